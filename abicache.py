@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+from decoding import load_abi
+from utils import get_logger
+
+"""
+Disk cache of the event entries of contract ABIs, so a start with hundreds of contracts does not parse every ABI again.
+Contract ABIs in the watchlist are JSON strings tens of kilobytes long, parsing them is most of the startup time while
+only their event entries are ever used. The cache maps the SHA-256 of the ABI string to its event entries, so an ABI
+edited in the watchlist is simply a new entry and the cache never needs to be invalidated.
+"""
+
+
+class AbiCache:
+
+    def __init__(self, path):
+        """
+        @param path: JSON file of the cache, created on the first flush
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.path = path
+        # content hash -> event name -> event ABI entry
+        self.entries = self.load(path)
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path) -> dict:
+        try:
+            with open(path, "rt") as fin:
+                return json.load(fin)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable ABI cache {}: {}".format(path, repr(e)))
+            return {}
+
+    @staticmethod
+    def content_hash(abi: str) -> str:
+        return hashlib.sha256(abi.encode()).hexdigest()
+
+    def event_abis(self, abi) -> dict:
+        """
+        @param abi: contract ABI, as a JSON string or an already parsed list
+        @return: event name -> ABI entry of the event, the first one for overloaded events
+        """
+        if not isinstance(abi, str):
+            # already parsed, nothing to save
+            return self.extract_events(abi)
+        key = self.content_hash(abi)
+        event_abis = self.entries.get(key)
+        if event_abis is not None:
+            self.hits += 1
+            return event_abis
+        self.misses += 1
+        event_abis = self.entries[key] = self.extract_events(load_abi(abi))
+        self.dirty = True
+        return event_abis
+
+    @staticmethod
+    def extract_events(abi: list) -> dict:
+        event_abis = {}
+        for entry in abi:
+            if entry.get("type") == "event":
+                event_abis.setdefault(entry.get("name"), entry)
+        return event_abis
+
+    def find_event_abi(self, abi, event_name: str) -> dict:
+        """
+        Same as decoding.find_event_abi, through the cache
+        """
+        event_abi = self.event_abis(abi).get(event_name)
+        if event_abi is None:
+            raise ValueError("Event {} not found in the contract ABI".format(event_name))
+        return event_abi
+
+    def flush(self):
+        """
+        Writes the new entries, merged with the ones other processes (shard workers) wrote meanwhile
+        """
+        if not self.dirty:
+            return
+        entries = self.load(self.path)
+        entries.update(self.entries)
+        temporary_path = self.path + ".tmp.{}".format(os.getpid())
+        with open(temporary_path, "wt") as fout:
+            json.dump(entries, fout)
+        os.replace(temporary_path, self.path)
+        self.entries = entries
+        self.dirty = False
+        self.logger.info("Saved ABI cache {} ({} hits, {} misses)".format(self.path, self.hits, self.misses))
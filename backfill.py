@@ -0,0 +1,195 @@
+import asyncio
+
+import aiohttp
+
+from utils import get_logger
+
+"""
+Historical backfill of logs over an integer block range.
+The range is split in chunks that are fetched with eth_getLogs by a bounded pool of concurrent workers. When the
+provider complains about the size of a result, the chunk is halved (and so is the size of all the following chunks).
+Rate limits and transient errors are retried on the same chunk with a doubling delay, the backfill only fails once a
+chunk used up its attempts.
+Logs are handed over strictly in (blockNumber, logIndex) order, regardless of the order in which chunks complete.
+"""
+
+
+class BackfillEngine:
+
+    CHUNK_SIZE = 2000
+    WORKERS = 8
+    # how many chunks past the oldest not yet handled chunk the workers may fetch, bounds the memory used
+    MAX_CHUNKS_AHEAD = 32
+    # fragments of the error messages providers use when a query covers too many logs or takes too long
+    RESULT_SIZE_ERROR_MARKERS = (
+        "query returned more than",
+        "response size exceeded",
+        "response size should not greater than",
+        "log response size",
+        "limit exceeded",
+        "block range",
+        "range is too large",
+        "too many logs",
+        "too many blocks",
+        "too many results",
+        "timeout",
+        "timed out",
+    )
+    # fragments of rate limiting errors, some of them look like result size errors ("limit exceeded") but a smaller
+    # chunk does not help with them
+    RATE_LIMIT_ERROR_MARKERS = ("too many requests", "rate limit", "request rate")
+    # fragments of other errors that go away by themselves
+    TRANSIENT_ERROR_MARKERS = ("try again", "temporarily unavailable", "service unavailable", "bad gateway")
+    # attempts of a chunk failing with rate limits or transient errors, with a doubling delay between them
+    MAX_FETCH_ATTEMPTS = 6
+    RETRY_BACKOFF_SECONDS = 1
+    MAX_RETRY_BACKOFF_SECONDS = 30
+
+    def __init__(self, w3i, chunk_size=CHUNK_SIZE, workers=WORKERS):
+        self.logger = get_logger(self.__class__.__name__)
+        self.w3i = w3i
+        self.initial_chunk_size = chunk_size
+        self.workers = workers
+
+    @classmethod
+    def is_result_size_error(cls, error: Exception) -> bool:
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        if getattr(error, "status", None) == 413:
+            return True
+        if getattr(error, "status", None) == 429:
+            return False
+        message = str(error).lower()
+        if any(marker in message for marker in cls.RATE_LIMIT_ERROR_MARKERS):
+            return False
+        return any(marker in message for marker in cls.RESULT_SIZE_ERROR_MARKERS)
+
+    @classmethod
+    def is_transient_error(cls, error: Exception) -> bool:
+        """
+        @return: True for rate limits, connection problems and unavailable providers, worth retrying as they are
+        """
+        if isinstance(error, (aiohttp.ClientError, OSError)):
+            return True
+        status = getattr(error, "status", None)
+        if status == 429 or (isinstance(status, int) and status >= 500):
+            return True
+        message = str(error).lower()
+        return any(marker in message for marker in cls.RATE_LIMIT_ERROR_MARKERS + cls.TRANSIENT_ERROR_MARKERS)
+
+    async def run(self, filter_params: dict, handle_log, from_block: int, to_block: int, on_chunk_done=None,
+                  handle_logs=None):
+        """
+        Fetches all logs matching filter_params between from_block and to_block (inclusive)
+        @param filter_params: eth_getLogs parameters without the block range (address, topics)
+        @param handle_log: coroutine function called with every formatted log entry, in order
+        @param from_block: first block of the range
+        @param to_block: last block of the range
+        @param on_chunk_done: optional function called with the last block of a chunk once all its logs are handled
+        @param handle_logs: optional coroutine function called with the ordered list of logs of each chunk, used
+        instead of handle_log
+        @return: number of handled logs
+        """
+        run = _BackfillRun(self, filter_params, handle_log, from_block, to_block, on_chunk_done, handle_logs)
+        self.logger.info("Backfilling blocks {}-{} for {}".format(from_block, to_block, filter_params))
+        await asyncio.gather(*[run.worker() for _ in range(self.workers)])
+        self.logger.info("Done backfilling blocks {}-{}: {} logs".format(from_block, to_block, run.handled_logs))
+        return run.handled_logs
+
+
+class _BackfillRun:
+    """
+    State of one backfill: the block cursor handing out chunks and the reorder buffer of fetched chunks
+    """
+    def __init__(self, engine: BackfillEngine, filter_params: dict, handle_log, from_block: int, to_block: int,
+                 on_chunk_done=None, handle_logs=None):
+        self.engine = engine
+        self.filter_params = filter_params
+        self.handle_log = handle_log
+        self.handle_logs = handle_logs
+        self.on_chunk_done = on_chunk_done
+        self.to_block = to_block
+        self.chunk_size = engine.initial_chunk_size
+        self.next_block = from_block
+        self.next_sequence = 0
+        self.next_sequence_to_handle = 0
+        self.fetched_chunks = {}
+        self.handled_logs = 0
+        self.failed = False
+        self.progress = asyncio.Condition()
+        self.handling = asyncio.Lock()
+
+    def next_chunk(self):
+        if self.next_block > self.to_block:
+            return None
+        chunk = (self.next_sequence, self.next_block, min(self.next_block + self.chunk_size - 1, self.to_block))
+        self.next_sequence += 1
+        self.next_block = chunk[2] + 1
+        return chunk
+
+    async def worker(self):
+        while True:
+            async with self.progress:
+                await self.progress.wait_for(self.can_fetch_ahead)
+                chunk = None if self.failed else self.next_chunk()
+            if chunk is None:
+                return
+            sequence, start, end = chunk
+            try:
+                log_entries = await self.fetch(start, end)
+                log_entries.sort(key=lambda log_entry: (log_entry['blockNumber'], log_entry['logIndex']))
+                self.fetched_chunks[sequence] = (end, log_entries)
+                await self.handle_ready_chunks()
+            except Exception:
+                # stops the other workers, the exception is propagated by run()
+                async with self.progress:
+                    self.failed = True
+                    self.progress.notify_all()
+                raise
+
+    def can_fetch_ahead(self):
+        return self.failed or self.next_sequence - self.next_sequence_to_handle < self.engine.MAX_CHUNKS_AHEAD
+
+    async def fetch(self, start: int, end: int) -> list:
+        attempt = 1
+        while True:
+            try:
+                return await self.engine.w3i.get_logs(dict(self.filter_params, fromBlock=start, toBlock=end))
+            except Exception as e:
+                if start != end and self.engine.is_result_size_error(e):
+                    break
+                if attempt >= self.engine.MAX_FETCH_ATTEMPTS or not self.engine.is_transient_error(e):
+                    raise
+                delay = min(self.engine.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1),
+                            self.engine.MAX_RETRY_BACKOFF_SECONDS)
+                self.engine.logger.warning("Fetching blocks {}-{} failed ({}), attempt {}/{}, retrying in {} "
+                                           "seconds".format(start, end, repr(e), attempt,
+                                                            self.engine.MAX_FETCH_ATTEMPTS, delay))
+                attempt += 1
+                await asyncio.sleep(delay)
+        self.chunk_size = max(1, min(self.chunk_size, (end - start + 1) // 2))
+        self.engine.logger.debug("Result too large for blocks {}-{}, chunk size lowered to {}".format(
+            start, end, self.chunk_size))
+        log_entries = []
+        while start <= end:
+            # the chunk size can be lowered further while fetching, so it is read again on each step
+            chunk_end = min(start + self.chunk_size - 1, end)
+            log_entries += await self.fetch(start, chunk_end)
+            start = chunk_end + 1
+        return log_entries
+
+    async def handle_ready_chunks(self):
+        async with self.handling:
+            while self.next_sequence_to_handle in self.fetched_chunks:
+                end, log_entries = self.fetched_chunks.pop(self.next_sequence_to_handle)
+                if self.handle_logs is not None:
+                    await self.handle_logs(log_entries)
+                else:
+                    for log_entry in log_entries:
+                        await self.handle_log(log_entry)
+                self.handled_logs += len(log_entries)
+                if self.on_chunk_done is not None:
+                    self.on_chunk_done(end)
+                async with self.progress:
+                    self.next_sequence_to_handle += 1
+                    self.progress.notify_all()
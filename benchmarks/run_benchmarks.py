@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is then not reported
+    resource = None
+
+from benchmarks.standins import FakeEthereumNode, InMemoryBroker, InMemoryRabbitPublisher, \
+    InMemoryAsyncRabbitPublisher, REPOSITORY_ROOT, synthetic_addresses
+
+"""
+End to end benchmark of the scraper against local stand-ins, no Ethereum node or RabbitMQ needed.
+
+Every scenario runs a real EventScraper, with the given settings, in a fresh process watching N synthetic contracts
+that all emit OrderFulfilled events. A FakeEthereumNode in the benchmark process produces blocks at a fixed rate and
+the scraper publishes to an in-memory broker. The report has, per scenario:
+ - events/sec delivered to the broker during the measured window, next to the rate the node offered
+ - end to end latency percentiles, from the block being produced to its event reaching the broker
+ - per stage latency percentiles (RPC calls, decoding, serialization, publishing), read from the scraper metrics
+ - the peak resident memory of the scraper process
+
+Usage:
+    python -m benchmarks.run_benchmarks --contracts 1,100,1000 --duration 20 --set CONSOLIDATE_FILTERS=true
+    python -m benchmarks.run_benchmarks --compare benchmark-results.json --output benchmark-new.json
+"""
+
+DEFAULT_OUTPUT = "benchmark-results.json"
+RABBITMQ_CONFIG = {"host": "localhost", "port": 5672, "exchange": "events", "routing_key": "events.all",
+                   "user": "guest", "password": "guest"}
+PERCENTILES = (50, 95, 99)
+
+
+def build_watchlist(addresses: list) -> dict:
+    """
+    @return: a watchlist with the OrderFulfilled event of every address, using the Seaport ABI of the repository
+    """
+    with open(os.path.join(REPOSITORY_ROOT, "contract-watchlist.json"), "rt") as fin:
+        seaport, = [contract_data for contract_data in json.load(fin)['contracts']
+                    if "OrderFulfilled" in contract_data['events_to_listen']]
+    return {"contracts": [{"address": address,
+                           "blockchain": seaport['blockchain'],
+                           "abi": seaport['abi'],
+                           "events_to_listen": {"OrderFulfilled": {"argument_filters": {"fromBlock": "latest"}}}}
+                          for address in addresses]}
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {"p{}".format(percentile): ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+               for percentile in PERCENTILES}
+    summary["max"] = ordered[-1]
+    summary["count"] = len(ordered)
+    return summary
+
+
+def histogram_percentiles(child) -> dict:
+    """
+    Estimates percentiles out of the buckets of a metrics histogram, interpolating linearly inside a bucket
+    """
+    total = sum(child.counts)
+    if not total:
+        return {}
+    summary = {}
+    for percentile in PERCENTILES:
+        rank = total * percentile / 100
+        cumulative = 0
+        lower_bound = 0.0
+        for upper_bound, count in zip(child.buckets + (float("inf"),), child.counts):
+            if count and cumulative + count >= rank:
+                if upper_bound == float("inf"):
+                    summary["p{}".format(percentile)] = lower_bound
+                else:
+                    summary["p{}".format(percentile)] = lower_bound + (upper_bound - lower_bound) * \
+                        (rank - cumulative) / count
+                break
+            cumulative += count
+            lower_bound = upper_bound
+    summary["mean"] = child.sum / total
+    summary["count"] = total
+    return summary
+
+
+def stage_latencies() -> dict:
+    """
+    @return: metric name (with labels) -> percentiles of every histogram the scraper observed values in
+    """
+    import metrics
+    stages = {}
+    for metric in metrics.REGISTRY.metrics:
+        if not isinstance(metric, metrics.Histogram):
+            continue
+        for label_values, child in list(metric._children.items()):
+            summary = histogram_percentiles(child)
+            if summary:
+                stages[metric.name + metrics.format_labels(metric.label_names, label_values)] = summary
+    return stages
+
+
+def peak_memory() -> dict:
+    """
+    @return: peak resident memory in MB of the process and of its largest child process (encoder pool workers)
+    """
+    if resource is None:
+        return {}
+    # kilobytes on Linux, bytes on macOS
+    unit = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            "peak_children_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+
+
+def run_scenario(endpoint: str, addresses: list, duration: float, overrides: dict) -> dict:
+    """
+    Runs the scraper for duration seconds after its filters are set up, in the process of the scenario
+    @return: the broker arrivals as (arrival time, block number), the stage latencies, the peak memory and timings
+    """
+    from main import EventScraper, configure_logging
+    from settings import ScraperSettings
+
+    class BenchmarkScraper(EventScraper):
+
+        def __init__(self, broker, *args, **kwargs):
+            self.broker = broker
+            self.measure_started_at = None
+            super().__init__(*args, **kwargs)
+            if self.async_publisher is not None:
+                self.async_publisher = InMemoryAsyncRabbitPublisher(
+                    broker, RABBITMQ_CONFIG,
+                    queue_size=self.settings.PUBLISH_QUEUE_SIZE,
+                    batch_size=self.settings.PUBLISH_BATCH_SIZE,
+                    max_unconfirmed=self.settings.PUBLISH_MAX_UNCONFIRMED,
+                    content_type=self.serializer.content_type)
+
+        def get_rabbit_connection(self, rabbitmq_config, content_type=None):
+            return InMemoryRabbitPublisher(self.broker, rabbitmq_config, content_type=content_type)
+
+        def create_filter_tasks(self, loop):
+            super().create_filter_tasks(loop)
+            self.start_measuring(loop)
+
+        def create_consolidated_filter_tasks(self, loop):
+            super().create_consolidated_filter_tasks(loop)
+            self.start_measuring(loop)
+
+        def create_subscription_tasks(self, loop):
+            super().create_subscription_tasks(loop)
+            self.start_measuring(loop)
+
+        def start_measuring(self, loop):
+            """
+            The measured window starts once every filter is set up and ends with the scraper
+            """
+            self.measure_started_at = time.time()
+            loop.call_later(duration, self.stop)
+
+        def stop(self):
+            for task in list(self.background_tasks):
+                task.cancel()
+
+    # the scraper logs every event, keep that off the benchmark output
+    sys.stdout = open(os.devnull, "w")
+    settings = ScraperSettings(**overrides)
+    configure_logging(settings)
+    setup_started_at = time.time()
+    broker = InMemoryBroker()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    event_scraper = BenchmarkScraper(broker, build_watchlist(addresses), RABBITMQ_CONFIG, endpoint, settings=settings)
+    event_scraper.setup_filters()
+    stopped_at = time.time()
+
+    if settings.MESSAGE_FORMAT == "cbor":
+        import cbor2
+        loads = cbor2.loads
+    else:
+        loads = json.loads
+    return {
+        "arrivals": [(arrival, loads(message)["event_data"]["blockNumber"])
+                     for arrival, message in zip(broker.arrivals, broker.messages)],
+        "setup_seconds": event_scraper.measure_started_at - setup_started_at,
+        "measure_started_at": event_scraper.measure_started_at,
+        "stopped_at": stopped_at,
+        "stages": stage_latencies(),
+        "memory": peak_memory(),
+    }
+
+
+def benchmark(contract_count: int, duration: float, logs_per_block: int, block_time: float, overrides: dict) -> dict:
+    """
+    Runs one scenario against a new fake node
+    @return: the results of the scenario
+    """
+    addresses = synthetic_addresses(contract_count)
+    node = FakeEthereumNode(addresses, logs_per_block, block_time)
+    endpoint = node.start()
+    context = multiprocessing.get_context("spawn")
+    try:
+        with tempfile.TemporaryDirectory() as work_directory, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                                       initializer=os.chdir, initargs=(work_directory,)) as executor:
+            outcome = executor.submit(run_scenario, endpoint, addresses, duration, overrides).result()
+    finally:
+        node.stop()
+
+    window_start, window_end = outcome["measure_started_at"], outcome["stopped_at"]
+    window = window_end - window_start
+    delivered = [(arrival, block_number) for arrival, block_number in outcome["arrivals"]
+                 if window_start <= arrival <= window_end]
+    # only blocks produced inside the window, the backlog of the setup would skew the latency
+    latencies = [arrival - node.block_times[block_number] for arrival, block_number in delivered
+                 if node.block_times.get(block_number, 0) >= window_start]
+    offered = sum(logs_per_block for produced_at in node.block_times.values()
+                  if window_start <= produced_at <= window_end)
+    return {
+        "contracts": contract_count,
+        "duration_seconds": window,
+        "setup_seconds": outcome["setup_seconds"],
+        "offered_events": offered,
+        "delivered_events": len(delivered),
+        "offered_events_per_second": offered / window if window > 0 else 0,
+        "events_per_second": len(delivered) / window if window > 0 else 0,
+        "end_to_end_latency_seconds": percentiles(latencies),
+        "stage_latencies": outcome["stages"],
+        "rpc_requests": dict(node.requests),
+        "memory": outcome["memory"],
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_overrides(assignments: list) -> dict:
+    """
+    @param assignments: KEY=VALUE strings, values are cast like the SCRAPER_* environment variables
+    """
+    from settings import ScraperSettings
+    environment = {}
+    for assignment in assignments:
+        name, separator, value = assignment.partition("=")
+        if not separator or not ScraperSettings.is_setting(name.strip()):
+            raise ValueError("Unknown scraper setting in --set {}".format(assignment))
+        environment[ScraperSettings.ENVIRONMENT_PREFIX + name.strip()] = value
+    settings = ScraperSettings.from_environment(environment)
+    return {name: getattr(settings, name) for name in ScraperSettings.setting_names()
+            if ScraperSettings.ENVIRONMENT_PREFIX + name in environment}
+
+
+def compare(previous: dict, current: dict) -> list:
+    """
+    @return: report lines with the change of the headline numbers of the scenarios both runs have
+    """
+    previous_scenarios = {scenario["contracts"]: scenario for scenario in previous["scenarios"]}
+    lines = []
+    for scenario in current["scenarios"]:
+        before = previous_scenarios.get(scenario["contracts"])
+        if before is None:
+            continue
+        for label, read in (("events/sec", lambda result: result["events_per_second"]),
+                            ("e2e p95 (s)", lambda result: result["end_to_end_latency_seconds"].get("p95")),
+                            ("peak RSS (MB)", lambda result: result["memory"].get("peak_rss_mb"))):
+            old_value, new_value = read(before), read(scenario)
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100 if old_value else 0
+            lines.append("{:>6} contracts  {:<14} {:>12.4f} -> {:>12.4f}  ({:+.1f}%)".format(
+                scenario["contracts"], label, old_value, new_value, change))
+    return lines
+
+
+def summary_line(result: dict) -> str:
+    latency = result["end_to_end_latency_seconds"]
+    return "{:>6} contracts  {:>9.1f} events/sec (offered {:.1f})  e2e p50 {}  p95 {}  p99 {}  peak RSS {} MB".format(
+        result["contracts"], result["events_per_second"], result["offered_events_per_second"],
+        *["{:.4f}".format(latency[key]) if key in latency else "-" for key in ("p50", "p95", "p99")],
+        "{:.1f}".format(result["memory"]["peak_rss_mb"]) if "peak_rss_mb" in result["memory"] else "-")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end benchmark of the scraper against local stand-ins")
+    parser.add_argument("--contracts", default="1,100,1000",
+                        help="comma separated numbers of watched contracts, one scenario each")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per scenario")
+    parser.add_argument("--logs-per-block", type=int, default=100, help="logs produced by the fake node per block")
+    parser.add_argument("--block-time", type=float, default=1.0, help="seconds between two blocks of the fake node")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="scraper setting of the run, e.g. --set CONSOLIDATE_FILTERS=true, can be repeated")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file the results are written to")
+    parser.add_argument("--compare", metavar="RESULTS", help="JSON results of a previous run to compare with")
+    arguments = parser.parse_args()
+
+    overrides = parse_overrides(arguments.overrides)
+    report = {
+        "started_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"duration_seconds": arguments.duration,
+                       "logs_per_block": arguments.logs_per_block,
+                       "block_time_seconds": arguments.block_time,
+                       "settings": overrides},
+        "scenarios": [],
+    }
+    for contract_count in [int(count) for count in arguments.contracts.split(",") if count.strip()]:
+        result = benchmark(contract_count, arguments.duration, arguments.logs_per_block, arguments.block_time,
+                           overrides)
+        report["scenarios"].append(result)
+        print(summary_line(result))
+
+    with open(arguments.output, "wt") as fout:
+        json.dump(report, fout, indent=2)
+    print("Results written to {}".format(arguments.output))
+
+    if arguments.compare:
+        with open(arguments.compare, "rt") as fin:
+            previous = json.load(fin)
+        print("Compared with {} ({})".format(arguments.compare, previous.get("git_commit")))
+        for line in compare(previous, report):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import types
+
+import pika
+from aiohttp import web
+from eth_abi import encode_abi
+from web3 import Web3
+
+from distribution import RabbitPublisher, AsyncRabbitPublisher
+
+"""
+Local stand-ins for the two external systems the scraper talks to.
+
+FakeEthereumNode is a JSON-RPC endpoint producing a block every block_time seconds, each with logs_per_block synthetic
+OrderFulfilled logs (built from tests/example.OrderFulfilled.json) spread over the watched contracts. It implements
+the filter and log methods the scraper uses, with batches, and remembers when each block was produced so end to end
+latencies can be measured.
+
+InMemoryBroker replaces RabbitMQ: the publishers are the real ones, only their channel is swapped for an in-process
+channel that records every message with its arrival time and acks it right away when publisher confirms are on.
+"""
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORDER_FULFILLED_SIGNATURE = "OrderFulfilled(bytes32,address,address,address,(uint8,address,uint256,uint256)[]," \
+                            "(uint8,address,uint256,uint256,address)[])"
+
+
+def load_example_message() -> dict:
+    with open(os.path.join(REPOSITORY_ROOT, "tests", "example.OrderFulfilled.json"), "rt") as fin:
+        return json.load(fin)
+
+
+def order_fulfilled_template() -> dict:
+    """
+    @return: the raw OrderFulfilled log the example message was decoded from
+    """
+    event_data = load_example_message()["event_data"]
+    args = event_data["args"]
+    data = encode_abi(["bytes32", "address", "(uint8,address,uint256,uint256)[]",
+                       "(uint8,address,uint256,uint256,address)[]"],
+                      [bytes.fromhex(args["orderHash"][2:]), args["recipient"],
+                       [tuple(item) for item in args["offer"]], [tuple(item) for item in args["consideration"]]])
+    return {
+        "address": event_data["address"].lower(),
+        "topics": [Web3.keccak(text=ORDER_FULFILLED_SIGNATURE).hex(),
+                   "0x" + args["offerer"][2:].lower().rjust(64, "0"),
+                   "0x" + args["zone"][2:].lower().rjust(64, "0")],
+        "data": "0x" + data.hex(),
+        "blockNumber": hex(event_data["blockNumber"]),
+        "blockHash": event_data["blockHash"],
+        "transactionHash": event_data["transactionHash"],
+        "transactionIndex": hex(event_data["transactionIndex"]),
+        "logIndex": hex(event_data["logIndex"]),
+        "removed": False,
+    }
+
+
+def synthetic_addresses(count: int) -> list:
+    return [Web3.toChecksumAddress("0x{:040x}".format(0x5ea9047 * (index + 1))) for index in range(count)]
+
+
+def parse_block(value, head_block: int) -> int:
+    if value is None or value in ("latest", "pending"):
+        return head_block
+    if value == "earliest":
+        return 0
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+class LogMatcher:
+    """
+    The address and topic0 part of eth_newFilter/eth_getLogs parameters
+    """
+    def __init__(self, params: dict):
+        addresses = params.get("address")
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.addresses = {address.lower() for address in addresses} if addresses else None
+        topics = params.get("topics") or [None]
+        topic0 = topics[0]
+        if isinstance(topic0, str):
+            topic0 = [topic0]
+        self.topic0 = {topic.lower() for topic in topic0} if topic0 else None
+
+    def select(self, logs_by_address: dict) -> list:
+        if self.addresses is None:
+            candidates = [log for logs in logs_by_address.values() for log in logs]
+        else:
+            candidates = [log for address in self.addresses for log in logs_by_address.get(address, ())]
+        if self.topic0 is not None:
+            candidates = [log for log in candidates if log["topics"][0] in self.topic0]
+        return sorted(candidates, key=lambda log: int(log["logIndex"], 16))
+
+
+class FakeEthereumNode:
+
+    FIRST_BLOCK = 15201653
+    # produced blocks kept in memory for eth_getLogs and late filter polls
+    KEPT_BLOCKS = 5000
+
+    def __init__(self, contracts: list, logs_per_block: int, block_time: float):
+        """
+        @param contracts: addresses the synthetic logs are spread over
+        @param logs_per_block: logs produced in every block
+        @param block_time: seconds between two blocks
+        """
+        self.contracts = [address.lower() for address in contracts]
+        self.logs_per_block = logs_per_block
+        self.block_time = block_time
+        self.template = order_fulfilled_template()
+        self.head_block = self.FIRST_BLOCK
+        # block number -> address -> raw logs
+        self.blocks = {}
+        # block number -> wall clock time the block was produced at
+        self.block_times = {}
+        self.filters = {}
+        self.requests = {}
+        self.produced_logs = 0
+        self.endpoint = None
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._started = threading.Event()
+
+    def produce_block(self):
+        block_number = self.head_block + 1
+        block_hash = "0x{:064x}".format(block_number)
+        logs_by_address = {}
+        for log_index in range(self.logs_per_block):
+            address = self.contracts[(block_number * self.logs_per_block + log_index) % len(self.contracts)]
+            raw_log = dict(self.template,
+                           address=address,
+                           blockNumber=hex(block_number),
+                           blockHash=block_hash,
+                           transactionHash="0x{:048x}{:016x}".format(block_number, log_index),
+                           transactionIndex=hex(log_index),
+                           logIndex=hex(log_index))
+            logs_by_address.setdefault(address, []).append(raw_log)
+        self.blocks[block_number] = logs_by_address
+        self.blocks.pop(block_number - self.KEPT_BLOCKS, None)
+        self.block_times[block_number] = time.time()
+        self.produced_logs += self.logs_per_block
+        self.head_block = block_number
+
+    async def produce_blocks(self):
+        next_block_at = time.monotonic()
+        while True:
+            next_block_at += self.block_time
+            await asyncio.sleep(max(0.0, next_block_at - time.monotonic()))
+            self.produce_block()
+
+    def logs_between(self, matcher: LogMatcher, from_block: int, to_block: int) -> list:
+        logs = []
+        for block_number in range(max(from_block, self.head_block - self.KEPT_BLOCKS + 1), to_block + 1):
+            logs_by_address = self.blocks.get(block_number)
+            if logs_by_address:
+                logs += matcher.select(logs_by_address)
+        return logs
+
+    def answer(self, request: dict) -> dict:
+        method = request.get("method")
+        params = request.get("params") or []
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if method == "web3_clientVersion":
+            result = "FakeEthereumNode/v1"
+        elif method in ("eth_chainId", "net_version"):
+            result = "0x1" if method == "eth_chainId" else "1"
+        elif method == "eth_blockNumber":
+            result = hex(self.head_block)
+        elif method == "eth_newFilter":
+            filter_id = hex(len(self.filters) + 1)
+            filter_params = params[0] if params else {}
+            from_block = filter_params.get("fromBlock")
+            # like a real node, a filter from the latest block only returns logs of the blocks after its creation
+            polled_block = self.head_block if from_block in (None, "latest", "pending") else \
+                parse_block(from_block, self.head_block) - 1
+            self.filters[filter_id] = [LogMatcher(filter_params), polled_block]
+            result = filter_id
+        elif method == "eth_getFilterChanges":
+            log_filter = self.filters.get(params[0])
+            if log_filter is None:
+                return {"jsonrpc": "2.0", "id": request.get("id"),
+                        "error": {"code": -32000, "message": "filter not found"}}
+            matcher, polled_block = log_filter
+            head_block = self.head_block
+            result = self.logs_between(matcher, polled_block + 1, head_block)
+            log_filter[1] = head_block
+        elif method == "eth_uninstallFilter":
+            result = self.filters.pop(params[0], None) is not None
+        elif method == "eth_getLogs":
+            head_block = self.head_block
+            result = self.logs_between(LogMatcher(params[0]), parse_block(params[0].get("fromBlock"), head_block),
+                                       parse_block(params[0].get("toBlock"), head_block))
+        else:
+            return {"jsonrpc": "2.0", "id": request.get("id"),
+                    "error": {"code": -32601, "message": "the method {} does not exist".format(method)}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    async def serve(self, request):
+        payload = json.loads(await request.read())
+        if isinstance(payload, list):
+            return web.json_response([self.answer(item) for item in payload])
+        return web.json_response(self.answer(payload))
+
+    def start(self) -> str:
+        """
+        Starts the node on its own thread
+        @return: the HTTP endpoint of the node
+        """
+        self._thread = threading.Thread(target=self._run, name="fake-ethereum-node", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self.endpoint
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        application = web.Application(client_max_size=64 * 1024 ** 2)
+        application.router.add_post("/", self.serve)
+        self._runner = web.AppRunner(application, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.endpoint = "http://127.0.0.1:{}/".format(self._runner.addresses[0][1])
+        producer = self._loop.create_task(self.produce_blocks())
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            producer.cancel()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+class InMemoryBroker:
+    """
+    Collects the published messages with their arrival time
+    """
+    def __init__(self):
+        self.arrivals = []
+        self.messages = []
+
+    def receive(self, body):
+        self.arrivals.append(time.time())
+        self.messages.append(body)
+
+
+class InMemoryChannel:
+
+    def __init__(self, broker: InMemoryBroker, on_delivery_confirmation=None):
+        self.broker = broker
+        self.on_delivery_confirmation = on_delivery_confirmation
+        self.delivery_tag = 0
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.broker.receive(body)
+        self.delivery_tag += 1
+        if self.on_delivery_confirmation is not None:
+            confirmation = types.SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=self.delivery_tag))
+            asyncio.get_running_loop().call_soon(self.on_delivery_confirmation, confirmation)
+
+
+class InMemoryRabbitPublisher(RabbitPublisher):
+
+    def __init__(self, broker: InMemoryBroker, config, content_type=None):
+        self.broker = broker
+        super().__init__(config, content_type)
+
+    def create_channel(self):
+        return InMemoryChannel(self.broker)
+
+
+class InMemoryAsyncRabbitPublisher(AsyncRabbitPublisher):
+
+    def __init__(self, broker: InMemoryBroker, config, **kwargs):
+        self.broker = broker
+        super().__init__(config, **kwargs)
+
+    async def connect(self):
+        self._delivery_tag = 0
+        self._channel = InMemoryChannel(self.broker, self.on_delivery_confirmation)
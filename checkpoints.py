@@ -0,0 +1,99 @@
+import sqlite3
+
+from utils import get_logger
+
+"""
+Durable record of how far the scraper got, per contract event.
+A checkpoint is the last block whose events have all been published for that (contract, event). Checkpoints are kept
+in memory while running and written to a local SQLite file in one transaction by flush(), so the hot path never
+touches the disk. On startup the scraper resumes every event from its checkpoint + 1.
+"""
+
+
+class CheckpointStore:
+
+    def __init__(self, path):
+        self.logger = get_logger(self.__class__.__name__)
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS checkpoints ("
+                                 "address TEXT NOT NULL, "
+                                 "event_name TEXT NOT NULL, "
+                                 "block_number INTEGER NOT NULL, "
+                                 "PRIMARY KEY (address, event_name))")
+        self._connection.commit()
+        self._checkpoints = {
+            (address, event_name): block_number
+            for address, event_name, block_number in self._connection.execute(
+                "SELECT address, event_name, block_number FROM checkpoints")
+        }
+        self._dirty = {}
+        self.logger.info("Loaded {} checkpoints from {}".format(len(self._checkpoints), path))
+
+    def get(self, address, event_name):
+        """
+        @return: the last fully published block for the contract event, None if it was never published
+        """
+        return self._checkpoints.get((address, event_name))
+
+    def record(self, address, event_name, block_number):
+        """
+        Marks block_number as fully published for the contract event. Checkpoints never move backwards
+        """
+        key = (address, event_name)
+        current = self._checkpoints.get(key)
+        if current is not None and current >= block_number:
+            return
+        self._checkpoints[key] = block_number
+        self._dirty[key] = block_number
+
+    def merge_from(self, path, keys=None):
+        """
+        Takes over the checkpoints of another store, e.g. the one of the shard that watched a contract before a
+        rebalance. The newest checkpoint wins
+        @param path: SQLite file of the other store, opened read only
+        @param keys: (address, event_name) pairs to take over, all of them when None
+        @return: number of checkpoints that moved forward
+        """
+        connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        try:
+            rows = connection.execute("SELECT address, event_name, block_number FROM checkpoints").fetchall()
+        except sqlite3.OperationalError:
+            # the other store was created but never written
+            rows = []
+        finally:
+            connection.close()
+        merged = 0
+        for address, event_name, block_number in rows:
+            if keys is not None and (address, event_name) not in keys:
+                continue
+            current = self.get(address, event_name)
+            if current is None or current < block_number:
+                self.record(address, event_name, block_number)
+                merged += 1
+        return merged
+
+    def pending_changes(self):
+        """
+        @return: the checkpoints recorded since the last flush, to be passed to flush()
+        """
+        changes, self._dirty = self._dirty, {}
+        return changes
+
+    def flush(self, changes=None):
+        """
+        Writes checkpoints to disk in a single transaction
+        @param changes: the result of an earlier pending_changes() call, all pending changes when None
+        """
+        if changes is None:
+            changes = self.pending_changes()
+        if not changes:
+            return
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO checkpoints (address, event_name, block_number) VALUES (?, ?, ?) "
+                "ON CONFLICT (address, event_name) DO UPDATE SET block_number = MAX(block_number, excluded.block_number)",
+                [(address, event_name, block_number) for (address, event_name), block_number in changes.items()])
+
+    def close(self):
+        self._connection.close()
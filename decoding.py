@@ -0,0 +1,161 @@
+import functools
+import json
+
+from eth_abi.decoding import ContextFramesBytesIO, TupleDecoder
+from eth_abi.grammar import TupleType, parse
+from eth_abi.registry import registry
+from eth_utils import to_checksum_address
+from web3._utils.abi import collapse_if_tuple
+from web3._utils.events import event_abi_to_log_topic
+
+from serialization import to_plain
+
+"""
+Precompiled event decoders.
+Each watched event ABI is compiled once into the eth_abi decoders of its topics and data, plus a converter per argument
+type, and logs are decoded straight into the plain dict layout of the published messages (checksum addresses,
+0x prefixed hex strings for bytes, lists for arrays and structs). This skips building a web3 contract out of the
+whole ABI and the generic per-log machinery of processLog (ABI lookups, type string parsing, AttributeDict copies).
+Decoders are shared between contracts with the same event ABI, e.g. the Transfer event of every ERC-20 token.
+"""
+
+
+@functools.lru_cache(maxsize=65536)
+def checksum_address(address):
+    return to_checksum_address(address)
+
+
+def _identity(value):
+    return value
+
+
+def _hex_bytes(value):
+    return "0x" + value.hex()
+
+
+def compile_converter(abi_type):
+    """
+    Builds the function turning a value decoded by eth_abi into its message representation
+    @param abi_type: parsed eth_abi type
+    @return: the converter, None when the decoded value is used as is
+    """
+    if abi_type.is_array:
+        convert_item = compile_converter(abi_type.item_type)
+        if convert_item is None:
+            return list
+        return lambda values: [convert_item(value) for value in values]
+    if isinstance(abi_type, TupleType):
+        converters = [compile_converter(component) or _identity for component in abi_type.components]
+        return lambda values: [convert(value) for convert, value in zip(converters, values)]
+    if abi_type.base == "address":
+        return checksum_address
+    if abi_type.base == "bytes":
+        return _hex_bytes
+    return None
+
+
+def _as_bytes(value):
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+
+@functools.lru_cache(maxsize=None)
+def load_abi(abi: str) -> list:
+    """
+    Parses a contract ABI given as a JSON string, once per distinct ABI. The result must not be modified
+    """
+    return json.loads(abi)
+
+
+def find_event_abi(abi, event_name: str) -> dict:
+    """
+    @param abi: contract ABI, as a JSON string or an already parsed list
+    @return: the ABI entry of the event
+    """
+    if isinstance(abi, str):
+        abi = load_abi(abi)
+    for entry in abi:
+        if entry.get("type") == "event" and entry.get("name") == event_name:
+            return entry
+    raise ValueError("Event {} not found in the contract ABI".format(event_name))
+
+
+class EventDecoder:
+
+    _decoders = {}
+
+    def __init__(self, event_abi: dict):
+        self.event_abi = event_abi
+        self.key = self.abi_key(event_abi)
+        self.event_name = event_abi["name"]
+        self.topic0 = bytes(event_abi_to_log_topic(event_abi))
+        # anonymous events do not carry their signature as the first topic
+        self.topics_offset = 0 if event_abi.get("anonymous") else 1
+
+        self.topic_names = []
+        self.topic_decoders = []
+        self.topic_converters = []
+        data_names = []
+        data_types = []
+        self.data_converters = []
+        for event_input in event_abi["inputs"]:
+            abi_type = parse(collapse_if_tuple(event_input))
+            if event_input.get("indexed"):
+                if abi_type.is_dynamic or abi_type.is_array or isinstance(abi_type, TupleType):
+                    # only the hash of indexed dynamic values is logged
+                    abi_type = parse("bytes32")
+                self.topic_names.append(event_input["name"])
+                self.topic_decoders.append(registry.get_decoder(abi_type.to_type_str()))
+                self.topic_converters.append(compile_converter(abi_type) or _identity)
+            else:
+                data_names.append(event_input["name"])
+                data_types.append(abi_type.to_type_str())
+                self.data_converters.append(compile_converter(abi_type) or _identity)
+        self.data_names = data_names
+        self.data_decoder = TupleDecoder(decoders=[registry.get_decoder(data_type) for data_type in data_types])
+
+    @staticmethod
+    def abi_key(event_abi: dict) -> str:
+        return json.dumps(event_abi, sort_keys=True)
+
+    @classmethod
+    def for_abi(cls, event_abi: dict, key=None) -> "EventDecoder":
+        """
+        @param key: the abi_key of the event ABI when already known
+        @return: the decoder of the event ABI, compiled on first use and shared afterwards
+        """
+        if key is None:
+            key = cls.abi_key(event_abi)
+        decoder = cls._decoders.get(key)
+        if decoder is None:
+            decoder = cls._decoders[key] = cls(event_abi)
+        return decoder
+
+    def decode(self, log_entry) -> dict:
+        """
+        Decodes a formatted log entry into the same layout web3's processLog gives once made serializable
+        @param log_entry: log entry as formatted by web3 (HexBytes topics and hashes, int numbers)
+        @return: plain dict with args, event and the log location fields
+        """
+        topics = log_entry["topics"][self.topics_offset:]
+        if len(topics) != len(self.topic_decoders):
+            raise ValueError("Expected {} indexed arguments for event {}, the log has {} topics".format(
+                len(self.topic_decoders), self.event_name, len(log_entry["topics"])))
+        args = {}
+        for name, decoder, convert, topic in zip(self.topic_names, self.topic_decoders, self.topic_converters,
+                                                 topics):
+            args[name] = convert(decoder(ContextFramesBytesIO(_as_bytes(topic))))
+        values = self.data_decoder(ContextFramesBytesIO(_as_bytes(log_entry["data"])))
+        for name, convert, value in zip(self.data_names, self.data_converters, values):
+            args[name] = convert(value)
+        return {
+            "args": args,
+            "event": self.event_name,
+            "logIndex": log_entry["logIndex"],
+            "transactionIndex": log_entry["transactionIndex"],
+            "transactionHash": to_plain(log_entry["transactionHash"]),
+            "address": log_entry["address"],
+            "blockHash": to_plain(log_entry["blockHash"]),
+            "blockNumber": log_entry["blockNumber"],
+        }
@@ -0,0 +1,123 @@
+import hashlib
+import heapq
+import math
+
+from web3.types import LogReceipt
+
+"""
+Duplicate suppression for at-least-once delivery.
+The same log can be received more than once: a filter created again after the node dropped it, a websocket
+reconnection, a catch up overlapping the live filter. Logs are identified by (blockHash, transactionHash, logIndex), so
+the same log in a reorganised block, with another block hash, is not taken for a duplicate.
+
+Identifiers are kept exactly for the last window_blocks blocks below the highest block seen, older blocks are evicted
+as the chain moves so memory depends on the window and not on the uptime. Optionally, evicted identifiers go into a
+bloom filter, remembering a much longer history in a fixed amount of memory at the cost of a small rate of false
+positives (logs wrongly taken for duplicates). The bloom filter has two generations: when the current one is full the
+previous one is dropped.
+"""
+
+
+def log_identifier(log_entry: LogReceipt) -> tuple:
+    return bytes(log_entry['blockHash']), bytes(log_entry['transactionHash']), log_entry['logIndex']
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        @param capacity: number of items the filter holds at the given error rate
+        @param error_rate: probability of an item never added to be reported as present
+        """
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+    def add(self, item: bytes):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class DuplicateFilter:
+
+    def __init__(self, window_blocks: int, bloom_capacity=0, bloom_error_rate=0.001):
+        """
+        @param window_blocks: number of blocks below the highest block seen whose log identifiers are kept exactly
+        @param bloom_capacity: identifiers remembered by each generation of the bloom filter, 0 disables it
+        @param bloom_error_rate: false positive rate of the bloom filter
+        """
+        self.window_blocks = window_blocks
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        # block number -> identifiers of the logs seen in that block
+        self.blocks = {}
+        self.block_heap = []
+        self.highest_block = None
+        self.bloom_filters = []
+        if bloom_capacity:
+            self.bloom_filters = [BloomFilter(bloom_capacity, bloom_error_rate)]
+
+    def __len__(self):
+        return sum(len(identifiers) for identifiers in self.blocks.values())
+
+    def is_duplicate(self, log_entry: LogReceipt) -> bool:
+        """
+        Records the log and tells whether it was seen before
+        """
+        block_number = log_entry['blockNumber']
+        identifier = log_identifier(log_entry)
+        if self.highest_block is not None and block_number <= self.highest_block - self.window_blocks:
+            # older than the exact window, only the bloom filter remembers it
+            if not self.bloom_filters:
+                return False
+            item = self.bloom_item(identifier)
+            if any(item in bloom_filter for bloom_filter in self.bloom_filters):
+                return True
+            self.remember(item)
+            return False
+
+        identifiers = self.blocks.get(block_number)
+        if identifiers is None:
+            identifiers = self.blocks[block_number] = set()
+            heapq.heappush(self.block_heap, block_number)
+        elif identifier in identifiers:
+            return True
+        identifiers.add(identifier)
+        if self.highest_block is None or block_number > self.highest_block:
+            self.highest_block = block_number
+            self.evict()
+        return False
+
+    def evict(self):
+        """
+        Drops the blocks that left the window, their identifiers move to the bloom filter when there is one
+        """
+        while self.block_heap and self.block_heap[0] <= self.highest_block - self.window_blocks:
+            identifiers = self.blocks.pop(heapq.heappop(self.block_heap))
+            if self.bloom_filters:
+                for identifier in identifiers:
+                    self.remember(self.bloom_item(identifier))
+
+    @staticmethod
+    def bloom_item(identifier: tuple) -> bytes:
+        block_hash, transaction_hash, log_index = identifier
+        return b"".join((block_hash, transaction_hash, log_index.to_bytes(8, "big")))
+
+    def remember(self, item: bytes):
+        current = self.bloom_filters[-1]
+        if current.count >= self.bloom_capacity:
+            current = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            # the previous generation is dropped, memory stays at two filters
+            self.bloom_filters = [self.bloom_filters[-1], current]
+        current.add(item)
@@ -1,5 +1,11 @@
+import asyncio
+import collections
+
 import pika
-from utils import get_logger
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+import metrics
+from utils import get_logger, PER_EVENT
 
 
 """
@@ -9,11 +15,23 @@ Modified from https://medium.com/@rahulsamant_2674/python-rabbitmq-8c1c3b79ab3d
 
 
 class RabbitPublisher:
-    def __init__(self, config):
+    """
+    Blocking publisher. The channel is in confirm mode: publish returns once the broker took the message and raises
+    when it refused it or the connection is gone, so the message can be spooled
+    """
+
+    # interval the broker and the publisher check each other with, a dead connection is noticed after two of them
+    HEARTBEAT_SECONDS = 60
+
+    def __init__(self, config, content_type=None, heartbeat=HEARTBEAT_SECONDS):
         self.logger = get_logger(self.__class__.__name__)
         self.config = config
+        self.heartbeat = heartbeat
         self._routing_key = config.get("routing_key")
+        self._properties = pika.BasicProperties(content_type=content_type) if content_type else None
         self._channel = self.create_channel()
+        # cleared when a publish fails, see reconnect
+        self.connected = True
 
     def publish(self, message, routing_key=None):
         if not routing_key:
@@ -22,15 +40,21 @@ class RabbitPublisher:
             routing_key = self._routing_key
 
         # Publishes message to the exchange with the given routing key
-        self._channel.basic_publish(exchange=self.config["exchange"], routing_key=routing_key, body=message)
-        self.logger.debug("Sent message {} on routing key {}".format(message, routing_key))
+        try:
+            self._channel.basic_publish(exchange=self.config["exchange"], routing_key=routing_key, body=message,
+                                        properties=self._properties)
+        except Exception:
+            self.connected = False
+            raise
+        # arguments are only formatted when the record is written, not for sampled out records
+        self.logger.debug("Sent message %s on routing key %s", message, routing_key, extra=PER_EVENT)
 
     def create_connection(self):
         param = pika.ConnectionParameters(host=self.config["host"],
                                           port=self.config["port"],
                                           credentials=pika.PlainCredentials(self.config["user"],
                                                                             self.config["password"]),
-                                          heartbeat=0)  # no timeout, possibly an issue
+                                          heartbeat=self.heartbeat)
         return pika.BlockingConnection(param)
 
     def create_channel(self):
@@ -47,4 +71,275 @@ class RabbitPublisher:
                                  exchange_type="topic",
                                  durable=True,
                                  auto_delete=False)
+        # basic_publish waits for the broker to ack the message and raises NackError when it does not
+        channel.confirm_delivery()
         return channel
+
+    def keep_alive(self):
+        """
+        The blocking connection only answers heartbeats while it is used, to be called at least once per heartbeat
+        interval when no message is published. Run on the thread that publishes
+        """
+        connection = getattr(self._channel, "connection", None)
+        if connection is None or not self.connected:
+            return
+        try:
+            connection.process_data_events(time_limit=0)
+        except Exception as e:
+            self.connected = False
+            self.logger.warning("RabbitMQ connection lost: {}".format(repr(e)))
+
+    def reconnect(self):
+        """
+        Replaces the connection and the channel, e.g. after the broker went away
+        """
+        self.close()
+        self._channel = self.create_channel()
+        self.connected = True
+
+    def close(self):
+        connection = getattr(self._channel, "connection", None)
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception as e:
+                self.logger.debug("Could not close the RabbitMQ connection: {}".format(repr(e)))
+
+
+class AsyncRabbitPublisher:
+    """
+    Pipelined publisher running on the scraper event loop.
+    Messages are put on a bounded in-memory queue (the producers wait when it is full, which is the backpressure
+    towards the pollers), drained in batches and published back to back without waiting for the broker in between.
+    Publisher confirms are tracked per delivery tag; nacked messages and messages still unconfirmed when the connection
+    drops are published again, so delivery is at-least-once.
+    """
+
+    QUEUE_SIZE = 10000
+    BATCH_SIZE = 500
+    MAX_UNCONFIRMED = 5000
+    RECONNECT_DELAY_SECONDS = 1
+    MAX_RECONNECT_DELAY_SECONDS = 30
+
+    def __init__(self, config, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, max_unconfirmed=MAX_UNCONFIRMED,
+                 content_type="application/json"):
+        self.logger = get_logger(self.__class__.__name__)
+        self.config = config
+        self._routing_key = config.get("routing_key")
+        self.batch_size = batch_size
+        self.max_unconfirmed = max_unconfirmed
+        self.properties = pika.BasicProperties(content_type=content_type, delivery_mode=pika.DeliveryMode.Persistent)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # messages to publish again before anything new from the queue, (sequence, routing_key, message) tuples
+        self.retry = collections.deque()
+        # delivery tag -> (sequence, routing_key, message), in publishing order
+        self.unconfirmed = collections.OrderedDict()
+        # delivery tag -> event loop time of the publish, for the confirmation latency
+        self.published_at = {}
+        # sequence numbers of the messages accepted by publish() and not yet confirmed by the broker
+        self.pending_sequences = set()
+        self.last_sequence = 0
+        self.confirmed_count = 0
+        self._delivery_tag = 0
+        self._connection = None
+        self._channel = None
+        self._closing = False
+        self._progress = asyncio.Condition()
+
+    @property
+    def depth(self):
+        """
+        @return: number of messages accepted but not yet confirmed by the broker
+        """
+        return len(self.pending_sequences)
+
+    @property
+    def is_connected(self):
+        return self._channel is not None
+
+    def is_confirmed_through(self, sequence):
+        """
+        @return: True when every message up to the given sequence number has been confirmed by the broker
+        """
+        return not self.pending_sequences or min(self.pending_sequences) > sequence
+
+    async def publish(self, message, routing_key=None):
+        """
+        Queues a message for publishing, waits while the queue is full
+        @return: the sequence number of the message, see is_confirmed_through
+        """
+        if not routing_key:
+            if not self._routing_key:
+                raise ValueError("A routing key needs to be set either in config or in publish")
+            routing_key = self._routing_key
+        self.last_sequence += 1
+        sequence = self.last_sequence
+        self.pending_sequences.add(sequence)
+        try:
+            await self.queue.put((sequence, routing_key, message))
+        except asyncio.CancelledError:
+            # cancelled while the queue was full, the message was never queued
+            self.pending_sequences.discard(sequence)
+            raise
+        return sequence
+
+    async def connect(self):
+        """
+        Opens the connection and a channel in confirm mode, declaring the exchange like RabbitPublisher does
+        """
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+
+        def on_open_error(connection, error):
+            if not opened.done():
+                opened.set_exception(ConnectionError(error))
+
+        self._connection = AsyncioConnection(parameters=self.create_connection_parameters(),
+                                             on_open_callback=lambda connection: opened.set_result(connection),
+                                             on_open_error_callback=on_open_error,
+                                             on_close_callback=self.on_connection_closed,
+                                             custom_ioloop=loop)
+        await opened
+
+        channel = await self.wait_callback(lambda callback: self._connection.channel(on_open_callback=callback))
+        channel.add_on_close_callback(self.on_channel_closed)
+        await self.wait_callback(lambda callback: channel.exchange_declare(exchange=self.config["exchange"],
+                                                                           exchange_type="topic",
+                                                                           durable=True,
+                                                                           auto_delete=False,
+                                                                           callback=callback))
+        await self.wait_callback(lambda callback: channel.confirm_delivery(self.on_delivery_confirmation,
+                                                                           callback=callback))
+        self._delivery_tag = 0
+        self._channel = channel
+        self.logger.info("Connected to RabbitMQ {}:{} with publisher confirms".format(
+            self.config["host"], self.config["port"]))
+
+    @staticmethod
+    async def wait_callback(operation):
+        future = asyncio.get_running_loop().create_future()
+        operation(lambda result: future.done() or future.set_result(result))
+        return await future
+
+    def create_connection_parameters(self):
+        return pika.ConnectionParameters(host=self.config["host"],
+                                         port=self.config["port"],
+                                         credentials=pika.PlainCredentials(self.config["user"],
+                                                                           self.config["password"]))
+
+    async def run(self):
+        """
+        Drains the queue in batches for as long as the scraper runs, reconnecting when the broker goes away
+        """
+        reconnect_delay = self.RECONNECT_DELAY_SECONDS
+        while True:
+            if self._channel is None:
+                try:
+                    await self.connect()
+                    reconnect_delay = self.RECONNECT_DELAY_SECONDS
+                except Exception:
+                    self.logger.exception("Could not connect to RabbitMQ, retrying in {} seconds".format(
+                        reconnect_delay))
+                    await asyncio.sleep(reconnect_delay)
+                    reconnect_delay = min(reconnect_delay * 2, self.MAX_RECONNECT_DELAY_SECONDS)
+                    continue
+            await self.publish_batch(await self.next_batch())
+
+    async def next_batch(self):
+        if not self.retry:
+            self.retry.append(await self.queue.get())
+        batch = []
+        while self.retry and len(batch) < self.batch_size:
+            batch.append(self.retry.popleft())
+        while not self.queue.empty() and len(batch) < self.batch_size:
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def publish_batch(self, batch):
+        async with self._progress:
+            await self._progress.wait_for(
+                lambda: self._channel is None or len(self.unconfirmed) + len(batch) <= self.max_unconfirmed)
+        published_at = asyncio.get_running_loop().time()
+        for position, (sequence, routing_key, message) in enumerate(batch):
+            if self._channel is None:
+                # connection lost in the middle of the batch, the rest goes out after reconnecting
+                self.retry.extendleft(reversed(batch[position:]))
+                return
+            self._channel.basic_publish(exchange=self.config["exchange"], routing_key=routing_key,
+                                        body=message, properties=self.properties)
+            self._delivery_tag += 1
+            self.unconfirmed[self._delivery_tag] = (sequence, routing_key, message)
+            self.published_at[self._delivery_tag] = published_at
+        self.logger.debug("Published batch of {} messages, {} unconfirmed".format(len(batch), len(self.unconfirmed)),
+                          extra=PER_EVENT)
+
+    def on_delivery_confirmation(self, method_frame):
+        confirmation = method_frame.method
+        if confirmation.multiple:
+            delivery_tags = []
+            for delivery_tag in self.unconfirmed:
+                if delivery_tag > confirmation.delivery_tag:
+                    break
+                delivery_tags.append(delivery_tag)
+        else:
+            delivery_tags = [confirmation.delivery_tag]
+
+        is_nack = isinstance(confirmation, pika.spec.Basic.Nack)
+        now = asyncio.get_running_loop().time()
+        for delivery_tag in delivery_tags:
+            message = self.unconfirmed.pop(delivery_tag, None)
+            if message is None:
+                continue
+            metrics.PUBLISH_CONFIRM_SECONDS.observe(now - self.published_at.pop(delivery_tag, now))
+            if is_nack:
+                self.retry.append(message)
+            else:
+                self.pending_sequences.discard(message[0])
+                self.confirmed_count += 1
+        if is_nack:
+            self.logger.warning("Broker rejected {} messages, publishing them again".format(len(delivery_tags)))
+        asyncio.ensure_future(self.notify_progress())
+
+    async def notify_progress(self):
+        async with self._progress:
+            self._progress.notify_all()
+
+    def on_channel_closed(self, channel, reason):
+        self.logger.error("RabbitMQ channel closed: {}".format(reason))
+        self.requeue_unconfirmed()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def on_connection_closed(self, connection, reason):
+        if not self._closing:
+            self.logger.error("RabbitMQ connection closed: {}".format(reason))
+        self.requeue_unconfirmed()
+        self._connection = None
+
+    def requeue_unconfirmed(self):
+        """
+        Messages whose confirmation was lost with the channel are published again once reconnected
+        """
+        self.retry.extendleft(reversed(list(self.unconfirmed.values())))
+        self.unconfirmed.clear()
+        self.published_at.clear()
+        self._channel = None
+        asyncio.ensure_future(self.notify_progress())
+
+    async def flush(self, timeout=None):
+        """
+        Waits until everything queued so far has been confirmed by the broker
+        """
+        async def confirmed():
+            while self.depth:
+                await asyncio.sleep(0.05)
+        await asyncio.wait_for(confirmed(), timeout)
+
+    async def close(self, timeout=10):
+        try:
+            await self.flush(timeout)
+        except asyncio.TimeoutError:
+            self.logger.error("Closing RabbitMQ publisher with {} messages not confirmed".format(self.depth))
+        self._closing = True
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
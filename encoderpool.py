@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from decoding import EventDecoder
+from eventfilters import EventArgumentFilter
+from serialization import MessageSerializer
+from utils import get_logger
+
+"""
+Parallel decode and serialize stage.
+The logs received in one poll (or one backfill chunk) are split in chunks that are decoded and serialized on a pool of
+worker processes, so the CPU heavy part of a burst spreads over the cores while the event loop keeps polling. The
+messages come back in the order of the logs, so each filter loop still publishes its contracts' events in
+(blockNumber, logIndex) order. Workers only receive the ABI of the events they decode and compile it once.
+
+A thread pool can be used instead for light workloads, it avoids the cost of pickling logs to other processes.
+"""
+
+# serializers of a worker process, per message format
+_serializers = {}
+
+
+def encode_logs(message_format: str, event_abis: dict, items: list, argument_values=None) -> list:
+    """
+    Runs in a worker, decodes and serializes a chunk of logs
+    @param message_format: MessageSerializer format of the messages
+    @param event_abis: abi key -> event ABI of every event in the chunk
+    @param items: list of (abi key, argument filter key or None, filter arguments, event name, formatted log entry,
+    fields added to the event or None)
+    @param argument_values: argument filter key -> argument values of the EventArgumentFilter of the events
+    @return: list of (message bytes, None) or (None, error description), in the order of the items.
+    Events not matching their argument filter give (None, None)
+    """
+    serializer = _serializers.get(message_format)
+    if serializer is None:
+        serializer = _serializers[message_format] = MessageSerializer(message_format)
+    results = []
+    for abi_key, filter_key, filter_arguments, event_name, log_entry, extra_fields in items:
+        try:
+            event = EventDecoder.for_abi(event_abis[abi_key], key=abi_key).decode(log_entry)
+            if filter_key is not None and not EventArgumentFilter.for_event(
+                    event_abis[abi_key], argument_values[filter_key], key=filter_key).matches(event):
+                results.append((None, None))
+                continue
+            if extra_fields:
+                event.update(extra_fields)
+            results.append((serializer.serialize(event, filter_arguments, event_name), None))
+        except Exception as e:
+            results.append((None, "{}: {} in log {}".format(type(e).__name__, e, dict(log_entry))))
+    return results
+
+
+class MessageEncoderPool:
+
+    PROCESS = "process"
+    THREAD = "thread"
+    # logs sent to a worker at once, big enough to amortize the inter process round trip
+    CHUNK_SIZE = 200
+
+    def __init__(self, message_format=MessageSerializer.JSON, pool_type=PROCESS, workers=None, chunk_size=CHUNK_SIZE):
+        """
+        @param message_format: MessageSerializer format of the messages
+        @param pool_type: PROCESS or THREAD
+        @param workers: number of workers, the number of cores when None
+        @param chunk_size: maximum number of logs handed to a worker at once
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.message_format = message_format
+        self.chunk_size = chunk_size
+        if pool_type == self.PROCESS:
+            # spawned, not forked, as the scraper process runs other threads (publisher, executors)
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        elif pool_type == self.THREAD:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+        else:
+            raise ValueError("Encoder pool type {} not supported. Currently supported are: {}".format(
+                pool_type, [self.PROCESS, self.THREAD]))
+
+    async def encode(self, matched_logs: list, enrichments=None) -> list:
+        """
+        Decodes and serializes logs on the pool
+        @param matched_logs: list of (WatchedEvent, formatted log entry)
+        @param enrichments: fields added to the event of each log, as returned by EventEnricher.enrich
+        @return: the message bytes of each log, in the same order, None for logs that could not be encoded or do not
+        match their argument filter
+        """
+        loop = asyncio.get_running_loop()
+        jobs = []
+        for start in range(0, len(matched_logs), self.chunk_size):
+            event_abis = {}
+            argument_values = {}
+            items = []
+            for index in range(start, min(start + self.chunk_size, len(matched_logs))):
+                watched_event, log_entry = matched_logs[index]
+                event_decoder = watched_event.event_decoder
+                event_abis[event_decoder.key] = event_decoder.event_abi
+                filter_key = None
+                if watched_event.argument_filter is not None:
+                    filter_key = watched_event.argument_filter.key
+                    argument_values[filter_key] = watched_event.argument_filter.argument_values
+                items.append((event_decoder.key, filter_key, watched_event.filter_arguments, watched_event.event_name,
+                              log_entry, enrichments[index] if enrichments is not None else None))
+            jobs.append(loop.run_in_executor(self.executor, encode_logs, self.message_format, event_abis, items,
+                                             argument_values))
+
+        messages = []
+        for results in await asyncio.gather(*jobs):
+            for message, error in results:
+                if error is not None:
+                    self.logger.error("Unknown problem encoding event: {}".format(error))
+                messages.append(message)
+        return messages
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+
+from hexbytes import HexBytes
+from web3._utils.rpc_abi import RPC
+
+from decoding import checksum_address
+from utils import get_logger
+
+"""
+Enrichment of the published events with block and transaction data consumers would otherwise look up themselves.
+The blocks and transactions needed by the logs of a poll are fetched together in JSON-RPC batches and kept in size
+bounded LRU caches shared by every filter, so one block lookup serves all the events of that block, whichever filter
+received them. Lookups already in flight for another filter are awaited instead of being sent again.
+Blocks are looked up by hash, so the timestamp is the one of the exact block the log was emitted in, even around
+reorganisations.
+"""
+
+
+class LRUCache:
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        value = self.entries.get(key, default)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class EventEnricher:
+
+    BLOCK_CACHE_SIZE = 4096
+    TRANSACTION_CACHE_SIZE = 65536
+    # lookups sent in one JSON-RPC batch
+    BATCH_SIZE = 100
+
+    def __init__(self, w3i, block_timestamps=True, transaction_senders=False, block_cache_size=BLOCK_CACHE_SIZE,
+                 transaction_cache_size=TRANSACTION_CACHE_SIZE, batch_size=BATCH_SIZE):
+        """
+        @param w3i: the Web3Interface lookups are sent through
+        @param block_timestamps: add the timestamp of the block of the event as blockTimestamp
+        @param transaction_senders: add the sender of the transaction of the event as transactionFrom
+        @param block_cache_size: block timestamps kept in memory
+        @param transaction_cache_size: transaction senders kept in memory
+        @param batch_size: maximum number of lookups in one batch
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.w3i = w3i
+        self.block_timestamps = block_timestamps
+        self.transaction_senders = transaction_senders
+        self.batch_size = batch_size
+        # block hash -> timestamp, transaction hash -> sender
+        self.block_cache = LRUCache(block_cache_size)
+        self.transaction_cache = LRUCache(transaction_cache_size)
+        # (RPC method, hash) -> future of the lookup in flight
+        self.pending = {}
+
+    async def enrich(self, log_entries: list) -> list:
+        """
+        Looks up the blocks and transactions of the logs, reusing cached and in flight lookups
+        @param log_entries: formatted log entries
+        @return: for each log, in the same order, the fields to add to its event. A field is None when its lookup failed
+        """
+        lookups = []
+        if self.block_timestamps:
+            lookups.append((RPC.eth_getBlockByHash, 'blockHash', self.block_cache))
+        if self.transaction_senders:
+            lookups.append((RPC.eth_getTransactionByHash, 'transactionHash', self.transaction_cache))
+
+        waiting = {}
+        missing = []
+        for method, field, cache in lookups:
+            for log_entry in log_entries:
+                key = bytes(log_entry[field])
+                if key in cache or (method, key) in waiting:
+                    continue
+                future = self.pending.get((method, key))
+                if future is None:
+                    future = self.pending[(method, key)] = asyncio.get_running_loop().create_future()
+                    missing.append((method, key))
+                waiting[(method, key)] = future
+        if missing:
+            await self.fetch(missing)
+        for future in waiting.values():
+            # resolved once the lookup is done, failures are reported by the fetch that owns it
+            await future
+
+        enrichments = []
+        for log_entry in log_entries:
+            fields = {}
+            if self.block_timestamps:
+                fields['blockTimestamp'] = self.block_cache.get(bytes(log_entry['blockHash']))
+            if self.transaction_senders:
+                fields['transactionFrom'] = self.transaction_cache.get(bytes(log_entry['transactionHash']))
+            enrichments.append(fields)
+        return enrichments
+
+    @staticmethod
+    def lookup_params(method, key: bytes) -> list:
+        if method == RPC.eth_getBlockByHash:
+            # the transactions of the block are not needed
+            return [HexBytes(key).hex(), False]
+        return [HexBytes(key).hex()]
+
+    async def fetch(self, missing: list):
+        """
+        Sends the lookups in batches and stores their results in the caches
+        @param missing: list of (RPC method, hash), each with a future in self.pending
+        """
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        try:
+            all_results = await asyncio.gather(*[
+                self.w3i.make_batch_request([(method, self.lookup_params(method, key)) for method, key in batch])
+                for batch in batches], return_exceptions=True)
+            for batch, results in zip(batches, all_results):
+                if isinstance(results, Exception):
+                    self.logger.warning("Could not look up {} blocks and transactions: {}".format(
+                        len(batch), repr(results)))
+                    continue
+                for (method, key), result in zip(batch, results):
+                    if isinstance(result, Exception) or result is None:
+                        self.logger.warning("Could not look up {} {}: {}".format(method, HexBytes(key).hex(), result))
+                    elif method == RPC.eth_getBlockByHash:
+                        self.block_cache.put(key, int(result['timestamp'], 16))
+                    else:
+                        self.transaction_cache.put(key, checksum_address(result['from']))
+        finally:
+            for lookup in missing:
+                future = self.pending.pop(lookup)
+                if not future.done():
+                    future.set_result(None)
@@ -0,0 +1,174 @@
+import json
+import operator
+
+from eth_abi import encode_single
+from eth_abi.grammar import TupleType, parse
+from web3 import Web3
+from web3._utils.abi import collapse_if_tuple
+
+from decoding import EventDecoder, checksum_address
+
+"""
+Filters on the argument values of watched events, the "argument_values" of an event in the watchlist:
+    "argument_values": {"to": ["0x...", "0x..."], "from": "0x...", "value": {"gte": 1000000}}
+An argument is matched against a single value, a list of accepted values or a dict of comparisons.
+
+Indexed arguments matched against values are compiled into the topics of the log filter, so the node only sends the
+matching logs. Everything else (non-indexed arguments, comparisons) is compiled once into a predicate over the decoded
+arguments, applied right after decoding so the events that do not match are never serialized nor published.
+"""
+
+COMPARISONS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "ne": operator.ne,
+}
+
+
+def _normalise_integer(value):
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+
+def _normalise_hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + value.hex()
+    return "0x" + value[2:].lower() if value.startswith("0x") else "0x" + value.lower()
+
+
+def _hashed_value(abi_type):
+    """
+    Indexed strings and bytes are logged as the keccak hash of their value
+    """
+    if abi_type.base == "string":
+        return lambda value: Web3.keccak(text=value).hex()
+    return lambda value: Web3.keccak(hexstr=_normalise_hex(value)).hex()
+
+
+def compile_normaliser(abi_type, indexed: bool):
+    """
+    @return: the function turning a value written in the watchlist into the representation of the decoded argument
+    """
+    if indexed and (abi_type.is_dynamic or abi_type.is_array or isinstance(abi_type, TupleType)):
+        if abi_type.is_array or isinstance(abi_type, TupleType):
+            raise ValueError("Filtering on indexed arrays and structs is not supported")
+        return _hashed_value(abi_type)
+    if abi_type.is_array or isinstance(abi_type, TupleType):
+        return lambda value: value
+    if abi_type.base == "address":
+        return checksum_address
+    if abi_type.base == "bytes":
+        return _normalise_hex
+    if abi_type.base in ("int", "uint"):
+        return _normalise_integer
+    if abi_type.base == "bool":
+        return bool
+    return lambda value: value
+
+
+def _accept_any(accepted):
+    try:
+        accepted = frozenset(accepted)
+    except TypeError:
+        # lists of arrays or structs are not hashable
+        pass
+    return lambda value: value in accepted
+
+
+def _compare(comparisons):
+    tests = [(COMPARISONS[name], expected) for name, expected in comparisons]
+    return lambda value: all(compare(value, expected) for compare, expected in tests)
+
+
+class EventArgumentFilter:
+
+    _filters = {}
+
+    def __init__(self, event_abi: dict, argument_values: dict):
+        """
+        @param event_abi: ABI of the event
+        @param argument_values: argument name -> value, list of values or dict of comparisons (gt, gte, lt, lte, ne)
+        """
+        self.key = self.filter_key(event_abi, argument_values)
+        self.argument_values = argument_values
+        event_decoder = EventDecoder.for_abi(event_abi)
+        inputs = {event_input["name"]: event_input for event_input in event_abi["inputs"]}
+        # positions 1 to 3 of the log topics, None matches any value
+        topics = [None] * len(event_decoder.topic_names)
+        tests = []
+        for name, expected in argument_values.items():
+            if name not in inputs:
+                raise ValueError("Event {} has no argument {}".format(event_abi["name"], name))
+            indexed = bool(inputs[name].get("indexed"))
+            abi_type = parse(collapse_if_tuple(inputs[name]))
+            normalise = compile_normaliser(abi_type, indexed)
+            if isinstance(expected, dict):
+                unknown = set(expected) - set(COMPARISONS)
+                if unknown:
+                    raise ValueError("Unknown comparisons {} on argument {}, supported are {}".format(
+                        sorted(unknown), name, sorted(COMPARISONS)))
+                if indexed and abi_type.is_dynamic:
+                    raise ValueError("Indexed argument {} is only logged as a hash, it can not be compared".format(
+                        name))
+                tests.append((name, _compare([(comparison, normalise(value))
+                                              for comparison, value in expected.items()])))
+                continue
+            accepted = [normalise(value) for value in (expected if isinstance(expected, list) else [expected])]
+            if indexed and not event_abi.get("anonymous"):
+                position = event_decoder.topic_names.index(name)
+                topics[position] = [self.topic_value(abi_type, value) for value in accepted]
+            else:
+                tests.append((name, _accept_any(accepted)))
+        while topics and topics[-1] is None:
+            topics.pop()
+        self.topics = topics
+        self.tests = tests
+
+    @staticmethod
+    def topic_value(abi_type, value) -> str:
+        """
+        @param value: normalised argument value
+        @return: the log topic of the value
+        """
+        if abi_type.is_dynamic:
+            # already hashed by the normaliser
+            return value
+        return "0x" + encode_single(abi_type.to_type_str(), value).hex()
+
+    @staticmethod
+    def filter_key(event_abi: dict, argument_values: dict) -> str:
+        return json.dumps([event_abi, argument_values], sort_keys=True)
+
+    @classmethod
+    def for_event(cls, event_abi: dict, argument_values: dict, key=None) -> "EventArgumentFilter":
+        """
+        @param key: the filter_key of the event ABI and argument values when already known
+        @return: the filter, compiled on first use and shared afterwards
+        """
+        if key is None:
+            key = cls.filter_key(event_abi, argument_values)
+        argument_filter = cls._filters.get(key)
+        if argument_filter is None:
+            argument_filter = cls._filters[key] = cls(event_abi, argument_values)
+        return argument_filter
+
+    @property
+    def topic_filters(self) -> tuple:
+        """
+        @return: the topics after topic0 as a hashable value, to group events with the same topic filters
+        """
+        return tuple(None if accepted is None else tuple(sorted(accepted)) for accepted in self.topics)
+
+    def matches(self, event: dict) -> bool:
+        """
+        @param event: decoded event, as returned by EventDecoder.decode
+        @return: whether the arguments that could not be filtered by the node match
+        """
+        args = event["args"]
+        for name, test in self.tests:
+            if not test(args[name]):
+                return False
+        return True
@@ -1,35 +1,154 @@
 import os
 import json
 import asyncio
+import functools
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
 from web3.types import LogReceipt
+from web3 import Web3
 from web3.contract import LogFilter
 
 from web3environment import Web3Interface, Blockchains
-from utils import get_logger
-from distribution import RabbitPublisher
-import myweb3encoding
+from utils import get_logger, LOGGING, PER_EVENT
+from distribution import RabbitPublisher, AsyncRabbitPublisher
+from settings import ScraperSettings
+from watchlist import WatchlistIndex, WatchedEvent, LogQuery
+from backfill import BackfillEngine
+from serialization import MessageSerializer
+from checkpoints import CheckpointStore
+from scheduler import ChainHeadScheduler
+from subscriptions import LogSubscriber
+from encoderpool import MessageEncoderPool
+from dedup import DuplicateFilter
+from enrichment import EventEnricher
+from spool import DiskSpool
+from abicache import AbiCache
+import metrics
+from metrics import MetricsServer
+from sharding import ShardSupervisor, shard_watchlist, shard_file_path, take_over_checkpoints
 
 
 class EventScraper:
 
     POLLING_INTERVAL_SECONDS = 1
+    # delay before retrying a failed filter recovery or catch-up, doubled at every consecutive failure
+    RETRY_DELAY_SECONDS = 1
+    MAX_RETRY_DELAY_SECONDS = 60
 
-    def __init__(self, contract_watchlist, rabbitmq_config, endpoint):
+    def __init__(self, contract_watchlist, rabbitmq_config, endpoint, settings=None, subscription_endpoint=None,
+                 fallback_endpoints=(), watchlist_loader=None):
+        """
+        @param watchlist_loader: returns the current watchlist, called again to reload it (see WATCHLIST_RELOAD)
+        """
         self.logger = get_logger(self.__class__.__name__)
+        self.settings = settings or ScraperSettings()
+        # websocket endpoint used for eth_subscribe, the main endpoint is used when it is a websocket itself
+        self.subscription_endpoint = subscription_endpoint or (endpoint if endpoint.startswith("ws") else None)
         self.w3i = Web3Interface(blockchain=Blockchains.ETHEREUM,
-                                 endpoint=endpoint)
+                                 endpoint=endpoint,
+                                 max_concurrent_requests=self.settings.RPC_MAX_CONCURRENT_REQUESTS,
+                                 connection_pool_size=self.settings.RPC_CONNECTION_POOL_SIZE,
+                                 batch_window=self.settings.RPC_BATCH_WINDOW_SECONDS,
+                                 max_batch_size=self.settings.RPC_MAX_BATCH_SIZE,
+                                 fallback_endpoints=fallback_endpoints,
+                                 max_attempts=self.settings.RPC_MAX_ATTEMPTS,
+                                 hedge_requests=self.settings.RPC_HEDGE_REQUESTS,
+                                 hedge_percentile=self.settings.RPC_HEDGE_PERCENTILE)
         self.contract_watchlist = contract_watchlist
         self.logger.info("Loaded contract watchlist")
+        self.watchlist_loader = watchlist_loader
+        self.abi_cache = AbiCache(self.settings.ABI_CACHE_PATH) if self.settings.ABI_CACHE_PATH else None
+        # LogQuery.key -> (LogQuery, its task) for everything started from the watchlist
+        self.running_queries = {}
+        self.subscription_task = None
+        # WatchedEvent.key -> last block known to be published by the subscriptions, kept when they are made again
+        self.subscription_covered_blocks = {}
+        self.reload_task = None
 
         # this is needed to keep a strong reference on the coroutines so that the GC doesn't collect them.
         # as per documentation indicated
         self.background_tasks = set()
         self.is_test_run = False
-        self.publisher = self.get_rabbit_connection(rabbitmq_config)
+        self.serializer = MessageSerializer(self.settings.MESSAGE_FORMAT)
+        self.rabbitmq_config = rabbitmq_config
+        self.spool = None
+        self.spool_task = None
+        if self.settings.SPOOL_DIRECTORY:
+            self.spool = DiskSpool(self.settings.SPOOL_DIRECTORY, segment_bytes=self.settings.SPOOL_SEGMENT_BYTES)
+        self.async_publisher = None
+        self.publisher_task = None
+        self.publisher = None
+        self.keep_alive_task = None
+        if self.settings.PUBLISH_PIPELINE:
+            self.async_publisher = AsyncRabbitPublisher(rabbitmq_config,
+                                                        queue_size=self.settings.PUBLISH_QUEUE_SIZE,
+                                                        batch_size=self.settings.PUBLISH_BATCH_SIZE,
+                                                        max_unconfirmed=self.settings.PUBLISH_MAX_UNCONFIRMED,
+                                                        content_type=self.serializer.content_type)
+        elif self.spool is None:
+            self.publisher = self.get_rabbit_connection(rabbitmq_config, self.serializer.content_type)
+        else:
+            try:
+                self.publisher = self.get_rabbit_connection(rabbitmq_config, self.serializer.content_type)
+            except Exception:
+                # connected later by replay_spool
+                self.logger.exception("Could not connect to RabbitMQ, events are spooled until it is reachable")
+        # the RabbitMQ connection is blocking and not thread safe, it is only ever used from this single thread
+        self.publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publisher")
+        # events handed to the publisher thread and not yet published
+        self.pending_publishes = 0
+        self.backfill_engine = BackfillEngine(self.w3i,
+                                              chunk_size=self.settings.BACKFILL_CHUNK_SIZE,
+                                              workers=self.settings.BACKFILL_WORKERS)
+        self.encoder_pool = None
+        if self.settings.ENCODER_WORKERS:
+            self.encoder_pool = MessageEncoderPool(self.settings.MESSAGE_FORMAT,
+                                                   pool_type=self.settings.ENCODER_POOL_TYPE,
+                                                   workers=self.settings.ENCODER_WORKERS,
+                                                   chunk_size=self.settings.ENCODER_CHUNK_SIZE)
+        self.duplicate_filter = None
+        if self.settings.DEDUP_WINDOW_BLOCKS:
+            self.duplicate_filter = DuplicateFilter(self.settings.DEDUP_WINDOW_BLOCKS,
+                                                    bloom_capacity=self.settings.DEDUP_BLOOM_CAPACITY,
+                                                    bloom_error_rate=self.settings.DEDUP_BLOOM_ERROR_RATE)
+        self.enricher = None
+        if self.settings.ENRICH_BLOCK_TIMESTAMP or self.settings.ENRICH_TRANSACTION_SENDER:
+            self.enricher = EventEnricher(self.w3i,
+                                          block_timestamps=self.settings.ENRICH_BLOCK_TIMESTAMP,
+                                          transaction_senders=self.settings.ENRICH_TRANSACTION_SENDER,
+                                          block_cache_size=self.settings.ENRICH_BLOCK_CACHE_SIZE,
+                                          transaction_cache_size=self.settings.ENRICH_TRANSACTION_CACHE_SIZE,
+                                          batch_size=self.settings.ENRICH_BATCH_SIZE)
+        self.checkpoints = CheckpointStore(self.settings.CHECKPOINT_PATH) if self.settings.CHECKPOINT_PATH else None
+        # (address, event name) -> lowest block of an event that could not be published, its checkpoint stays before it
+        # so the event is published again after a restart
+        self.publish_failures = {}
+        self.checkpoint_task = None
+        self.scheduler = None
+        self.scheduler_task = None
+        head_poll_interval = self.settings.HEAD_POLL_INTERVAL_SECONDS or \
+            Blockchains.HEAD_POLL_INTERVAL_SECONDS[self.w3i.blockchain]
+        if self.settings.POLL_ON_NEW_BLOCKS:
+            self.scheduler = ChainHeadScheduler(self.w3i, head_poll_interval, jitter=self.settings.POLL_JITTER_SECONDS)
+        self.metrics_server = None
+        # follows the chain head to measure the lag of published events and to move the checkpoints of the polled
+        # filters, the polling scheduler does it when there is one
+        self.head_tracker = self.scheduler
+        if self.head_tracker is None and (self.settings.METRICS_PORT or self.checkpoints is not None):
+            self.head_tracker = ChainHeadScheduler(self.w3i, head_poll_interval)
+        if self.settings.METRICS_PORT:
+            self.metrics_server = MetricsServer(self.settings.METRICS_HOST, self.settings.METRICS_PORT)
+            if self.async_publisher is not None:
+                metrics.PUBLISH_QUEUE_DEPTH.set_function(lambda: self.async_publisher.depth)
+            else:
+                metrics.PUBLISH_QUEUE_DEPTH.set_function(lambda: self.pending_publishes)
+            if self.spool is not None:
+                metrics.SPOOL_DEPTH.set_function(lambda: self.spool.depth)
 
     @staticmethod
-    def get_rabbit_connection(rabbitmq_config):
-        return RabbitPublisher(rabbitmq_config)
+    def get_rabbit_connection(rabbitmq_config, content_type=None):
+        return RabbitPublisher(rabbitmq_config, content_type=content_type)
 
     def setup_filters(self):
         """
@@ -41,46 +160,265 @@ class EventScraper:
         """
         loop = asyncio.get_event_loop()
 
-        for contract_data in self.contract_watchlist['contracts']:
-            address = self.w3i.web3.toChecksumAddress(contract_data['address'])
-            blockchain = contract_data['blockchain']
-            if blockchain != self.w3i.blockchain:
-                raise ValueError("Chain {} is not supported for smart contract {}!".format(
-                    blockchain, address))
-            abi = contract_data['abi']
+        if self.async_publisher is not None:
+            try:
+                loop.run_until_complete(self.async_publisher.connect())
+            except Exception:
+                if self.spool is None:
+                    raise
+                # the publisher keeps trying to connect in run()
+                self.logger.exception("Could not connect to RabbitMQ, events are spooled until it is reachable")
+            # kept out of background_tasks as it only stops once the filters are done
+            self.publisher_task = loop.create_task(self.async_publisher.run())
+        else:
+            self.keep_alive_task = loop.create_task(self.publisher_keep_alive_loop(
+                RabbitPublisher.HEARTBEAT_SECONDS / 2))
+        if self.spool is not None:
+            self.spool_task = loop.create_task(self.spool_loop(self.settings.SPOOL_REPLAY_INTERVAL_SECONDS))
+        if self.checkpoints is not None:
+            self.checkpoint_task = loop.create_task(self.checkpoint_loop(self.settings.CHECKPOINT_INTERVAL_SECONDS))
+        if self.head_tracker is not None:
+            self.scheduler_task = loop.create_task(self.head_tracker.run())
+        if self.metrics_server is not None:
+            loop.run_until_complete(self.metrics_server.start())
+
+        if self.settings.SUBSCRIBE_LOGS:
+            self.create_subscription_tasks(loop)
+        elif self.settings.CONSOLIDATE_FILTERS:
+            self.create_consolidated_filter_tasks(loop)
+        else:
+            self.create_filter_tasks(loop)
+        if self.abi_cache is not None:
+            self.abi_cache.flush()
+        if self.settings.WATCHLIST_RELOAD:
+            if self.watchlist_loader is None:
+                self.logger.warning("Watchlist reload is enabled but the scraper was given no way to load it again")
+            else:
+                self.reload_task = self.add_background_task(
+                    loop, self.watchlist_reload_loop(self.settings.WATCHLIST_RELOAD_INTERVAL_SECONDS))
+
+        try:
+            # tasks started by watchlist reloads are not in the set being waited on, wait again until all are done
+            while self.background_tasks:
+                loop.run_until_complete(
+                    asyncio.wait(self.background_tasks)
+                )
+        finally:
+            if self.head_tracker is not None:
+                self.scheduler_task.cancel()
+            if self.metrics_server is not None:
+                loop.run_until_complete(self.metrics_server.close())
+            if self.spool is not None:
+                # what is left in the spool is published on the next run
+                self.spool_task.cancel()
+            if self.async_publisher is not None:
+                loop.run_until_complete(self.async_publisher.close())
+                self.publisher_task.cancel()
+            else:
+                self.keep_alive_task.cancel()
+            if self.checkpoints is not None:
+                self.checkpoint_task.cancel()
+                # checkpoints of events the broker did not confirm are not saved, they are published again next run
+                if self.async_publisher is None or self.async_publisher.depth == 0:
+                    self.checkpoints.flush()
+                self.checkpoints.close()
+            loop.run_until_complete(self.w3i.close())
+            if self.encoder_pool is not None:
+                self.encoder_pool.close()
+            self.publish_executor.shutdown()
+            if self.publisher is not None:
+                self.publisher.close()
+            if self.spool is not None:
+                self.spool.close()
+            loop.close()
 
+    def add_background_task(self, loop, coroutine):
+        task = loop.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def compile_queries(self, contract_watchlist: dict) -> dict:
+        """
+        @return: LogQuery.key -> LogQuery of the watchlist, one query per contract event or consolidated ones
+        """
+        watchlist_index = WatchlistIndex(self.w3i.web3, contract_watchlist, self.w3i.blockchain,
+                                         abi_cache=self.abi_cache)
+        if self.settings.SUBSCRIBE_LOGS or self.settings.CONSOLIDATE_FILTERS:
+            log_queries = watchlist_index.compile_log_queries(self.settings.MAX_ADDRESSES_PER_QUERY)
+        else:
+            log_queries = watchlist_index.single_event_queries()
+        return {log_query.key: log_query for log_query in log_queries}
+
+    def create_filter_tasks(self, loop):
+        """
+        Creates one filter and one polling task for each event of each contract in the watchlist
+        """
+        for key, log_query in self.compile_queries(self.contract_watchlist).items():
+            self.running_queries[key] = log_query, self.start_event_filter(loop, log_query, create_now=True)
+
+    def start_event_filter(self, loop, log_query: LogQuery, create_now=False):
+        """
+        Starts the task polling the filter of a single contract event, or its backfill task
+        @param create_now: create the filter right away, when the event loop is not running yet. Otherwise the task
+        creates it in an executor
+        @return: the task
+        """
+        if log_query.historical_range is not None:
+            return self.add_background_task(loop, self.backfill(log_query))
+        watched_event, = log_query.watched_events.values()
+        address = watched_event.address
+        event_name = watched_event.event_name
+        argument_filters = watched_event.filter_arguments
+
+        if watched_event.topic_filters:
+            # the indexed argument values are part of the filter topics
+            create_filter = functools.partial(self.w3i.new_log_filter, log_query.filter_params())
+        else:
             # this is actually used dynamically, do not delete, look down at the eval function
-            contract = self.w3i.web3.eth.contract(address=address, abi=abi)
+            # only the listened event is needed to create the filter, not the whole contract ABI
+            contract = self.w3i.web3.eth.contract(address=address, abi=[watched_event.event_decoder.event_abi])
+            function_string = self.compose_filter_creation_execution_string(event_name, argument_filters)
 
-            events_to_listen = contract_data['events_to_listen']
-            for event_name, event_data in events_to_listen.items():
-                argument_filters = event_data['argument_filters']
+            # this is a hack and the use of eval in general code should be discouraged
+            # this also brings a very bad security risk if the passed argument can be controlled by a 3rd party
+            # in this case it is not, it is composed of the content in contract-watchlist.json which we control
+            # TODO: there is actually a better way using web3.eth.filter:
+            #  https://web3py.readthedocs.io/en/latest/filters.html#event-log-filters
+            create_filter = functools.partial(eval, function_string, globals(), {"contract": contract})
+        description = "event filter for contract {}: {}:{}".format(address, event_name, argument_filters)
 
-                function_string = self.compose_filter_creation_execution_string(event_name, argument_filters)
+        # create_filter is also used to create the filter again when the node drops it
+        def poll(event_filter):
+            return self.filter_loop(event_filter, self.POLLING_INTERVAL_SECONDS, event_name, argument_filters,
+                                    log_query, create_filter)
+        log_filter = create_filter() if create_now else None
+        return self.add_background_task(loop, self.resume_then_poll(log_query, create_filter, poll, description,
+                                                                    log_filter))
 
-                # this is a hack and the use of eval in general code should be discouraged
-                # this also brings a very bad security risk if the passed argument can be controlled by a 3rd party
-                # in this case it is not, it is composed of the content in contract-watchlist.json which we control
-                # TODO: there is actually a better way using web3.eth.filter:
-                #  https://web3py.readthedocs.io/en/latest/filters.html#event-log-filters
-                event_filter = eval(function_string)
+    def create_consolidated_filter_tasks(self, loop):
+        """
+        Compiles the whole watchlist into a few log filters keyed on lists of addresses and topic0 hashes, so that the
+        number of RPC calls per polling cycle does not grow with the watchlist size
+        """
+        for key, log_query in self.compile_queries(self.contract_watchlist).items():
+            self.running_queries[key] = log_query, self.start_consolidated_filter(loop, log_query, create_now=True)
 
-                self.logger.info("For contract {} created event filter: {}:{}".format(
-                    address, event_name, argument_filters))
+    def start_consolidated_filter(self, loop, log_query: LogQuery, create_now=False):
+        """
+        Starts the task polling a consolidated filter, or its backfill task
+        @param create_now: create the filter right away, when the event loop is not running yet. Otherwise the task
+        creates it in an executor
+        @return: the task
+        """
+        if log_query.historical_range is not None:
+            return self.add_background_task(loop, self.backfill(log_query))
+        create_filter = functools.partial(self.w3i.new_log_filter, log_query.filter_params())
+        description = "consolidated filter for {} addresses and {} events: {}".format(
+            len(log_query.addresses), len(log_query.watched_events), log_query.argument_filters)
 
-                task = loop.create_task(self.filter_loop(event_filter,
-                                                         self.POLLING_INTERVAL_SECONDS,
-                                                         event_name,
-                                                         argument_filters))
-                self.background_tasks.add(task)
-                task.add_done_callback(self.background_tasks.discard)
+        def poll(log_filter):
+            return self.consolidated_filter_loop(log_filter, self.POLLING_INTERVAL_SECONDS, log_query, create_filter)
+        log_filter = create_filter() if create_now else None
+        return self.add_background_task(loop, self.resume_then_poll(log_query, create_filter, poll, description,
+                                                                    log_filter))
 
+    def create_subscription_tasks(self, loop):
+        """
+        Turns the watchlist into eth_subscribe log subscriptions (one per consolidated query) on the websocket endpoint,
+        events are pushed to handle_event as they arrive instead of being polled
+        """
+        if not self.subscription_endpoint:
+            raise ValueError("Subscribing to logs requires a websocket endpoint (RPC_ENDPOINT_WSS_URL)")
+        for key, log_query in self.compile_queries(self.contract_watchlist).items():
+            task = None
+            if log_query.historical_range is not None:
+                task = self.add_background_task(loop, self.backfill(log_query))
+            self.running_queries[key] = log_query, task
+        self.start_subscriptions(loop)
+
+    def start_subscriptions(self, loop):
+        """
+        Starts the task of the subscriptions of all the live queries, they share a single websocket connection
+        """
+        live_queries = [log_query for log_query, _ in self.running_queries.values()
+                        if log_query.historical_range is None]
+        live_events = {key for log_query in live_queries for key in log_query.watched_events}
+        self.subscription_covered_blocks = {key: covered_block
+                                            for key, covered_block in self.subscription_covered_blocks.items()
+                                            if key in live_events}
+        self.subscription_task = None
+        if live_queries:
+            self.subscription_task = self.add_background_task(loop, self.subscription_loop(live_queries))
+
+    def reload_watchlist(self, loop, contract_watchlist: dict):
+        """
+        Applies a new watchlist to the running scraper: filters of queries that are no longer in the watchlist stop
+        after their current poll, new ones are created, and the others keep running untouched. The subscriptions are
+        made again as a whole when their queries changed, each event resuming after the last block published for it
+        """
+        queries = self.compile_queries(contract_watchlist)
+        removed = [key for key in self.running_queries if key not in queries]
+        added = [key for key in queries if key not in self.running_queries]
+        changed_queries = [self.running_queries[key][0] for key in removed] + [queries[key] for key in added]
+        self.contract_watchlist = contract_watchlist
+        if self.abi_cache is not None:
+            self.abi_cache.flush()
+        if not removed and not added:
+            self.logger.info("Reloaded watchlist, nothing changed")
+            return
+
+        for key in removed:
+            log_query, task = self.running_queries.pop(key)
+            log_query.retired = True
+            if task is not None and log_query.historical_range is not None:
+                task.cancel()
+        for key in added:
+            log_query = queries[key]
+            if self.settings.SUBSCRIBE_LOGS:
+                task = None
+                if log_query.historical_range is not None:
+                    task = self.add_background_task(loop, self.backfill(log_query))
+            elif self.settings.CONSOLIDATE_FILTERS:
+                task = self.start_consolidated_filter(loop, log_query)
+            else:
+                task = self.start_event_filter(loop, log_query)
+            self.running_queries[key] = log_query, task
+        if self.settings.SUBSCRIBE_LOGS and any(log_query.historical_range is None for log_query in changed_queries):
+            if self.subscription_task is not None:
+                self.subscription_task.cancel()
+            self.start_subscriptions(loop)
+        self.logger.info("Reloaded watchlist: {} queries stopped, {} started, {} unchanged".format(
+            len(removed), len(added), len(self.running_queries) - len(added)))
+
+    async def watchlist_reload_loop(self, interval):
+        """
+        Reloads the watchlist when contract-watchlist.json changes, checked every interval seconds, or right away when
+        the process receives SIGHUP
+        """
+        reload_requested = asyncio.Event()
         try:
-            loop.run_until_complete(
-                asyncio.wait(self.background_tasks)
-            )
-        finally:
-            loop.close()
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_requested.set)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            # no SIGHUP on Windows, and signal handlers can only be set from the main thread
+            self.logger.info("Reloading the watchlist on file changes only")
+        file_state = watchlist_file_state()
+        while True:
+            try:
+                await asyncio.wait_for(reload_requested.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            requested = reload_requested.is_set()
+            reload_requested.clear()
+            current_file_state = watchlist_file_state()
+            if not requested and current_file_state == file_state:
+                continue
+            file_state = current_file_state
+            try:
+                self.reload_watchlist(asyncio.get_running_loop(), self.watchlist_loader())
+            except Exception:
+                # e.g. the file read while it was being written, it is reloaded again on the next change
+                self.logger.exception("Could not reload the watchlist, the running filters are kept")
 
     @staticmethod
     def compose_filter_creation_execution_string(event_name: str, argument_filters: dict) -> str:
@@ -109,20 +447,591 @@ class EventScraper:
         function_string = "contract.events.{}.createFilter({})".format(event_name, normalised_args)
         return function_string
 
-    async def filter_loop(self, event_filter: LogFilter, polling_interval: int, event_name: str, filter_arguments: dict):
+    async def filter_loop(self, event_filter: LogFilter, polling_interval: int, event_name: str, filter_arguments: dict,
+                          log_query: LogQuery, create_filter):
         """
         Entry point for the async functions. Passes arguments to handle_event function and polls polling_interval
-        seconds for new events to pass
+        seconds for new events to pass.
+        If the node drops the filter, it is created again with create_filter and the missed blocks are filled in.
+        The checkpoint moves up to the chain head known before the poll once the poll is published
         """
         self.logger.info("Starting asyncio filter routine {} {} with arguments: {}".format(
             event_name, event_filter, filter_arguments))
+        watched_event, = log_query.watched_events.values()
+        covered_block = await self.w3i.get_block_number()
+        polled_block = covered_block
         while True:
-            for event_data in event_filter.get_new_entries():
-                self.handle_event(event_data, filter_arguments, event_name)
-                if self.is_test_run:
-                    # helper part for testing purpose
-                    return
+            head_block = self.known_head_block()
+            try:
+                log_entries = await self.w3i.get_new_entries(event_filter, decode=False)
+            except Exception as e:
+                event_filter, covered_block = await self.handle_polling_error(e, event_filter, polling_interval,
+                                                                              log_query, create_filter, covered_block)
+                continue
+            if self.is_test_run and log_entries:
+                # helper part for testing purpose
+                await self.publish_logs([(watched_event, log_entries[0])])
+                return
+            published_logs = await self.publish_logs([(watched_event, log_entry) for log_entry in log_entries])
+            for _, log_entry in published_logs:
+                self.record_checkpoint(watched_event.address, event_name, log_entry['blockNumber'])
+                covered_block = max(covered_block, log_entry['blockNumber'])
+            if head_block is not None and len(published_logs) == len(log_entries):
+                covered_block = self.record_polled_head(log_query, covered_block, head_block)
+            if log_query.retired:
+                # polled once more after the reload so nothing is missed before the filters replacing it
+                await self.stop_filter(event_filter, log_query)
+                return
+            polled_block = await self.wait_next_poll(polling_interval, polled_block)
+
+    async def consolidated_filter_loop(self, log_filter: LogFilter, polling_interval: int, log_query: LogQuery,
+                                       create_filter):
+        """
+        Polls a consolidated filter and demultiplexes every received log to its watched contract event.
+        As in filter_loop, the checkpoints of all the events of the query move up to the head known before each poll
+        """
+        self.logger.info("Starting asyncio consolidated filter routine {} with arguments: {}".format(
+            log_filter, log_query.argument_filters))
+        covered_block = await self.w3i.get_block_number()
+        polled_block = covered_block
+        while True:
+            head_block = self.known_head_block()
+            try:
+                log_entries = await self.w3i.get_new_entries(log_filter)
+            except Exception as e:
+                log_filter, covered_block = await self.handle_polling_error(e, log_filter, polling_interval,
+                                                                            log_query, create_filter, covered_block)
+                continue
+            matched_logs = []
+            for log_entry in log_entries:
+                watched_event = log_query.demultiplex(log_entry)
+                if watched_event is not None:
+                    matched_logs.append((watched_event, log_entry))
+            if self.is_test_run and matched_logs:
+                # helper part for testing purpose
+                await self.publish_logs(matched_logs[:1])
+                return
+            published_logs = await self.publish_logs(matched_logs)
+            for watched_event, log_entry in published_logs:
+                self.record_checkpoint(watched_event.address, watched_event.event_name, log_entry['blockNumber'])
+                covered_block = max(covered_block, log_entry['blockNumber'])
+            if head_block is not None and len(published_logs) == len(matched_logs):
+                covered_block = self.record_polled_head(log_query, covered_block, head_block)
+            if log_query.retired:
+                await self.stop_filter(log_filter, log_query)
+                return
+            polled_block = await self.wait_next_poll(polling_interval, polled_block)
+
+    def known_head_block(self):
+        """
+        @return: the last chain head read by the shared head tracker, None when checkpoints are off or before its first
+        read. Filter loops take it before polling instead of reading the head themselves
+        """
+        if self.checkpoints is None or self.head_tracker is None:
+            return None
+        return self.head_tracker.head_block
+
+    def record_polled_head(self, log_query: LogQuery, covered_block: int, head_block: int) -> int:
+        """
+        A filter poll returns every log up to the head of the node at the time of the poll, so once they are published
+        all the blocks up to head_block, known before the poll, are complete for every event of the query, including
+        the events that emitted nothing
+        @return: the last block covered
+        """
+        for watched_event in log_query.watched_events.values():
+            self.record_checkpoint(watched_event.address, watched_event.event_name, head_block)
+        return max(covered_block, head_block)
+
+    async def stop_filter(self, log_filter: LogFilter, log_query: LogQuery):
+        """
+        Uninstalls the filter of a query removed from the watchlist, once it was polled for the last time
+        """
+        try:
+            await self.w3i.uninstall_filter(log_filter)
+        except Exception as e:
+            self.logger.warning("Could not uninstall filter {}: {}".format(log_filter.filter_id, repr(e)))
+        self.logger.info("Stopped filter {} of {} addresses and {} events, removed from the watchlist".format(
+            log_filter.filter_id, len(log_query.addresses), len(log_query.watched_events)))
+
+    async def wait_next_poll(self, polling_interval: int, polled_block: int) -> int:
+        """
+        Waits until the next poll of a filter is due: polling_interval seconds, or, with the new block scheduler, until
+        the chain head moves past the block the filter was last polled at
+        @return: the block the next poll happens at
+        """
+        if self.scheduler is None:
+            await asyncio.sleep(polling_interval)
+            return polled_block
+        return await self.scheduler.wait_for_block_after(polled_block)
+
+    async def subscription_loop(self, log_queries: list):
+        """
+        Publishes the logs pushed by the subscriptions. After every (re)subscription the blocks since the last log
+        seen are filled in with eth_getLogs (from the checkpoints for events not seen yet) before pushed logs are
+        handled, and pushed logs already covered by that fill are skipped. The blocks seen are kept per watched event
+        in subscription_covered_blocks, so subscriptions made again after a watchlist reload resume where they were.
+        With checkpoints, the blocks seen and the checkpoints of all the subscribed events also follow the chain head,
+        so events that are rarely pushed do not resume far behind it
+        """
+        covered_blocks = self.subscription_covered_blocks
+        subscriber = LogSubscriber(self.subscription_endpoint)
+
+        async def on_subscribed():
+            head_block = await self.w3i.get_block_number()
+            for log_query in log_queries:
+                new_events = [key for key in log_query.watched_events if key not in covered_blocks]
+                if new_events and self.checkpoints is not None:
+                    await self.catch_up(log_query, head_block)
+                else:
+                    resume_blocks = {key: covered_blocks[key] + 1 for key in log_query.watched_events
+                                     if key in covered_blocks and covered_blocks[key] < head_block}
+                    if resume_blocks:
+                        await self.publish_block_range(log_query, min(resume_blocks.values()), head_block,
+                                                       resume_blocks)
+                for key in log_query.watched_events:
+                    if key in covered_blocks or self.checkpoints is not None:
+                        covered_blocks[key] = max(head_block, covered_blocks.get(key, head_block))
+                    else:
+                        # nothing to resume from, logs are published from the current head on
+                        covered_blocks[key] = head_block - 1
+
+        async def handle_log(index, log_entry: LogReceipt):
+            log_query = log_queries[index]
+            watched_event = log_query.demultiplex(log_entry)
+            block_number = log_entry['blockNumber']
+            if watched_event is None or block_number <= covered_blocks.get(watched_event.key, -1):
+                return
+            if not await self.publish_logs([(watched_event, log_entry)]):
+                return
+            # logs are pushed one at a time and in order, only the blocks before this one are known to be complete
+            self.record_checkpoint(watched_event.address, watched_event.event_name, block_number - 1)
+            for key in log_query.watched_events:
+                covered_blocks[key] = max(covered_blocks.get(key, -1), block_number - 1)
+
+        async def follow_head():
+            # a head is recorded once the next one is seen: the subscriptions stayed up in between and every log they
+            # pushed was handled, so the logs of its blocks had a head read interval to arrive
+            seen_head, head_block = None, None
+            while True:
+                head_block = await self.head_tracker.wait_for_block_after(head_block)
+                if seen_head is not None and subscriber.caught_up and seen_head[1] == subscriber.subscriptions_made:
+                    for log_query in log_queries:
+                        for key, watched_event in log_query.watched_events.items():
+                            if covered_blocks.get(key, -1) < seen_head[0]:
+                                covered_blocks[key] = seen_head[0]
+                                self.record_checkpoint(watched_event.address, watched_event.event_name, seen_head[0])
+                seen_head = (head_block, subscriber.subscriptions_made) if subscriber.caught_up else None
+
+        subscriptions = []
+        for log_query in log_queries:
+            params = log_query.filter_params()
+            params.pop('fromBlock', None)
+            params.pop('toBlock', None)
+            subscriptions.append(params)
+        head_following = None
+        if self.checkpoints is not None and self.head_tracker is not None:
+            head_following = asyncio.ensure_future(follow_head())
+        try:
+            await subscriber.run(subscriptions, handle_log, on_subscribed)
+        finally:
+            if head_following is not None:
+                head_following.cancel()
+
+    async def handle_polling_error(self, error: Exception, log_filter: LogFilter, polling_interval: int,
+                                   log_query: LogQuery, create_filter, covered_block: int):
+        """
+        Keeps a filter loop alive when polling fails. When the node no longer knows the filter, a new one is created
+        and the blocks after covered_block (the last block known to be delivered by the old filter) are filled in
+        with eth_getLogs, otherwise the filter is polled again on the next cycle. The same happens when the endpoint
+        of the filter is put aside, the new filter then lives on another endpoint. Creating the filter and filling the
+        blocks are retried until they succeed, the fill starting again after covered_block
+        @return: the filter to poll from now on and the last block covered
+        """
+        if not Web3Interface.is_filter_not_found(error):
+            self.logger.exception("Problem polling filter {}, retrying in {} seconds".format(
+                log_filter, polling_interval))
             await asyncio.sleep(polling_interval)
+            return log_filter, covered_block
+
+        self.logger.warning("Node dropped filter {} ({}), creating it again and filling blocks after {}".format(
+            log_filter, error, covered_block))
+        new_filters = []
+
+        async def recover():
+            if not new_filters:
+                # created once, before the head is read, so the fill and the new filter leave no block in between
+                new_filters.append(await self.w3i.create_filter(create_filter, log_filter))
+            head_block = await self.w3i.get_block_number()
+            if covered_block < head_block:
+                resume_blocks = {key: covered_block + 1 for key in log_query.watched_events}
+                await self.publish_block_range(log_query, covered_block + 1, head_block, resume_blocks)
+            return new_filters[0], max(covered_block, head_block)
+        return await self.retry_until_done(recover, "recovering dropped filter {}".format(log_filter))
+
+    async def retry_until_done(self, operation, description: str):
+        """
+        Awaits operation() until it succeeds, waiting RETRY_DELAY_SECONDS after the first failure and twice as long
+        after every next one
+        @param operation: coroutine function without arguments
+        @param description: what operation does, for the log
+        @return: what operation returned
+        """
+        delay = self.RETRY_DELAY_SECONDS
+        while True:
+            try:
+                return await operation()
+            except Exception:
+                self.logger.exception("Problem {}, retrying in {} seconds".format(description, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RETRY_DELAY_SECONDS)
+
+    async def backfill(self, log_query: LogQuery):
+        """
+        Serves a query over a fixed historical block range with chunked, concurrent eth_getLogs calls instead of a
+        single filter over the whole range. Logs are published in block and log index order.
+        Events already published up to a checkpoint in a previous run resume after it
+        """
+        from_block, to_block = log_query.historical_range
+        resume_blocks = {}
+        for key, watched_event in log_query.watched_events.items():
+            checkpoint = self.get_checkpoint(watched_event.address, watched_event.event_name)
+            resume_blocks[key] = from_block if checkpoint is None else max(from_block, checkpoint + 1)
+        from_block = min(resume_blocks.values())
+        if from_block <= to_block:
+            await self.publish_block_range(log_query, from_block, to_block, resume_blocks)
+
+    async def resume_then_poll(self, log_query: LogQuery, create_filter, poll, description: str,
+                               log_filter: LogFilter = None):
+        """
+        Creates the filter of the query off the event loop when not given, publishes what the events of the query
+        emitted since their checkpoints, then polls the filter.
+        The filter is created before the chain head is read here, so no block falls in between. A failed creation or
+        catch-up is retried until it succeeds, polling only starts after them
+        @param create_filter: function creating the filter with the synchronous web3 object
+        @param poll: function returning the polling coroutine of a filter
+        @param description: what the filter is, for the log
+        @param log_filter: the filter when already created
+        """
+        if log_filter is None:
+            log_filter = await self.retry_until_done(functools.partial(self.w3i.create_filter, create_filter),
+                                                     "creating {}".format(description))
+        self.logger.info("Created {}".format(description))
+
+        async def catch_up():
+            await self.catch_up(log_query, await self.w3i.get_block_number())
+        if self.checkpoints is not None:
+            await self.retry_until_done(catch_up, "catching up {} events".format(len(log_query.watched_events)))
+        await poll(log_filter)
+
+    async def catch_up(self, log_query: LogQuery, to_block: int):
+        """
+        Publishes the logs the events of the query emitted between their checkpoints and to_block
+        """
+        resume_blocks = {}
+        for key, watched_event in log_query.watched_events.items():
+            checkpoint = self.get_checkpoint(watched_event.address, watched_event.event_name)
+            if checkpoint is None:
+                # new in the watchlist, it starts from the current head
+                self.record_checkpoint(watched_event.address, watched_event.event_name, to_block)
+            else:
+                resume_blocks[key] = checkpoint + 1
+        if resume_blocks and min(resume_blocks.values()) <= to_block:
+            self.logger.info("Catching up {} events from block {} to {}".format(
+                len(resume_blocks), min(resume_blocks.values()), to_block))
+            await self.publish_block_range(log_query, min(resume_blocks.values()), to_block, resume_blocks)
+
+    async def publish_block_range(self, log_query: LogQuery, from_block: int, to_block: int, resume_blocks: dict):
+        """
+        Publishes the logs of the query in a block range with the backfill engine
+        @param resume_blocks: (address, topic0) -> first block to publish for that event, events not in it are skipped
+        """
+        async def publish_logs(log_entries: list):
+            matched_logs = []
+            for log_entry in log_entries:
+                watched_event = log_query.demultiplex(log_entry)
+                if watched_event is not None and \
+                        log_entry['blockNumber'] >= resume_blocks.get(watched_event.key, to_block + 1):
+                    matched_logs.append((watched_event, log_entry))
+            await self.publish_logs(matched_logs)
+
+        def chunk_done(end_block):
+            for key, watched_event in log_query.watched_events.items():
+                if key in resume_blocks and resume_blocks[key] <= end_block:
+                    self.record_checkpoint(watched_event.address, watched_event.event_name, end_block)
+
+        params = log_query.filter_params()
+        params.pop('fromBlock', None)
+        params.pop('toBlock', None)
+        await self.backfill_engine.run(params, None, from_block, to_block, on_chunk_done=chunk_done,
+                                       handle_logs=publish_logs)
+
+    def get_checkpoint(self, address, event_name):
+        if self.checkpoints is None:
+            return None
+        return self.checkpoints.get(address, event_name)
+
+    def record_checkpoint(self, address, event_name, block_number):
+        if self.checkpoints is None:
+            return
+        failed_block = self.publish_failures.get((address, event_name))
+        if failed_block is not None:
+            block_number = min(block_number, failed_block - 1)
+        self.checkpoints.record(address, event_name, block_number)
+
+    def record_publish_failure(self, watched_event: WatchedEvent, log_entry: LogReceipt):
+        key = (watched_event.address, watched_event.event_name)
+        self.publish_failures[key] = min(self.publish_failures.get(key, log_entry['blockNumber']),
+                                         log_entry['blockNumber'])
+
+    async def checkpoint_loop(self, interval):
+        """
+        Periodically writes the checkpoints to disk. With the pipelined publisher a checkpoint is only written once the
+        broker confirmed every message queued before it was recorded
+        """
+        while True:
+            await asyncio.sleep(interval)
+            changes = self.checkpoints.pending_changes()
+            if self.async_publisher is not None:
+                last_sequence = self.async_publisher.last_sequence
+                while not self.async_publisher.is_confirmed_through(last_sequence):
+                    await asyncio.sleep(0.1)
+            self.checkpoints.flush(changes)
+
+    async def publish_logs(self, matched_logs: list) -> list:
+        """
+        Decodes, serializes and publishes logs in the given order. With the encoder pool the CPU work of the whole list
+        is spread over its workers before the messages are published, otherwise logs go one by one through publish_event
+        Events whose argument values do not match the filter of their watched event are dropped right after decoding,
+        logs already published are dropped before. With enrichment, the block and transaction fields of the remaining
+        logs are looked up at once and added to the decoded events. The encoder pool decodes in its workers, so the
+        events it would drop are decoded and checked here first, only when enrichment is on and only for the watched
+        events filtering decoded argument values: each of them is then decoded twice, instead of a lookup per
+        dropped event
+        @param matched_logs: list of (WatchedEvent, formatted log entry)
+        @return: the logs of matched_logs done with: published, spooled or deliberately dropped. Logs that could not be
+        published are left out and their event recorded in publish_failures
+        """
+        all_logs = matched_logs
+        if self.duplicate_filter is not None:
+            matched_logs = self.drop_duplicates(matched_logs)
+        # id of the log entries that could not be published
+        failed = set()
+        if self.encoder_pool is None:
+            decoded_logs = []
+            for watched_event, log_entry in matched_logs:
+                started = time.perf_counter()
+                event = watched_event.decode(log_entry)
+                metrics.DECODE_SECONDS.observe(time.perf_counter() - started)
+                if watched_event.matches(event):
+                    decoded_logs.append((watched_event, log_entry, event))
+            enrichments = await self.enrich([log_entry for _, log_entry, _ in decoded_logs])
+            for index, (watched_event, log_entry, event) in enumerate(decoded_logs):
+                if enrichments is not None:
+                    event.update(enrichments[index])
+                if not await self.publish_event(event, watched_event.filter_arguments, watched_event.event_name):
+                    self.record_publish_failure(watched_event, log_entry)
+                    failed.add(id(log_entry))
+                    continue
+                self.record_published(watched_event, log_entry)
+        elif matched_logs:
+            if self.enricher is not None:
+                matched_logs = [(watched_event, log_entry) for watched_event, log_entry in matched_logs
+                                if not watched_event.filters_decoded_arguments
+                                or watched_event.matches(watched_event.decode(log_entry))]
+            enrichments = await self.enrich([log_entry for _, log_entry in matched_logs])
+            started = time.perf_counter()
+            messages = await self.encoder_pool.encode(matched_logs, enrichments)
+            metrics.ENCODE_BATCH_SECONDS.observe(time.perf_counter() - started)
+            for (watched_event, log_entry), message in zip(matched_logs, messages):
+                if message is None:
+                    continue
+                if not await self.publish_message(message, watched_event.event_name):
+                    self.record_publish_failure(watched_event, log_entry)
+                    failed.add(id(log_entry))
+                    continue
+                self.record_published(watched_event, log_entry)
+        if not failed:
+            return all_logs
+        return [(watched_event, log_entry) for watched_event, log_entry in all_logs if id(log_entry) not in failed]
+
+    async def enrich(self, log_entries: list):
+        """
+        @return: the fields to add to the event of each log, None without enrichment or logs
+        """
+        if self.enricher is None or not log_entries:
+            return None
+        return await self.enricher.enrich(log_entries)
+
+    def drop_duplicates(self, matched_logs: list) -> list:
+        """
+        @return: the logs of matched_logs not seen before
+        """
+        unique_logs = [(watched_event, log_entry) for watched_event, log_entry in matched_logs
+                       if not self.duplicate_filter.is_duplicate(log_entry)]
+        if len(unique_logs) != len(matched_logs):
+            metrics.DUPLICATE_EVENTS.inc(len(matched_logs) - len(unique_logs))
+        return unique_logs
+
+    def record_published(self, watched_event: WatchedEvent, log_entry: LogReceipt):
+        """
+        Updates the per event counter and the lag between the chain head and the published event
+        """
+        metrics.EVENTS.labels(watched_event.address, watched_event.event_name).inc()
+        if self.head_tracker is None or self.head_tracker.head_block is None:
+            return
+        block_number = log_entry['blockNumber']
+        metrics.HEAD_LAG_BLOCKS.observe(max(0, self.head_tracker.head_block - block_number))
+        seen_at = self.head_tracker.head_seen_at.get(block_number)
+        if seen_at is not None:
+            metrics.HEAD_LAG_SECONDS.observe(asyncio.get_running_loop().time() - seen_at)
+
+    async def publish_event(self, event: LogReceipt, filter_arguments: dict, event_name: str) -> bool:
+        """
+        Hands the event over to the pipelined publisher, waiting while its queue is full, or runs handle_event on the
+        publisher thread so the blocking RabbitMQ publish does not stall the other filters
+        @return: False if the event could not be published nor spooled
+        """
+        if self.async_publisher is None and not self.spooling():
+            return await self.run_on_publisher_thread(self.handle_event, event, filter_arguments, event_name)
+        try:
+            message = self.compose_message(event, filter_arguments, event_name)
+        except Exception:
+            # publishing it again would fail the same way, the event is dropped
+            self.logger.exception("Unknown problem serializing event {}:{}".format(event_name, event))
+            return True
+        return await self.publish_message(message, event_name)
+
+    async def publish_message(self, message: bytes, event_name: str) -> bool:
+        """
+        Publishes an already serialized message, through the pipelined publisher or on the publisher thread, or
+        appends it to the disk spool while the spool is in use
+        @return: False if the message could not be published nor spooled
+        """
+        if self.spooling():
+            self.spool.append(message)
+            return True
+        if self.async_publisher is None:
+            return await self.run_on_publisher_thread(self.handle_message, message, event_name)
+        started = time.perf_counter()
+        await self.async_publisher.publish(message)
+        metrics.PUBLISH_SECONDS.observe(time.perf_counter() - started)
+        return True
+
+    def spooling(self) -> bool:
+        """
+        @return: True when messages go to the disk spool: it holds messages that have to be published first, or the
+        broker is unreachable or can not keep up (its queue is full)
+        """
+        if self.spool is None:
+            return False
+        if self.spool.depth:
+            return True
+        if self.async_publisher is not None:
+            return not self.async_publisher.is_connected or self.async_publisher.queue.full()
+        return self.publisher is None or not self.publisher.connected or \
+            self.pending_publishes >= self.settings.PUBLISH_QUEUE_SIZE
+
+    async def spool_loop(self, interval):
+        """
+        Publishes the spooled messages again, in order, once the broker is reachable
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if not self.spool.depth:
+                continue
+            if self.async_publisher is None:
+                await self.run_on_publisher_thread(self.replay_spool)
+            elif self.async_publisher.is_connected:
+                await self.replay_spool_through_pipeline()
+
+    async def publisher_keep_alive_loop(self, interval):
+        """
+        Lets the blocking RabbitMQ connection answer the broker heartbeats between publishes. Without the disk spool,
+        which connects again on its own, a lost connection is also replaced here
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.get_running_loop().run_in_executor(self.publish_executor, self.keep_publisher_alive)
+
+    def keep_publisher_alive(self):
+        """
+        Runs on the publisher thread
+        """
+        if self.publisher is None:
+            return
+        if self.publisher.connected:
+            self.publisher.keep_alive()
+        elif self.spool is None:
+            try:
+                self.publisher.reconnect()
+                self.logger.info("Connected to RabbitMQ again")
+            except Exception as e:
+                self.logger.warning("RabbitMQ is still unreachable: {}".format(repr(e)))
+
+    def replay_spool(self):
+        """
+        Runs on the publisher thread, connects to RabbitMQ again when needed and publishes the spooled messages until
+        the spool is empty or publishing fails
+        """
+        try:
+            if self.publisher is None:
+                self.publisher = self.get_rabbit_connection(self.rabbitmq_config, self.serializer.content_type)
+            elif not self.publisher.connected:
+                self.publisher.reconnect()
+        except Exception as e:
+            self.logger.warning("RabbitMQ is still unreachable, {} events spooled: {}".format(self.spool.depth,
+                                                                                              repr(e)))
+            return
+        while True:
+            messages = self.spool.read(self.settings.SPOOL_REPLAY_BATCH_SIZE)
+            if not messages:
+                return
+            published = None
+            try:
+                for position, message in messages:
+                    self.publisher.publish(message)
+                    published = position
+            except Exception:
+                self.logger.exception("Could not publish spooled events, {} left".format(self.spool.depth))
+                self.spool.rewind()
+                return
+            finally:
+                if published is not None:
+                    self.spool.acknowledge(published)
+            self.logger.info("Published {} spooled events, {} left".format(len(messages), self.spool.depth))
+
+    async def replay_spool_through_pipeline(self):
+        """
+        Hands the spooled messages over to the pipelined publisher, a batch leaves the spool once the broker confirmed
+        it. Should the connection drop meanwhile, the pipelined publisher publishes them again itself
+        """
+        while True:
+            messages = self.spool.read(self.settings.SPOOL_REPLAY_BATCH_SIZE)
+            if not messages:
+                return
+            for _, message in messages:
+                sequence = await self.async_publisher.publish(message)
+            while not self.async_publisher.is_confirmed_through(sequence):
+                await asyncio.sleep(0.05)
+            self.spool.acknowledge(messages[-1][0])
+            self.logger.info("Published {} spooled events, {} left".format(len(messages), self.spool.depth))
+
+    async def run_on_publisher_thread(self, function, *args):
+        self.pending_publishes += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.publish_executor, function, *args)
+        finally:
+            self.pending_publishes -= 1
+
+    def compose_message(self, event: LogReceipt, filter_arguments: dict, event_name: str) -> bytes:
+        """
+        Groups the event data, the filter arguments and the event name in the message sent over RabbitMQ,
+        encoded in a single pass in the configured message format
+        """
+        started = time.perf_counter()
+        message = self.serializer.serialize(event, filter_arguments, event_name)
+        metrics.SERIALIZE_SECONDS.observe(time.perf_counter() - started)
+        return message
 
     def handle_event(self, event: LogReceipt, filter_arguments: dict, event_name: str):
         """
@@ -131,21 +1040,41 @@ class EventScraper:
         @param event: the blockchain event as returned by the API
         @param filter_arguments: the dict with the filter parameters used
         @param event_name: the Event name
-        @return: nothing, it publishes to the message broker new events
+        @return: False if the event could not be published nor spooled, it publishes to the message broker new events
         """
         try:
-            data = {
-                "event_name": event_name,
-                "filter_arguments": filter_arguments,
-                # TODO: do a pull request with the extension to web3.toJSON to support bytes then resume using it here
-                # "event_data": json.loads(self.w3i.web3.toJSON(event))
-                "event_data": json.loads(myweb3encoding.to_json(event))
-            }
-            self.logger.info("Publishing event {} data to routing key".format(event_name))
-            self.publisher.publish(json.dumps(data))
-            self.logger.info("Done publishing event {} data to routing key".format(event_name))
+            message = self.compose_message(event, filter_arguments, event_name)
         except Exception:
             self.logger.exception("Unknown problem publishing event {}:{}".format(event_name, event))
+            return True
+        return self.handle_message(message, event_name)
+
+    def handle_message(self, message: bytes, event_name: str) -> bool:
+        """
+        Publishes a serialized event message on the indicated RabbitMQ routing key. With the disk spool, the message
+        is spooled when publishing fails or when spooled messages are waiting to be published before it
+        @return: False if the message could not be published nor spooled
+        """
+        if self.spool is not None and (self.spool.depth or self.publisher is None or not self.publisher.connected):
+            self.spool.append(message)
+            return True
+        try:
+            self.logger.info("Publishing event {} data to routing key".format(event_name), extra=PER_EVENT)
+            started = time.perf_counter()
+            self.publisher.publish(message)
+            metrics.PUBLISH_SECONDS.observe(time.perf_counter() - started)
+            self.logger.info("Done publishing event {} data to routing key".format(event_name), extra=PER_EVENT)
+        except Exception:
+            if self.spool is None:
+                self.logger.exception("Unknown problem publishing event {}".format(event_name))
+                return False
+            self.logger.exception("Could not publish event {}, spooling it until RabbitMQ is reachable".format(
+                event_name))
+            self.spool.append(message)
+        return True
+
+
+WATCHLIST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract-watchlist.json")
 
 
 def load_events_filter() -> dict:
@@ -153,13 +1082,79 @@ def load_events_filter() -> dict:
     Reads the content of input_file_name (json file) and returns it. Simple helper function
     @return: the targeted contract events and filters
     """
-    input_file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract-watchlist.json")
-    with open(input_file_name, "rt") as fin:
+    with open(WATCHLIST_FILE, "rt") as fin:
         return json.load(fin)
 
 
+def watchlist_file_state():
+    """
+    @return: modification time and size of the watchlist file, None when it is missing
+    """
+    try:
+        stat = os.stat(WATCHLIST_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_shard_watchlist(settings: ScraperSettings, worker_index=None) -> dict:
+    """
+    @param worker_index: index of the shard worker process, None for the whole host
+    @return: the part of the watchlist this host, or this worker of the host, is responsible for
+    """
+    contract_watchlist = shard_watchlist(load_events_filter(), settings.SHARD_INDEX, settings.SHARD_COUNT)
+    if worker_index is not None:
+        contract_watchlist = shard_watchlist(contract_watchlist, worker_index, settings.SHARD_WORKERS, salt="worker")
+    return contract_watchlist
+
+
+def configure_logging(settings: ScraperSettings):
+    LOGGING.configure(file_name=settings.LOG_FILE,
+                      max_bytes=settings.LOG_FILE_MAX_BYTES,
+                      backup_count=settings.LOG_FILE_BACKUP_COUNT,
+                      use_queue=settings.LOG_QUEUE,
+                      queue_size=settings.LOG_QUEUE_SIZE,
+                      sample_every=settings.LOG_EVENT_SAMPLE_EVERY,
+                      max_events_per_second=settings.LOG_EVENT_MAX_PER_SECOND)
+
+
+def run_shard(worker_index: int, contract_watchlist: dict, rabbitmq_config: dict, endpoint: str,
+              settings: ScraperSettings, subscription_endpoint=None, fallback_endpoints=()):
+    """
+    Entry point of a shard worker process, runs a scraper over its part of the watchlist with its own checkpoint file,
+    log file and spool directory
+    """
+    if settings.LOG_FILE:
+        # rotating a file shared by several processes would lose records
+        settings.LOG_FILE = shard_file_path(settings.LOG_FILE, settings.SHARD_INDEX, worker_index)
+    configure_logging(settings)
+    if settings.WATCHLIST_RELOAD:
+        # the watchlist may have changed since the supervisor split it, e.g. when a crashed worker is restarted
+        contract_watchlist = load_shard_watchlist(settings, worker_index)
+    if settings.CHECKPOINT_PATH:
+        shard_path = shard_file_path(settings.CHECKPOINT_PATH, settings.SHARD_INDEX, worker_index)
+        take_over_checkpoints(settings.CHECKPOINT_PATH, shard_path, contract_watchlist, Web3.toChecksumAddress)
+        settings.CHECKPOINT_PATH = shard_path
+    if settings.SPOOL_DIRECTORY:
+        settings.SPOOL_DIRECTORY = shard_file_path(settings.SPOOL_DIRECTORY, settings.SHARD_INDEX, worker_index)
+    if settings.METRICS_PORT:
+        # one endpoint per worker
+        settings.METRICS_PORT += worker_index
+    event_scraper = EventScraper(contract_watchlist=contract_watchlist,
+                                 rabbitmq_config=rabbitmq_config,
+                                 endpoint=endpoint,
+                                 settings=settings,
+                                 subscription_endpoint=subscription_endpoint,
+                                 fallback_endpoints=fallback_endpoints,
+                                 watchlist_loader=functools.partial(load_shard_watchlist, settings, worker_index))
+    event_scraper.setup_filters()
+
+
 def main():
     endpoint = os.environ['RPC_ENDPOINT_HTTPS_URL']
+    subscription_endpoint = os.environ.get('RPC_ENDPOINT_WSS_URL')
+    # comma separated HTTP endpoints of other providers, used when the main one is slow or failing
+    fallback_endpoints = [url.strip() for url in os.environ.get('RPC_FALLBACK_HTTPS_URLS', '').split(',') if url.strip()]
     rabbitmq_config = {
         "host": os.environ["RABBIT_HOST_URL"],
         "port": int(os.environ["RABBIT_HOST_PORT"]),
@@ -168,11 +1163,26 @@ def main():
         "user": os.environ["RABBIT_USER"],
         "password": os.environ["RABBIT_PASSWORD"]
     }
+    settings = ScraperSettings.from_environment()
+    configure_logging(settings)
+
+    # the part of the watchlist this host is responsible for
+    contract_watchlist = load_shard_watchlist(settings)
+    if settings.SHARD_WORKERS:
+        shard_watchlists = {worker_index: shard_watchlist(contract_watchlist, worker_index, settings.SHARD_WORKERS,
+                                                          salt="worker")
+                            for worker_index in range(settings.SHARD_WORKERS)}
+        ShardSupervisor(shard_watchlists, run_shard, (rabbitmq_config, endpoint, settings, subscription_endpoint,
+                                                      fallback_endpoints)).run()
+        return
 
-    contract_watchlist = load_events_filter()
     event_scraper = EventScraper(contract_watchlist=contract_watchlist,
                                  rabbitmq_config=rabbitmq_config,
-                                 endpoint=endpoint)
+                                 endpoint=endpoint,
+                                 settings=settings,
+                                 subscription_endpoint=subscription_endpoint,
+                                 fallback_endpoints=fallback_endpoints,
+                                 watchlist_loader=functools.partial(load_shard_watchlist, settings))
     event_scraper.setup_filters()
 
 
@@ -0,0 +1,244 @@
+import bisect
+import threading
+
+from aiohttp import web
+
+from utils import get_logger
+
+"""
+In process metrics of the scraper, exposed in the Prometheus text format.
+Metrics are plain counters and bucket arrays updated in place, a labelled child is looked up once per update in a
+dict, so instrumenting the hot path costs well under a microsecond per event. Values are only formatted when the
+endpoint is scraped. Updates take a per child lock as the publisher and encoder threads update metrics as well.
+"""
+
+# seconds, from a fast JSON-RPC call or a single event decode to a slow provider
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(label_names, label_values, extra="") -> str:
+    labels = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+              for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        @return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.TYPE))
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+
+    TYPE = None
+
+    def __init__(self, name, documentation, label_names=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *label_values):
+        """
+        @return: the child of the metric for these label values, created on first use
+        """
+        child = self._children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError("Metric {} expects labels {}".format(self.name, self.label_names))
+            with self._children_lock:
+                child = self._children.setdefault(label_values, self.create_child())
+        return child
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = []
+        for label_values, child in list(self._children.items()):
+            lines += child.render(self.name, self.label_names, label_values)
+        return lines
+
+
+class _CounterChild:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, label_names, label_values):
+        return ["{}{} {}".format(name, format_labels(label_names, label_values), format_value(self.value))]
+
+
+class Counter(_Metric):
+
+    TYPE = "counter"
+
+    def create_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+
+    def __init__(self):
+        super().__init__()
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """
+        The value is read from function when the metrics are rendered, for values the code already keeps
+        """
+        self.function = function
+
+    def render(self, name, label_names, label_values):
+        value = self.function() if self.function is not None else self.value
+        return ["{}{} {}".format(name, format_labels(label_names, label_values), format_value(value))]
+
+
+class Gauge(_Metric):
+
+    TYPE = "gauge"
+
+    def create_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class _HistogramChild:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, label_names, label_values):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(
+                name, format_labels(label_names, label_values, 'le="{}"'.format(format_value(float(upper_bound)))),
+                cumulative))
+        labels = format_labels(label_names, label_values)
+        lines.append("{}_sum{} {}".format(name, labels, format_value(total)))
+        lines.append("{}_count{} {}".format(name, labels, cumulative))
+        return lines
+
+
+class Histogram(_Metric):
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names, registry)
+
+    def create_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class MetricsServer:
+    """
+    Serves the registry on http://<host>:<port>/metrics from the scraper event loop
+    """
+    def __init__(self, host, port, registry=REGISTRY):
+        self.logger = get_logger(self.__class__.__name__)
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        application = web.Application()
+        application.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(application, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info("Serving metrics on http://{}:{}/metrics".format(self.host, self.port))
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+RPC_REQUEST_SECONDS = Histogram("scraper_rpc_request_seconds", "JSON-RPC request latency", ["method"])
+RPC_ERRORS = Counter("scraper_rpc_errors_total", "JSON-RPC requests that failed", ["method"])
+EVENTS = Counter("scraper_events_total", "Events published, per contract event", ["address", "event"])
+DUPLICATE_EVENTS = Counter("scraper_duplicate_events_total", "Logs received again and dropped before decoding")
+DECODE_SECONDS = Histogram("scraper_decode_seconds", "Time to decode one log")
+SERIALIZE_SECONDS = Histogram("scraper_serialize_seconds", "Time to serialize one event message")
+ENCODE_BATCH_SECONDS = Histogram("scraper_encode_batch_seconds",
+                                 "Time to decode and serialize the logs of one poll on the encoder pool")
+PUBLISH_SECONDS = Histogram("scraper_publish_seconds",
+                            "Time to hand a message to RabbitMQ, or to the pipelined publisher queue")
+PUBLISH_CONFIRM_SECONDS = Histogram("scraper_publish_confirm_seconds",
+                                    "Time between publishing a message and the broker confirming it")
+PUBLISH_QUEUE_DEPTH = Gauge("scraper_publish_queue_depth", "Messages accepted but not yet confirmed by the broker")
+SPOOL_DEPTH = Gauge("scraper_spool_depth", "Messages waiting in the disk spool")
+HEAD_LAG_BLOCKS = Histogram("scraper_head_lag_blocks", "Blocks between the chain head and the block of a published event",
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 1000, 10000))
+HEAD_LAG_SECONDS = Histogram("scraper_head_lag_seconds",
+                             "Time between a block reaching the chain head and the publishing of its events")
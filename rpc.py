@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+
+import aiohttp
+
+from utils import get_logger
+
+"""
+Asynchronous JSON-RPC transport used on the polling path.
+All requests share one aiohttp session, so HTTP connections are kept alive and reused between polling cycles,
+and the number of requests in flight at the same time is capped by a semaphore.
+
+Optionally requests issued within a short window are coalesced into a single JSON-RPC batch POST, responses are split
+back to their callers by request id. If the endpoint rejects batches the client falls back to single requests.
+"""
+
+
+class AsyncJsonRpcClient:
+
+    MAX_CONCURRENT_REQUESTS = 16
+    CONNECTION_POOL_SIZE = 32
+    REQUEST_TIMEOUT_SECONDS = 30
+    # 0 disables batching
+    BATCH_WINDOW_SECONDS = 0.0
+    MAX_BATCH_SIZE = 100
+    # HTTP statuses with which endpoints that do not support batches answer to them
+    BATCH_REJECTION_STATUSES = (400, 405, 413, 415, 501)
+
+    def __init__(self, endpoint, max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                 connection_pool_size=CONNECTION_POOL_SIZE, request_timeout=REQUEST_TIMEOUT_SECONDS,
+                 batch_window=BATCH_WINDOW_SECONDS, max_batch_size=MAX_BATCH_SIZE):
+        self.logger = get_logger(self.__class__.__name__)
+        self.endpoint = endpoint
+        self.max_concurrent_requests = max_concurrent_requests
+        self.connection_pool_size = connection_pool_size
+        self.request_timeout = request_timeout
+        self._request_ids = itertools.count(1)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batch_supported = batch_window > 0
+        # set once the endpoint answered a batch with an error status
+        self.batch_rejected = False
+        self._pending_batch = []
+        self._batch_flush_handle = None
+        self._batch_tasks = set()
+        # both are bound to the running event loop, so they are created on first use
+        self._session = None
+        self._semaphore = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._session
+
+    def build_request(self, method, params) -> dict:
+        return {
+            "jsonrpc": "2.0",
+            "id": next(self._request_ids),
+            "method": method,
+            "params": params
+        }
+
+    @staticmethod
+    def get_result(response: dict):
+        """
+        Extracts the result out of a JSON-RPC response, errors are raised as ValueError the same way web3 does
+        """
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    async def post(self, payload):
+        session = self.get_session()
+        async with self._semaphore:
+            async with session.post(self.endpoint, json=payload) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def make_request(self, method, params):
+        """
+        Sends a JSON-RPC request and returns its result. When batching is enabled the request is queued and sent
+        together with all the other requests issued within the batch window
+        @param method: RPC method name, e.g. eth_getFilterChanges
+        @param params: list of positional parameters
+        @return: the "result" field of the response
+        """
+        request = self.build_request(method, params)
+        if not self.batch_supported:
+            return self.get_result(await self.post(request))
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending_batch.append((request, future))
+        if len(self._pending_batch) >= self.max_batch_size:
+            self.flush_batch()
+        elif self._batch_flush_handle is None:
+            self._batch_flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.flush_batch)
+        return self.get_result(await future)
+
+    def flush_batch(self):
+        """
+        Sends all the queued requests as one batch, in the background
+        """
+        if self._batch_flush_handle is not None:
+            self._batch_flush_handle.cancel()
+            self._batch_flush_handle = None
+        batch, self._pending_batch = self._pending_batch, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self.send_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def send_batch(self, batch):
+        """
+        Sends the batch and resolves each caller future with its own response
+        @param batch: list of (request, future) tuples
+        """
+        try:
+            if len(batch) == 1 or not self.batch_supported:
+                responses = await asyncio.gather(*[self.post(request) for request, _ in batch])
+            else:
+                responses = await self.post_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        responses_by_id = {response.get("id"): response for response in responses}
+        for request, future in batch:
+            if future.done():
+                continue
+            response = responses_by_id.get(request["id"])
+            if response is None:
+                future.set_exception(ValueError({"code": -32603,
+                                                 "message": "No response for request {}".format(request["id"])}))
+            else:
+                future.set_result(response)
+
+    async def post_batch(self, requests):
+        """
+        Posts a list of requests as one JSON-RPC batch. If the endpoint does not understand batches, batching is
+        turned off for the lifetime of the client and the requests are sent one by one
+        @return: list of responses, in any order
+        """
+        try:
+            responses = await self.post(requests)
+        except aiohttp.ClientResponseError as e:
+            if e.status not in self.BATCH_REJECTION_STATUSES:
+                raise
+            responses = e
+        if isinstance(responses, list):
+            return responses
+
+        self.logger.warning("Endpoint {} rejected a JSON-RPC batch ({}), falling back to single requests".format(
+            self.endpoint, responses))
+        self.batch_supported = False
+        self.batch_rejected = True
+        return await asyncio.gather(*[self.post(request) for request in requests])
+
+    async def make_batch_request(self, calls: list) -> list:
+        """
+        Sends several requests as one JSON-RPC batch, whatever the batch window, or one by one if the endpoint
+        rejected batches before
+        @param calls: list of (method, params)
+        @return: the results in the order of the calls, a ValueError in place of the result of a failed call
+        """
+        requests = [self.build_request(method, params) for method, params in calls]
+        if len(requests) == 1 or self.batch_rejected:
+            responses = await asyncio.gather(*[self.post(request) for request in requests])
+        else:
+            responses = await self.post_batch(requests)
+        responses_by_id = {response.get("id"): response for response in responses}
+        results = []
+        for request in requests:
+            response = responses_by_id.get(request["id"], {
+                "error": {"code": -32603, "message": "No response for request {}".format(request["id"])}})
+            try:
+                results.append(self.get_result(response))
+            except ValueError as e:
+                results.append(e)
+        return results
+
+    async def close(self):
+        self.flush_batch()
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,304 @@
+import asyncio
+import collections
+import random
+
+import aiohttp
+from web3._utils.rpc_abi import RPC
+
+import metrics
+from utils import get_logger
+
+"""
+Pool of JSON-RPC endpoints behind the asynchronous transport.
+Each endpoint keeps a moving latency average and a window of recent latencies. Requests go to a healthy endpoint picked
+at random with a weight inversely proportional to its latency, so a slow provider gets less and less traffic. An
+endpoint failing at the transport level (connection error, timeout, HTTP error status) is put aside for an
+exponentially growing period and the request is retried on another endpoint, with a growing delay between attempts.
+
+With hedging enabled, a request still unanswered after the p95 latency of its endpoint is also sent to another
+endpoint and the first answer wins.
+Filters only exist on the node they were created on: they are created on the primary endpoint, or on another healthy one
+while the primary is put aside, and their requests always go to that endpoint. Once it is put aside, requests of its
+filters fail with FilterEndpointUnavailable so that the filters are created again elsewhere.
+Every endpoint remembers the highest head it reported with eth_blockNumber. eth_getLogs over a block range ending at a
+block number only goes to endpoints known to have reached that block: the missed blocks are filled in up to a head read
+from one endpoint and checkpointed once done, a provider lagging behind it would silently return part of the logs.
+"""
+
+
+class EndpointState:
+
+    # number of recent latencies kept to compute the hedging threshold
+    LATENCY_WINDOW = 200
+    # weight of the newest sample in the moving latency average
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, client):
+        """
+        @param client: the AsyncJsonRpcClient of the endpoint
+        """
+        self.client = client
+        self.latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+        self.average_latency = None
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        # highest chain head the endpoint reported, None before its first eth_blockNumber answer
+        self.head_block = None
+
+    @property
+    def endpoint(self):
+        return self.client.endpoint
+
+    def is_healthy(self, now) -> bool:
+        return now >= self.unhealthy_until
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        if self.average_latency is None:
+            self.average_latency = latency
+        else:
+            self.average_latency += self.LATENCY_SMOOTHING * (latency - self.average_latency)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def record_failure(self, now, base_backoff, max_backoff) -> float:
+        """
+        Puts the endpoint aside, for twice as long as the previous time if it failed just before
+        @return: the number of seconds the endpoint is put aside for
+        """
+        self.consecutive_failures += 1
+        backoff = min(base_backoff * 2 ** (self.consecutive_failures - 1), max_backoff)
+        self.unhealthy_until = now + backoff
+        return backoff
+
+    def latency_percentile(self, percentile):
+        """
+        @return: the given percentile of the recent latencies, None while there are too few of them
+        """
+        if len(self.latencies) < RpcEndpointPool.MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class FilterEndpointUnavailable(Exception):
+    """
+    The endpoint a filter was created on is put aside, the filter has to be created again on another endpoint
+    """
+
+
+class RpcEndpointPool:
+
+    MAX_ATTEMPTS = 4
+    # delay before the second attempt of a request, doubled at every attempt
+    RETRY_BACKOFF_SECONDS = 0.1
+    MAX_RETRY_BACKOFF_SECONDS = 5
+    # time a failing endpoint is put aside for, doubled at every consecutive failure
+    UNHEALTHY_BACKOFF_SECONDS = 1
+    MAX_UNHEALTHY_BACKOFF_SECONDS = 60
+    HEDGE_PERCENTILE = 95
+    # an endpoint is only hedged once this many latencies were measured on it
+    MIN_HEDGE_SAMPLES = 20
+    MIN_HEDGE_DELAY_SECONDS = 0.05
+    # latency assumed for endpoints that did not answer yet, so they are tried early
+    UNKNOWN_LATENCY_SECONDS = 0.05
+    # requests bound to the node the filter in their first parameter was created on
+    FILTER_METHODS = (RPC.eth_getFilterChanges, RPC.eth_getFilterLogs, RPC.eth_uninstallFilter)
+    TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+    # method label of JSON-RPC batches in the metrics
+    BATCH = "batch"
+
+    def __init__(self, clients: list, max_attempts=MAX_ATTEMPTS, hedge_requests=False,
+                 hedge_percentile=HEDGE_PERCENTILE):
+        """
+        @param clients: one AsyncJsonRpcClient per endpoint, the first one is the primary endpoint
+        @param max_attempts: number of endpoints a request is tried on before its error is raised
+        @param hedge_requests: send slow requests to a second endpoint as well
+        @param hedge_percentile: latency percentile of an endpoint after which its requests are hedged
+        """
+        if not clients:
+            raise ValueError("The RPC endpoint pool needs at least one endpoint")
+        self.logger = get_logger(self.__class__.__name__)
+        self.endpoints = [EndpointState(client) for client in clients]
+        self.primary = self.endpoints[0]
+        self.max_attempts = max_attempts
+        self.hedge_requests = hedge_requests and len(self.endpoints) > 1
+        self.hedge_percentile = hedge_percentile
+        # filter id -> EndpointState the filter was created on, unknown filters are looked for on the primary endpoint
+        self.filter_endpoints = {}
+
+    @property
+    def endpoint(self):
+        return self.primary.endpoint
+
+    def choose_endpoint(self, exclude=(), among=None) -> EndpointState:
+        """
+        Picks a healthy endpoint at random, weighted by the inverse of its latency. When every endpoint is put aside,
+        the one that comes back first is used
+        @param exclude: endpoints already tried for the request, only used again when there is no other endpoint
+        @param among: endpoints to choose from, all of them by default
+        """
+        now = asyncio.get_running_loop().time()
+        among = among or self.endpoints
+        candidates = [state for state in among if state not in exclude] or among
+        healthy = [state for state in candidates if state.is_healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda state: state.unhealthy_until)
+        weights = [1 / max(state.average_latency or self.UNKNOWN_LATENCY_SECONDS, 0.001) for state in healthy]
+        return random.choices(healthy, weights=weights)[0]
+
+    async def call(self, state: EndpointState, method, params):
+        """
+        Sends the request to one endpoint and updates its health. A BATCH method sends the (method, params) list in
+        params as one batch
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            if method == self.BATCH:
+                result = await state.client.make_batch_request(params)
+            else:
+                result = await state.client.make_request(method, params)
+        except self.TRANSPORT_ERRORS as e:
+            metrics.RPC_ERRORS.labels(method).inc()
+            backoff = state.record_failure(loop.time(), self.UNHEALTHY_BACKOFF_SECONDS,
+                                           self.MAX_UNHEALTHY_BACKOFF_SECONDS)
+            self.logger.warning("RPC endpoint {} failed on {} ({}), putting it aside for {} seconds".format(
+                state.endpoint, method, repr(e), backoff))
+            raise
+        except ValueError:
+            # a JSON-RPC error is still an answer from a healthy endpoint
+            metrics.RPC_ERRORS.labels(method).inc()
+            state.record_success(loop.time() - started)
+            raise
+        latency = loop.time() - started
+        state.record_success(latency)
+        metrics.RPC_REQUEST_SECONDS.labels(method).observe(latency)
+        if method == RPC.eth_blockNumber:
+            state.head_block = max(state.head_block or 0, int(result, 16))
+            # the highest head reported by any endpoint: it never goes backwards when the next read goes to a lagging
+            # endpoint, nor falls behind the start of a filter created elsewhere, eth_getLogs only goes to
+            # endpoints that reached it
+            return hex(max(endpoint.head_block or 0 for endpoint in self.endpoints))
+        elif method == RPC.eth_newFilter:
+            self.filter_endpoints[result] = state
+        return result
+
+    @staticmethod
+    def required_block(method, params):
+        """
+        @return: the block an endpoint has to have reached to answer the request completely, None for any endpoint
+        """
+        if method != RPC.eth_getLogs or not params or not isinstance(params[0], dict):
+            return None
+        to_block = params[0].get('toBlock')
+        if isinstance(to_block, int):
+            return to_block
+        if isinstance(to_block, str) and to_block.startswith("0x"):
+            return int(to_block, 16)
+        return None
+
+    async def endpoints_at(self, block_number: int) -> list:
+        """
+        @return: the endpoints known to have reached block_number, the heads of the healthy endpoints are read first
+        when there are none
+        """
+        endpoints = [state for state in self.endpoints if (state.head_block or -1) >= block_number]
+        if endpoints:
+            return endpoints
+        now = asyncio.get_running_loop().time()
+        await asyncio.gather(*[self.call(state, RPC.eth_blockNumber, []) for state in self.endpoints
+                               if state.is_healthy(now)], return_exceptions=True)
+        endpoints = [state for state in self.endpoints if (state.head_block or -1) >= block_number]
+        if not endpoints:
+            raise ValueError("No RPC endpoint reached block {} yet, try again later".format(block_number))
+        return endpoints
+
+    def filter_endpoint(self, method, params) -> EndpointState:
+        """
+        @return: the endpoint the filter of the request was created on
+        @raise FilterEndpointUnavailable: when that endpoint is put aside
+        """
+        filter_id = params[0] if params else None
+        state = self.filter_endpoints.get(filter_id, self.primary)
+        if method == RPC.eth_uninstallFilter:
+            self.filter_endpoints.pop(filter_id, None)
+        if not state.is_healthy(asyncio.get_running_loop().time()):
+            self.filter_endpoints.pop(filter_id, None)
+            raise FilterEndpointUnavailable("filter {} not found, its endpoint {} is put aside".format(
+                filter_id, state.endpoint))
+        return state
+
+    async def make_request(self, method, params):
+        """
+        Same as AsyncJsonRpcClient.make_request, transport failures are retried on other endpoints
+        @return: the "result" field of the response
+        """
+        tried = set()
+        last_error = None
+        required_block = self.required_block(method, params)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(min(self.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1),
+                                        self.MAX_RETRY_BACKOFF_SECONDS))
+            among = None
+            if method in self.FILTER_METHODS:
+                state = self.filter_endpoint(method, params)
+            elif method == RPC.eth_newFilter and self.primary.is_healthy(asyncio.get_running_loop().time()):
+                state = self.primary
+            else:
+                if required_block is not None:
+                    among = await self.endpoints_at(required_block)
+                state = self.choose_endpoint(exclude=tried, among=among)
+            tried.add(state)
+            try:
+                if self.hedge_requests and method not in self.FILTER_METHODS + (RPC.eth_newFilter,):
+                    return await self.hedged_call(state, method, params, among)
+                return await self.call(state, method, params)
+            except self.TRANSPORT_ERRORS as e:
+                last_error = e
+        raise last_error
+
+    async def make_batch_request(self, calls: list) -> list:
+        """
+        Same as AsyncJsonRpcClient.make_batch_request, the whole batch is retried on other endpoints on transport
+        failures
+        """
+        return await self.make_request(self.BATCH, calls)
+
+    async def hedged_call(self, state: EndpointState, method, params, among=None):
+        """
+        Sends the request to the endpoint and, if it is slower than its usual p95 latency, to a second endpoint too.
+        The first successful answer is returned and the other request is cancelled
+        @param among: endpoints the second one is chosen from, all of them by default
+        """
+        hedge_delay = state.latency_percentile(self.hedge_percentile)
+        if hedge_delay is None:
+            return await self.call(state, method, params)
+
+        first = asyncio.ensure_future(self.call(state, method, params))
+        done, _ = await asyncio.wait({first}, timeout=max(hedge_delay, self.MIN_HEDGE_DELAY_SECONDS))
+        if done:
+            return first.result()
+
+        backup = self.choose_endpoint(exclude={state}, among=among)
+        if backup is state or not backup.is_healthy(asyncio.get_running_loop().time()):
+            return await first
+        pending = {first, asyncio.ensure_future(self.call(backup, method, params))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not isinstance(error, self.TRANSPORT_ERRORS):
+                        raise error
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def close(self):
+        await asyncio.gather(*[state.client.close() for state in self.endpoints])
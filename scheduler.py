@@ -0,0 +1,67 @@
+import asyncio
+import collections
+import random
+
+from utils import get_logger
+
+"""
+New block driven polling.
+A single task watches the chain head with one cheap eth_blockNumber call per cadence, shared by all filter loops.
+Filter loops wait for a block newer than the one they last polled at instead of sleeping a fixed interval, so no
+eth_getFilterChanges call is made while the chain did not move.
+"""
+
+
+class ChainHeadScheduler:
+
+    # number of recent head blocks whose arrival time is kept
+    HEAD_HISTORY_SIZE = 1024
+
+    def __init__(self, w3i, head_poll_interval: float, jitter: float = 0.0):
+        """
+        @param w3i: the Web3Interface used to read the chain head
+        @param head_poll_interval: seconds between two chain head reads
+        @param jitter: maximum random delay, in seconds, added before waking each filter loop on a new block,
+        spreads the polls of many filters when requests are not batched
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.w3i = w3i
+        self.head_poll_interval = head_poll_interval
+        self.jitter = jitter
+        self.head_block = None
+        # block number -> event loop time at which it was first seen as the chain head
+        self.head_seen_at = collections.OrderedDict()
+        self._new_block = asyncio.Condition()
+
+    async def run(self):
+        """
+        Watches the chain head for as long as the scraper runs
+        """
+        while True:
+            try:
+                head_block = await self.w3i.get_block_number()
+            except Exception:
+                self.logger.exception("Problem reading the chain head, retrying in {} seconds".format(
+                    self.head_poll_interval))
+            else:
+                if self.head_block is None or head_block > self.head_block:
+                    self.head_seen_at[head_block] = asyncio.get_running_loop().time()
+                    while len(self.head_seen_at) > self.HEAD_HISTORY_SIZE:
+                        self.head_seen_at.popitem(last=False)
+                    async with self._new_block:
+                        self.head_block = head_block
+                        self._new_block.notify_all()
+            await asyncio.sleep(self.head_poll_interval)
+
+    async def wait_for_block_after(self, block_number) -> int:
+        """
+        Waits until the chain head is past block_number (any head when block_number is None)
+        @return: the new chain head
+        """
+        async with self._new_block:
+            await self._new_block.wait_for(
+                lambda: self.head_block is not None and (block_number is None or self.head_block > block_number))
+            head_block = self.head_block
+        if self.jitter:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+        return head_block
@@ -0,0 +1,115 @@
+import json
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+try:
+    import cbor2
+except ImportError:  # optional, only needed for the cbor message format
+    cbor2 = None
+
+"""
+Single pass serialization of the messages sent over RabbitMQ.
+The decoded event (AttributeDict, HexBytes, bytes, tuples of nested structs) is walked once into plain python values,
+dispatching on the exact type instead of going through an isinstance chain per value, and encoded straight into the
+message bytes. The output has the same layout as the one produced through myweb3encoding.to_json.
+
+Besides JSON, a compact binary CBOR encoding can be selected. CBOR is used over msgpack as it carries uint256 values
+natively (bignums) instead of overflowing. The format is signalled to consumers through the AMQP content type.
+"""
+
+
+def _plain_mapping(value):
+    return {key: to_plain(item) for key, item in value.items()}
+
+
+def _plain_sequence(value):
+    return [to_plain(item) for item in value]
+
+
+def _hex_bytes(value):
+    return value.hex()
+
+
+def _hex_raw_bytes(value):
+    return "0x" + value.hex()
+
+
+_CONVERTERS = {
+    AttributeDict: _plain_mapping,
+    dict: _plain_mapping,
+    list: _plain_sequence,
+    tuple: _plain_sequence,
+    HexBytes: _hex_bytes,
+    bytes: _hex_raw_bytes,
+    bytearray: _hex_raw_bytes,
+}
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+def to_plain(value):
+    """
+    Converts a decoded event, or any value nested in one, into JSON compatible python values
+    """
+    converter = _CONVERTERS.get(type(value))
+    if converter is not None:
+        return converter(value)
+    if isinstance(value, _PLAIN_TYPES):
+        return value
+    # subclasses of the known types
+    if isinstance(value, HexBytes):
+        return _hex_bytes(value)
+    if isinstance(value, (bytes, bytearray)):
+        return _hex_raw_bytes(value)
+    if isinstance(value, (AttributeDict, dict)):
+        return _plain_mapping(value)
+    if isinstance(value, (list, tuple)):
+        return _plain_sequence(value)
+    raise TypeError("Object of type {} is not serializable".format(type(value).__name__))
+
+
+class MessageSerializer:
+
+    JSON = "json"
+    CBOR = "cbor"
+
+    CONTENT_TYPES = {
+        JSON: "application/json",
+        CBOR: "application/cbor",
+    }
+
+    def __init__(self, message_format=JSON):
+        if message_format not in self.CONTENT_TYPES:
+            raise ValueError("Message format {} not supported. Currently supported are: {}".format(
+                message_format, list(self.CONTENT_TYPES)))
+        if message_format == self.CBOR and cbor2 is None:
+            raise ValueError("Message format {} requires the cbor2 package to be installed".format(message_format))
+        self.message_format = message_format
+        self.content_type = self.CONTENT_TYPES[message_format]
+        self._json_encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def serialize(self, event, filter_arguments: dict, event_name: str) -> bytes:
+        """
+        Builds the message published for an event
+        @param event: the decoded event as returned by web3
+        @param filter_arguments: the dict with the filter parameters used
+        @param event_name: the Event name
+        @return: the encoded message bytes
+        """
+        data = {
+            "event_name": event_name,
+            "filter_arguments": filter_arguments,
+            "event_data": to_plain(event)
+        }
+        return self.encode(data)
+
+    def encode(self, data) -> bytes:
+        if self.message_format == self.CBOR:
+            return cbor2.dumps(data)
+        return self._json_encoder.encode(data).encode("utf8")
+
+    def decode(self, message: bytes):
+        if self.message_format == self.CBOR:
+            return cbor2.loads(message)
+        return json.loads(message)
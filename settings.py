@@ -0,0 +1,163 @@
+import os
+
+"""
+Optional tuning knobs for the scraper.
+Every knob has a default that keeps the original behaviour, except CHECKPOINT_PATH: checkpoints are on by default
+so a restart resumes where the previous run stopped. Each knob can be overridden with an environment variable
+of the same name prefixed by SCRAPER_ (e.g. SCRAPER_CONSOLIDATE_FILTERS=true)
+"""
+
+
+class ScraperSettings:
+
+    ENVIRONMENT_PREFIX = "SCRAPER_"
+
+    # compile the whole watchlist into one (or a few) log filters instead of one filter per contract event
+    CONSOLIDATE_FILTERS = False
+    # maximum number of contract addresses that are packed in a single consolidated log filter
+    MAX_ADDRESSES_PER_QUERY = 500
+
+    # maximum number of RPC requests in flight at the same time on the asynchronous transport
+    RPC_MAX_CONCURRENT_REQUESTS = 16
+    # size of the shared keep-alive HTTP connection pool used by the asynchronous transport
+    RPC_CONNECTION_POOL_SIZE = 32
+    # requests issued within this window are sent as a single JSON-RPC batch, 0 disables batching
+    RPC_BATCH_WINDOW_SECONDS = 0.0
+    RPC_MAX_BATCH_SIZE = 100
+    # number of endpoints (from RPC_ENDPOINT_HTTPS_URL and RPC_FALLBACK_HTTPS_URLS) a failing request is tried on
+    RPC_MAX_ATTEMPTS = 4
+    # also send a request to a second endpoint when the first one is slower than its usual RPC_HEDGE_PERCENTILE latency
+    RPC_HEDGE_REQUESTS = False
+    RPC_HEDGE_PERCENTILE = 95
+
+    # filters with integer fromBlock and toBlock are backfilled with eth_getLogs over chunks of this many blocks
+    BACKFILL_CHUNK_SIZE = 2000
+    # number of concurrent eth_getLogs workers used by a backfill
+    BACKFILL_WORKERS = 8
+
+    # publish through a bounded queue drained in batches with publisher confirms instead of one blocking publish per event
+    PUBLISH_PIPELINE = False
+    # events waiting to be published, pollers wait when the queue is full
+    PUBLISH_QUEUE_SIZE = 10000
+    PUBLISH_BATCH_SIZE = 500
+    # messages published but not yet confirmed by the broker, publishing waits above this
+    PUBLISH_MAX_UNCONFIRMED = 5000
+
+    # encoding of the published messages: "json" or "cbor" (compact binary, requires the cbor2 package)
+    MESSAGE_FORMAT = "json"
+    # workers decoding and serializing logs in parallel, 0 does it on the event loop
+    ENCODER_WORKERS = 0
+    # "process" spreads the work over cores, "thread" avoids pickling logs for light workloads
+    ENCODER_POOL_TYPE = "process"
+    # logs handed to an encoder worker at once
+    ENCODER_CHUNK_SIZE = 200
+
+    # SQLite file keeping the last fully published block per contract event, an empty value disables checkpoints
+    CHECKPOINT_PATH = "checkpoints.sqlite"
+    CHECKPOINT_INTERVAL_SECONDS = 5
+
+    # poll the filters only when a new block appears instead of every POLLING_INTERVAL_SECONDS
+    POLL_ON_NEW_BLOCKS = False
+    # seconds between two chain head reads, 0 uses the cadence of the chain (Blockchains.HEAD_POLL_INTERVAL_SECONDS)
+    HEAD_POLL_INTERVAL_SECONDS = 0.0
+    # maximum random delay before a filter is polled on a new block, spreads the requests of many filters
+    POLL_JITTER_SECONDS = 0.0
+
+    # drop logs already seen in the last DEDUP_WINDOW_BLOCKS blocks below the highest block seen, 0 disables it
+    DEDUP_WINDOW_BLOCKS = 0
+    # identifiers of logs older than the window kept in a bloom filter of this capacity (two generations), 0 disables it
+    DEDUP_BLOOM_CAPACITY = 0
+    # share of the logs older than the window wrongly taken for duplicates by the bloom filter
+    DEDUP_BLOOM_ERROR_RATE = 0.001
+
+    # add the timestamp of its block (blockTimestamp) and the sender of its transaction (transactionFrom) to each event
+    ENRICH_BLOCK_TIMESTAMP = False
+    ENRICH_TRANSACTION_SENDER = False
+    # block timestamps and transaction senders kept in memory, shared by all filters
+    ENRICH_BLOCK_CACHE_SIZE = 4096
+    ENRICH_TRANSACTION_CACHE_SIZE = 65536
+    # block and transaction lookups sent in one JSON-RPC batch
+    ENRICH_BATCH_SIZE = 100
+
+    # directory of the disk spool keeping the messages RabbitMQ could not take, an empty value disables it
+    SPOOL_DIRECTORY = ""
+    # size from which a new spool segment file is started
+    SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+    # spooled messages published again at once, and seconds between two attempts while the broker is unreachable
+    SPOOL_REPLAY_BATCH_SIZE = 500
+    SPOOL_REPLAY_INTERVAL_SECONDS = 1.0
+
+    # reload contract-watchlist.json when it changes (checked every WATCHLIST_RELOAD_INTERVAL_SECONDS) or on SIGHUP,
+    # only the filters of the contract events that changed are created or stopped
+    WATCHLIST_RELOAD = False
+    WATCHLIST_RELOAD_INTERVAL_SECONDS = 2.0
+    # JSON file caching the event entries of the contract ABIs by content hash, an empty value disables it
+    ABI_CACHE_PATH = ""
+
+    # receive logs pushed over RPC_ENDPOINT_WSS_URL with eth_subscribe("logs") instead of polling filters
+    SUBSCRIBE_LOGS = False
+
+    # this host only watches the contracts of shard SHARD_INDEX out of SHARD_COUNT (stable hashing of the address)
+    SHARD_INDEX = 0
+    SHARD_COUNT = 1
+    # worker processes the contracts of this host are split across, restarted when they crash. 0 runs one process
+    SHARD_WORKERS = 0
+
+    # port of the local Prometheus metrics endpoint (/metrics), 0 disables it. Shard workers use METRICS_PORT + index
+    METRICS_PORT = 0
+    METRICS_HOST = "127.0.0.1"
+
+    # log file of the scraper, an empty value only logs to stdout
+    LOG_FILE = "debug_log.txt"
+    # size in bytes at which the log file is rotated, keeping LOG_FILE_BACKUP_COUNT old files. 0 never rotates it
+    LOG_FILE_MAX_BYTES = 0
+    LOG_FILE_BACKUP_COUNT = 5
+    # format and write log records on a background thread instead of the thread logging them
+    LOG_QUEUE = False
+    # records waiting for the logging thread, records are dropped (and counted) above it
+    LOG_QUEUE_SIZE = 10000
+    # only log one out of every LOG_EVENT_SAMPLE_EVERY per event messages
+    LOG_EVENT_SAMPLE_EVERY = 1
+    # per event messages logged per second for each log statement, 0 does not limit them
+    LOG_EVENT_MAX_PER_SECOND = 0
+
+    def __init__(self, **overrides):
+        for name, value in overrides.items():
+            if not self.is_setting(name):
+                raise ValueError("Unknown scraper setting {}".format(name))
+            setattr(self, name, value)
+
+    @classmethod
+    def is_setting(cls, name):
+        return name.isupper() and name != "ENVIRONMENT_PREFIX" and hasattr(cls, name)
+
+    @classmethod
+    def setting_names(cls):
+        return [name for name in dir(cls) if cls.is_setting(name)]
+
+    @classmethod
+    def from_environment(cls, environment=None):
+        """
+        Builds the settings out of the SCRAPER_* environment variables, values are cast to the type of the default
+        @param environment: mapping to read from, defaults to os.environ
+        @return: a ScraperSettings instance
+        """
+        if environment is None:
+            environment = os.environ
+        overrides = {}
+        for name in cls.setting_names():
+            raw_value = environment.get(cls.ENVIRONMENT_PREFIX + name)
+            if raw_value is None:
+                continue
+            overrides[name] = cls.cast_value(getattr(cls, name), raw_value)
+        return cls(**overrides)
+
+    @staticmethod
+    def cast_value(default, raw_value):
+        if isinstance(default, bool):
+            return raw_value.strip().lower() in ("1", "true", "yes", "on")
+        if isinstance(default, int):
+            return int(raw_value)
+        if isinstance(default, float):
+            return float(raw_value)
+        return raw_value
@@ -0,0 +1,171 @@
+import glob
+import hashlib
+import multiprocessing
+import os
+import time
+
+from checkpoints import CheckpointStore
+from utils import get_logger
+
+"""
+Horizontal sharding of the watchlist.
+Contracts are assigned to shards with rendezvous (highest random weight) hashing of their address: every shard gets
+a pseudo random score per address and the highest score wins. The assignment only depends on the address and on the
+set of shards, and adding a shard only moves the contracts the new shard wins, roughly 1/N of them, everything else
+stays where it was. The watchlist is first split across hosts (SHARD_INDEX out of SHARD_COUNT) then, on a host,
+across worker processes.
+
+Every worker process keeps its own checkpoint file. When a worker starts it takes over the newest checkpoints of its
+contracts from the sibling files, so a contract moved by a rebalance resumes where its previous shard stopped.
+"""
+
+
+def shard_score(shard, address: str) -> int:
+    digest = hashlib.blake2b("{}:{}".format(shard, address.lower()).encode("utf8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_for_address(address: str, shard_count: int, salt="") -> int:
+    """
+    @param address: contract address, case insensitive
+    @param shard_count: number of shards
+    @param salt: separates independent levels of sharding (hosts, processes of a host)
+    @return: the shard index, between 0 and shard_count - 1, that owns the address
+    """
+    return max(range(shard_count), key=lambda shard: shard_score("{}{}".format(salt, shard), address))
+
+
+def shard_watchlist(contract_watchlist: dict, shard_index: int, shard_count: int, salt="") -> dict:
+    """
+    @return: a copy of the watchlist with only the contracts owned by the shard
+    """
+    if shard_count <= 1:
+        return contract_watchlist
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("Shard index {} out of range for {} shards".format(shard_index, shard_count))
+    shard = dict(contract_watchlist)
+    shard['contracts'] = [contract_data for contract_data in contract_watchlist['contracts']
+                          if shard_for_address(contract_data['address'], shard_count, salt) == shard_index]
+    return shard
+
+
+def shard_file_path(path: str, host_index: int, worker_index: int) -> str:
+    """
+    @return: the file of a worker (checkpoints, logs), next to the unsharded file
+    """
+    root, extension = os.path.splitext(path)
+    return "{}.shard-{}-{}{}".format(root, host_index, worker_index, extension)
+
+
+def sibling_checkpoint_paths(checkpoint_path: str) -> list:
+    """
+    @return: the unsharded checkpoint file and the files of every shard, the ones that exist
+    """
+    root, extension = os.path.splitext(checkpoint_path)
+    paths = glob.glob("{}.shard-*{}".format(glob.escape(root), extension))
+    if os.path.exists(checkpoint_path):
+        paths.append(checkpoint_path)
+    return sorted(paths)
+
+
+def take_over_checkpoints(checkpoint_path: str, shard_path: str, contract_watchlist: dict, to_checksum_address):
+    """
+    Brings the checkpoint file of a shard up to date with the newest checkpoints of its contracts in the sibling files
+    """
+    keys = {(to_checksum_address(contract_data['address']), event_name)
+            for contract_data in contract_watchlist['contracts']
+            for event_name in contract_data['events_to_listen']}
+    store = CheckpointStore(shard_path)
+    try:
+        for path in sibling_checkpoint_paths(checkpoint_path):
+            if os.path.abspath(path) != os.path.abspath(shard_path):
+                store.merge_from(path, keys)
+        store.flush()
+    finally:
+        store.close()
+
+
+class ShardSupervisor:
+
+    CHECK_INTERVAL_SECONDS = 1
+    RESTART_DELAY_SECONDS = 1
+    MAX_RESTART_DELAY_SECONDS = 60
+    # a worker that ran at least this long before crashing is restarted right away
+    HEALTHY_UPTIME_SECONDS = 300
+
+    def __init__(self, shard_watchlists: dict, target, arguments: tuple):
+        """
+        @param shard_watchlists: worker index -> watchlist of the worker
+        @param target: function run in every worker process, called with (worker index, watchlist, *arguments)
+        @param arguments: the other arguments of target, must be picklable
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.shard_watchlists = shard_watchlists
+        self.target = target
+        self.arguments = arguments
+        # spawned, not forked, so workers do not inherit the threads and sockets of the supervisor
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.started_at = {}
+        self.restart_delays = {}
+        self.restart_at = {}
+
+    def start(self, worker_index):
+        process = self.context.Process(target=self.target,
+                                       args=(worker_index, self.shard_watchlists[worker_index]) + self.arguments,
+                                       name="scraper-shard-{}".format(worker_index))
+        process.start()
+        self.processes[worker_index] = process
+        self.started_at[worker_index] = time.monotonic()
+        self.logger.info("Started shard worker {} (pid {}) for {} contracts".format(
+            worker_index, process.pid, len(self.shard_watchlists[worker_index]['contracts'])))
+
+    def check_workers(self):
+        """
+        Restarts the workers that exited, with a growing delay for workers that keep crashing right after starting
+        """
+        now = time.monotonic()
+        for worker_index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if process.exitcode == 0:
+                # nothing left to watch, e.g. a shard made only of historical backfills
+                self.logger.info("Shard worker {} is done".format(worker_index))
+                del self.processes[worker_index]
+                continue
+            if worker_index not in self.restart_at:
+                if now - self.started_at[worker_index] >= self.HEALTHY_UPTIME_SECONDS:
+                    self.restart_delays[worker_index] = 0
+                else:
+                    self.restart_delays[worker_index] = min(
+                        max(self.restart_delays.get(worker_index, 0) * 2, self.RESTART_DELAY_SECONDS),
+                        self.MAX_RESTART_DELAY_SECONDS)
+                self.restart_at[worker_index] = now + self.restart_delays[worker_index]
+                self.logger.error("Shard worker {} exited with code {}, restarting it in {} seconds".format(
+                    worker_index, process.exitcode, self.restart_delays[worker_index]))
+            if now >= self.restart_at[worker_index]:
+                del self.restart_at[worker_index]
+                self.start(worker_index)
+
+    def run(self):
+        """
+        Starts one process per non empty shard and keeps them running until interrupted or all of them are done
+        """
+        for worker_index, watchlist in sorted(self.shard_watchlists.items()):
+            if watchlist['contracts']:
+                self.start(worker_index)
+            else:
+                self.logger.info("Shard worker {} has no contracts, not starting it".format(worker_index))
+        try:
+            while self.processes:
+                time.sleep(self.CHECK_INTERVAL_SECONDS)
+                self.check_workers()
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
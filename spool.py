@@ -0,0 +1,198 @@
+import collections
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from utils import get_logger
+
+"""
+Local disk spool of the messages RabbitMQ could not take, so the pollers keep going while the broker is unreachable or
+slower than the chain without losing events nor growing the memory.
+Messages are appended to segment files, each record being its length, its CRC32 and the message. Segments are only
+ever appended to and are read through memory maps. The read cursor is written to a small file once messages are
+published, and segments entirely behind it are deleted, so the spool survives restarts and replays what was left in
+order. A record cut short by a crash is dropped when the spool is opened again.
+"""
+
+
+class DiskSpool:
+
+    HEADER = struct.Struct("<II")
+    SEGMENT_BYTES = 64 * 1024 * 1024
+    SEGMENT_SUFFIX = ".segment"
+    CURSOR_FILE = "cursor"
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES):
+        """
+        @param directory: directory of the segment files, created when missing. Only one spool may use it at a time
+        @param segment_bytes: size from which a new segment file is started
+        """
+        self.logger = get_logger(self.__class__.__name__)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # appends come from the event loop and from the publisher thread
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.acknowledged = self.load_cursor()
+        segments = sorted(int(name[:-len(self.SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                          if name.endswith(self.SEGMENT_SUFFIX))
+        for segment in segments:
+            if segment < self.acknowledged[0]:
+                os.remove(self.segment_path(segment))
+        segments = [segment for segment in segments if segment >= self.acknowledged[0]] or [self.acknowledged[0]]
+        # segment number -> offset of the end of its last complete record
+        self.segment_ends = {}
+        self.depth = 0
+        self.mappings = {}
+        for segment in segments:
+            start = self.acknowledged[1] if segment == self.acknowledged[0] else 0
+            end, count = self.scan(segment, start)
+            self.segment_ends[segment] = end
+            self.depth += count
+        self.write_segment = segments[-1]
+        self.writer = open(self.segment_path(self.write_segment), "ab")
+        if self.writer.tell() != self.segment_ends[self.write_segment]:
+            self.logger.warning("Dropping {} bytes of an incomplete record at the end of the spool".format(
+                self.writer.tell() - self.segment_ends[self.write_segment]))
+            self.writer.truncate(self.segment_ends[self.write_segment])
+            self.writer.seek(self.segment_ends[self.write_segment])
+
+        self.read_position = self.acknowledged
+        # positions of the messages read and not yet acknowledged, in reading order
+        self.in_flight = collections.deque()
+        self.unread = self.depth
+        if self.depth:
+            self.logger.info("Loaded {} spooled messages from {}".format(self.depth, directory))
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "{:020d}{}".format(segment, self.SEGMENT_SUFFIX))
+
+    def load_cursor(self) -> tuple:
+        """
+        @return: (segment, offset) of the first message not yet published
+        """
+        try:
+            with open(os.path.join(self.directory, self.CURSOR_FILE), "rt") as fin:
+                segment, offset = fin.read().split()
+            return int(segment), int(offset)
+        except FileNotFoundError:
+            return 0, 0
+
+    def save_cursor(self, position: tuple):
+        path = os.path.join(self.directory, self.CURSOR_FILE)
+        with open(path + ".tmp", "wt") as fout:
+            fout.write("{} {}".format(*position))
+        os.replace(path + ".tmp", path)
+
+    def scan(self, segment: int, start: int) -> tuple:
+        """
+        Walks the records of a segment, checking their CRC
+        @return: (end of the last complete record, number of records after start)
+        """
+        if not os.path.exists(self.segment_path(segment)):
+            return 0, 0
+        size = os.path.getsize(self.segment_path(segment))
+        if size <= start:
+            return start, 0
+        offset, count = start, 0
+        with open(self.segment_path(segment), "rb") as fin, \
+                mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            while offset + self.HEADER.size <= size:
+                length, crc = self.HEADER.unpack_from(view, offset)
+                end = offset + self.HEADER.size + length
+                if end > size or zlib.crc32(view[offset + self.HEADER.size:end]) != crc:
+                    break
+                offset, count = end, count + 1
+        return offset, count
+
+    def append(self, message: bytes):
+        """
+        Writes the message at the end of the spool. It is handed to the OS before returning, so it survives the
+        process crashing but not the host losing power
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        record = self.HEADER.pack(len(message), zlib.crc32(message)) + message
+        with self.lock:
+            if self.segment_ends[self.write_segment] and \
+                    self.segment_ends[self.write_segment] + len(record) > self.segment_bytes:
+                self.writer.close()
+                self.write_segment += 1
+                self.segment_ends[self.write_segment] = 0
+                self.writer = open(self.segment_path(self.write_segment), "ab")
+            self.writer.write(record)
+            self.writer.flush()
+            self.segment_ends[self.write_segment] += len(record)
+            self.depth += 1
+            self.unread += 1
+
+    def view(self, segment: int, end: int):
+        """
+        @return: a memory map of the segment covering at least its first end bytes
+        """
+        mapping = self.mappings.get(segment)
+        if mapping is None or len(mapping) < end:
+            if mapping is not None:
+                mapping.close()
+            with open(self.segment_path(segment), "rb") as fin:
+                mapping = self.mappings[segment] = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapping
+
+    def read(self, max_messages: int) -> list:
+        """
+        Reads the next messages, they stay in the spool until acknowledged
+        @return: list of (position, message), position being the one to acknowledge once the message is published
+        """
+        messages = []
+        with self.lock:
+            segment, offset = self.read_position
+            while self.unread and len(messages) < max_messages:
+                end = self.segment_ends[segment]
+                if offset >= end:
+                    segment, offset = segment + 1, 0
+                    continue
+                view = self.view(segment, end)
+                length, _ = self.HEADER.unpack_from(view, offset)
+                start = offset + self.HEADER.size
+                offset = start + length
+                messages.append(((segment, offset), view[start:offset]))
+                self.in_flight.append((segment, offset))
+                self.unread -= 1
+            self.read_position = segment, offset
+        return messages
+
+    def acknowledge(self, position: tuple):
+        """
+        Removes the messages read up to position from the spool, deleting the segments left behind
+        """
+        with self.lock:
+            while self.in_flight and self.in_flight[0] <= position:
+                self.in_flight.popleft()
+                self.depth -= 1
+            self.acknowledged = position
+            self.save_cursor(position)
+            for segment in [segment for segment in self.segment_ends if segment < position[0]]:
+                del self.segment_ends[segment]
+                mapping = self.mappings.pop(segment, None)
+                if mapping is not None:
+                    mapping.close()
+                os.remove(self.segment_path(segment))
+
+    def rewind(self):
+        """
+        Messages read and not acknowledged are read again, e.g. after publishing them failed
+        """
+        with self.lock:
+            self.unread += len(self.in_flight)
+            self.in_flight.clear()
+            self.read_position = self.acknowledged
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+            for mapping in self.mappings.values():
+                mapping.close()
+            self.mappings.clear()
@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import json
+
+import websockets
+from web3._utils.method_formatters import log_entry_formatter
+
+from utils import get_logger
+
+"""
+Push based log delivery over a websocket endpoint with eth_subscribe("logs").
+Every log query becomes one subscription. When the socket drops, the subscriber reconnects with a growing delay and
+subscribes again; a callback is awaited after every (re)subscription, before any pushed log is handed over, so the
+caller can fill the blocks missed while disconnected and keep logs in order.
+"""
+
+
+class LogSubscriber:
+
+    RECONNECT_DELAY_SECONDS = 1
+    MAX_RECONNECT_DELAY_SECONDS = 30
+
+    def __init__(self, endpoint):
+        self.logger = get_logger(self.__class__.__name__)
+        self.endpoint = endpoint
+        # number of times on_subscribed completed, a new value means the subscriptions were made again in between
+        self.subscriptions_made = 0
+        self._request_ids = itertools.count(1)
+        # pushed logs not handed over yet, None while not subscribed
+        self._notifications = None
+        self._handing_over = False
+
+    @property
+    def caught_up(self) -> bool:
+        """
+        @return: True while subscribed, with every log received so far handed over
+        """
+        return self._notifications is not None and self._notifications.empty() and not self._handing_over
+
+    async def run(self, subscriptions: list, handle_log, on_subscribed):
+        """
+        Keeps the subscriptions alive for as long as the scraper runs
+        @param subscriptions: list of eth_subscribe logs parameters (address, topics)
+        @param handle_log: coroutine function called with (subscription index, formatted log entry)
+        @param on_subscribed: coroutine function awaited after every (re)subscription
+        """
+        reconnect_delay = self.RECONNECT_DELAY_SECONDS
+        while True:
+            try:
+                async with websockets.connect(self.endpoint, max_size=None) as socket:
+                    subscription_indexes, early_notifications = await self.subscribe(socket, subscriptions)
+                    reconnect_delay = self.RECONNECT_DELAY_SECONDS
+                    await self.deliver(socket, subscription_indexes, early_notifications, handle_log, on_subscribed)
+                self.logger.error("Websocket {} closed by the endpoint, subscribing again in {} seconds".format(
+                    self.endpoint, reconnect_delay))
+            except (websockets.exceptions.WebSocketException, OSError, asyncio.TimeoutError) as e:
+                self.logger.error("Websocket {} dropped ({}), subscribing again in {} seconds".format(
+                    self.endpoint, e, reconnect_delay))
+            except Exception:
+                self.logger.exception("Unknown problem with the subscriptions on {}, subscribing again in {} seconds".format(
+                    self.endpoint, reconnect_delay))
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, self.MAX_RECONNECT_DELAY_SECONDS)
+
+    async def subscribe(self, socket, subscriptions: list):
+        """
+        @return: subscription id -> index of the subscription in the given list, and the logs pushed by the first
+        subscriptions while waiting for the confirmation of the others
+        """
+        request_indexes = {}
+        for index, params in enumerate(subscriptions):
+            request_id = next(self._request_ids)
+            request_indexes[request_id] = index
+            await socket.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "eth_subscribe",
+                                          "params": ["logs", params]}))
+
+        subscription_indexes = {}
+        early_notifications = []
+        while len(subscription_indexes) < len(subscriptions):
+            response = json.loads(await socket.recv())
+            if response.get("id") not in request_indexes:
+                early_notifications.append(response)
+                continue
+            if "error" in response:
+                raise ValueError(response["error"])
+            subscription_indexes[response["result"]] = request_indexes[response["id"]]
+        self.logger.info("Subscribed to {} log subscriptions on {}".format(len(subscription_indexes), self.endpoint))
+        return subscription_indexes, early_notifications
+
+    async def deliver(self, socket, subscription_indexes: dict, early_notifications: list, handle_log, on_subscribed):
+        """
+        Buffers pushed logs while on_subscribed runs, then hands them over in arrival order.
+        Returns once the endpoint closed the socket and every received log was handed over
+        """
+        notifications = asyncio.Queue()
+        for notification in early_notifications:
+            notifications.put_nowait(notification)
+
+        async def read():
+            async for message in socket:
+                notifications.put_nowait(json.loads(message))
+
+        reader = asyncio.ensure_future(read())
+        try:
+            await on_subscribed()
+            self.subscriptions_made += 1
+            self._notifications = notifications
+            while True:
+                if notifications.empty():
+                    next_notification = asyncio.ensure_future(notifications.get())
+                    await asyncio.wait({next_notification, reader}, return_when=asyncio.FIRST_COMPLETED)
+                    if not next_notification.done():
+                        next_notification.cancel()
+                        # the socket closed, raises the close reason if there is one
+                        reader.result()
+                        return
+                    notification = next_notification.result()
+                else:
+                    notification = notifications.get_nowait()
+                if notification.get("method") != "eth_subscription":
+                    continue
+                index = subscription_indexes.get(notification["params"]["subscription"])
+                if index is not None:
+                    self._handing_over = True
+                    try:
+                        await handle_log(index, log_entry_formatter(notification["params"]["result"]))
+                    finally:
+                        self._handing_over = False
+        finally:
+            self._notifications = None
+            reader.cancel()
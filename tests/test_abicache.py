@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from abicache import AbiCache
+from tests.test_watchlist import ERC20_EVENTS_ABI
+
+
+def test_event_abis_are_served_from_the_cache_after_a_restart(tmp_path):
+    path = str(tmp_path / "abi-cache.json")
+    cache = AbiCache(path)
+    transfer_abi = cache.find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+    assert transfer_abi["inputs"][2]["name"] == "value"
+    assert cache.misses == 1
+    cache.flush()
+
+    cache = AbiCache(path)
+    assert cache.find_event_abi(ERC20_EVENTS_ABI, "Transfer") == transfer_abi
+    assert cache.find_event_abi(ERC20_EVENTS_ABI, "Approval")["name"] == "Approval"
+    assert (cache.hits, cache.misses) == (2, 0)
+    with pytest.raises(ValueError):
+        cache.find_event_abi(ERC20_EVENTS_ABI, "Swap")
+
+
+def test_changed_abi_is_a_new_entry(tmp_path):
+    path = str(tmp_path / "abi-cache.json")
+    cache = AbiCache(path)
+    cache.find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+    changed_abi = json.loads(ERC20_EVENTS_ABI)
+    changed_abi[0]["inputs"][2]["name"] = "amount"
+    assert cache.find_event_abi(json.dumps(changed_abi), "Transfer")["inputs"][2]["name"] == "amount"
+    assert cache.misses == 2
+
+
+def test_flush_keeps_entries_written_by_other_processes(tmp_path):
+    path = str(tmp_path / "abi-cache.json")
+    first, second = AbiCache(path), AbiCache(path)
+    first.find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+    first.flush()
+    other_abi = json.dumps([{"anonymous": False, "name": "Sync", "type": "event", "inputs": []}])
+    second.find_event_abi(other_abi, "Sync")
+    second.flush()
+
+    cache = AbiCache(path)
+    cache.find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+    cache.find_event_abi(other_abi, "Sync")
+    assert cache.misses == 0
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / "abi-cache.json"
+    path.write_text("{not json")
+    cache = AbiCache(str(path))
+    assert cache.find_event_abi(ERC20_EVENTS_ABI, "Transfer")["name"] == "Transfer"
+    cache.flush()
+    assert AbiCache(str(path)).entries == cache.entries
@@ -0,0 +1,106 @@
+import asyncio
+import random
+
+import aiohttp
+import pytest
+
+from backfill import BackfillEngine
+
+
+class FakeLogSource:
+    """
+    Serves two logs per block and rejects queries spanning more than max_blocks blocks, like providers do
+    """
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self.queried_ranges = []
+
+    async def get_logs(self, filter_params):
+        from_block, to_block = filter_params['fromBlock'], filter_params['toBlock']
+        self.queried_ranges.append((from_block, to_block))
+        await asyncio.sleep(random.random() / 100)
+        if to_block - from_block + 1 > self.max_blocks:
+            raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+        log_entries = [{'blockNumber': block, 'logIndex': log_index}
+                       for block in range(from_block, to_block + 1) for log_index in (1, 0)]
+        random.shuffle(log_entries)
+        return log_entries
+
+
+def run_backfill(log_source, from_block, to_block, chunk_size, workers):
+    handled = []
+
+    async def handle_log(log_entry):
+        handled.append((log_entry['blockNumber'], log_entry['logIndex']))
+
+    engine = BackfillEngine(log_source, chunk_size=chunk_size, workers=workers)
+    count = asyncio.run(engine.run({'address': []}, handle_log, from_block, to_block))
+    return count, handled
+
+
+def test_backfill_handles_logs_in_order():
+    count, handled = run_backfill(FakeLogSource(max_blocks=1000), 100, 599, chunk_size=10, workers=8)
+
+    expected = [(block, log_index) for block in range(100, 600) for log_index in (0, 1)]
+    assert handled == expected
+    assert count == len(expected)
+
+
+def test_backfill_halves_chunks_on_result_size_errors():
+    log_source = FakeLogSource(max_blocks=7)
+    count, handled = run_backfill(log_source, 0, 99, chunk_size=64, workers=4)
+
+    assert handled == [(block, log_index) for block in range(100) for log_index in (0, 1)]
+    # the chunks handed out after the first rejections are already small enough
+    rejected = [(from_block, to_block) for from_block, to_block in log_source.queried_ranges
+                if to_block - from_block + 1 > 7]
+    assert len(rejected) < 10
+
+
+def test_rate_limits_are_not_result_size_errors():
+    assert BackfillEngine.is_result_size_error(ValueError({'code': -32005, 'message': 'query returned more than 10000 '
+                                                                                      'results'}))
+    assert BackfillEngine.is_result_size_error(ValueError({'code': -32000, 'message': 'too many logs in range'}))
+    assert not BackfillEngine.is_result_size_error(
+        aiohttp.ClientResponseError(None, (), status=429, message="Too Many Requests"))
+    assert not BackfillEngine.is_result_size_error(ValueError({'code': -32005, 'message': 'daily request rate limit '
+                                                                                          'exceeded'}))
+
+
+def test_backfill_retries_rate_limited_chunks_without_halving(monkeypatch):
+    monkeypatch.setattr(BackfillEngine, "RETRY_BACKOFF_SECONDS", 0.001)
+
+    class RateLimitedLogSource(FakeLogSource):
+        async def get_logs(self, filter_params):
+            if len(self.queried_ranges) < 6:
+                self.queried_ranges.append((filter_params['fromBlock'], filter_params['toBlock']))
+                raise ValueError({'code': -32005, 'message': 'daily request rate limit exceeded'})
+            return await super().get_logs(filter_params)
+
+    log_source = RateLimitedLogSource(max_blocks=1000)
+    count, handled = run_backfill(log_source, 0, 99, chunk_size=10, workers=4)
+    assert handled == [(block, log_index) for block in range(100) for log_index in (0, 1)]
+    assert all(to_block - from_block + 1 == 10 for from_block, to_block in log_source.queried_ranges)
+
+
+def test_backfill_fails_once_a_chunk_used_up_its_attempts(monkeypatch):
+    monkeypatch.setattr(BackfillEngine, "RETRY_BACKOFF_SECONDS", 0.001)
+    attempts = []
+
+    class OverloadedLogSource:
+        async def get_logs(self, filter_params):
+            attempts.append(filter_params['fromBlock'])
+            raise ValueError({'code': -32005, 'message': 'rate limit exceeded'})
+
+    with pytest.raises(ValueError, match="rate limit"):
+        run_backfill(OverloadedLogSource(), 0, 9, chunk_size=10, workers=1)
+    assert len(attempts) == BackfillEngine.MAX_FETCH_ATTEMPTS
+
+
+def test_backfill_propagates_other_errors():
+    class BrokenLogSource:
+        async def get_logs(self, filter_params):
+            raise ValueError({'code': -32602, 'message': 'invalid method params'})
+
+    with pytest.raises(ValueError, match="invalid method params"):
+        run_backfill(BrokenLogSource(), 0, 99, chunk_size=10, workers=4)
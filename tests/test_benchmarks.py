@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from benchmarks.run_benchmarks import build_watchlist, histogram_percentiles
+from benchmarks.standins import FakeEthereumNode, InMemoryBroker, InMemoryAsyncRabbitPublisher, \
+    load_example_message, synthetic_addresses
+from metrics import Histogram, MetricsRegistry
+from serialization import to_plain
+from watchlist import WatchlistIndex
+from web3environment import Web3Interface, Blockchains
+
+
+def test_fake_node_serves_decodable_logs():
+    addresses = synthetic_addresses(3)
+    node = FakeEthereumNode(addresses, logs_per_block=6, block_time=0.05)
+    endpoint = node.start()
+
+    async def scenario():
+        w3i = Web3Interface(blockchain=Blockchains.ETHEREUM, endpoint=endpoint)
+        try:
+            log_query, = WatchlistIndex(w3i.web3, build_watchlist(addresses), w3i.blockchain).compile_log_queries(500)
+            log_filter = w3i.web3.eth.filter(log_query.filter_params())
+            head_block = await w3i.get_block_number()
+            await asyncio.sleep(0.3)
+            return head_block, await w3i.get_new_entries(log_filter, decode=False), log_query
+        finally:
+            await w3i.close()
+
+    try:
+        head_block, log_entries, log_query = asyncio.run(scenario())
+    finally:
+        node.stop()
+    # only blocks after the filter creation, every one with all of its logs
+    assert log_entries and min(log_entry['blockNumber'] for log_entry in log_entries) > node.FIRST_BLOCK
+    assert len(log_entries) % 6 == 0
+    assert {log_entry['address'] for log_entry in log_entries} == set(addresses)
+
+    expected_args = load_example_message()["event_data"]["args"]
+    for log_entry in log_entries:
+        event = to_plain(log_query.demultiplex(log_entry).decode(log_entry))
+        assert event["args"] == expected_args
+        assert node.block_times[event["blockNumber"]] > 0
+
+
+def test_in_memory_publisher_confirms_messages():
+    async def scenario():
+        broker = InMemoryBroker()
+        publisher = InMemoryAsyncRabbitPublisher(broker, {"exchange": "events", "routing_key": "events.all"})
+        await publisher.connect()
+        publisher_task = asyncio.ensure_future(publisher.run())
+        for index in range(10):
+            await publisher.publish(json.dumps({"index": index}).encode())
+        await publisher.flush(timeout=5)
+        publisher_task.cancel()
+        return broker, publisher
+
+    broker, publisher = asyncio.run(scenario())
+    assert [json.loads(message)["index"] for message in broker.messages] == list(range(10))
+    assert publisher.depth == 0
+
+
+def test_histogram_percentiles_interpolate_buckets():
+    histogram = Histogram("test_seconds", "test", buckets=(1, 2, 4), registry=MetricsRegistry())
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+    summary = histogram_percentiles(histogram.labels())
+    assert summary["count"] == 4
+    assert summary["p50"] == 1.5
+    assert 2 < summary["p95"] <= 4
@@ -0,0 +1,36 @@
+from checkpoints import CheckpointStore
+
+ADDRESS = "0x3845badAde8e6dFF049820680d1F14bD3903a5d0"
+
+
+def test_checkpoints_survive_restart(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    store = CheckpointStore(path)
+    assert store.get(ADDRESS, "Transfer") is None
+
+    store.record(ADDRESS, "Transfer", 100)
+    store.record(ADDRESS, "Approval", 90)
+    store.flush()
+    store.record(ADDRESS, "Transfer", 120)
+    store.close()
+
+    # the last record was never flushed, so the restart resumes from the flushed block
+    store = CheckpointStore(path)
+    assert store.get(ADDRESS, "Transfer") == 100
+    assert store.get(ADDRESS, "Approval") == 90
+    store.close()
+
+
+def test_checkpoints_never_move_backwards(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"))
+    store.record(ADDRESS, "Transfer", 100)
+    store.record(ADDRESS, "Transfer", 50)
+    assert store.get(ADDRESS, "Transfer") == 100
+
+    changes = store.pending_changes()
+    store.record(ADDRESS, "Transfer", 150)
+    store.flush(changes)
+    store.flush()
+    store.close()
+
+    assert CheckpointStore(str(tmp_path / "checkpoints.sqlite")).get(ADDRESS, "Transfer") == 150
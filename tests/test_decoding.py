@@ -0,0 +1,87 @@
+import os
+import json
+
+import pytest
+from eth_abi import encode_abi
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from decoding import EventDecoder, find_event_abi
+from serialization import to_plain
+from tests.test_watchlist import raw_log, ERC20_EVENTS_ABI, TOKEN_A, TRANSFER_TOPIC
+
+SEAPORT_ADDRESS = "0x00000000006c3852cbEf3e08E8dF289169EdE581"
+
+
+@pytest.fixture
+def seaport_abi():
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "contract-watchlist.json"), "rt") as fin:
+        contract_watchlist = json.load(fin)
+    for contract_data in contract_watchlist["contracts"]:
+        if contract_data["address"].lower() == SEAPORT_ADDRESS.lower():
+            return contract_data["abi"]
+
+
+@pytest.fixture
+def order_fulfilled_log():
+    """
+    The raw log the example message was decoded from
+    """
+    with open(os.path.join(os.path.dirname(__file__), "example.OrderFulfilled.json"), "rt") as fin:
+        event_data = json.load(fin)["event_data"]
+    args = event_data["args"]
+    data = encode_abi(["bytes32", "address", "(uint8,address,uint256,uint256)[]",
+                       "(uint8,address,uint256,uint256,address)[]"],
+                      [bytes.fromhex(args["orderHash"][2:]), args["recipient"],
+                       [tuple(item) for item in args["offer"]], [tuple(item) for item in args["consideration"]]])
+    raw_entry = {
+        "address": event_data["address"].lower(),
+        "topics": [Web3.keccak(text="OrderFulfilled(bytes32,address,address,address,(uint8,address,uint256,uint256)[],"
+                                    "(uint8,address,uint256,uint256,address)[])").hex(),
+                   "0x" + args["offerer"][2:].lower().rjust(64, "0"),
+                   "0x" + args["zone"][2:].lower().rjust(64, "0")],
+        "data": "0x" + data.hex(),
+        "blockNumber": hex(event_data["blockNumber"]),
+        "blockHash": event_data["blockHash"],
+        "transactionHash": event_data["transactionHash"],
+        "transactionIndex": hex(event_data["transactionIndex"]),
+        "logIndex": hex(event_data["logIndex"]),
+        "removed": False,
+    }
+    return log_entry_formatter(raw_entry), event_data
+
+
+def test_decoded_struct_event_matches_web3(seaport_abi, order_fulfilled_log):
+    log_entry, expected_event_data = order_fulfilled_log
+    decoder = EventDecoder.for_abi(find_event_abi(seaport_abi, "OrderFulfilled"))
+    contract = Web3().eth.contract(address=SEAPORT_ADDRESS, abi=seaport_abi)
+
+    decoded = decoder.decode(log_entry)
+    assert decoded == expected_event_data
+    assert decoded == to_plain(contract.events.OrderFulfilled().processLog(log_entry))
+    # same key order as web3, so messages are byte for byte the same as before
+    assert json.dumps(decoded) == json.dumps(to_plain(contract.events.OrderFulfilled().processLog(log_entry)))
+
+
+def test_decoder_is_shared_between_contracts():
+    transfer_abi = find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+    assert EventDecoder.for_abi(transfer_abi) is EventDecoder.for_abi(dict(transfer_abi))
+
+    decoded = EventDecoder.for_abi(transfer_abi).decode(log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC)))
+    assert decoded["args"] == {"from": Web3.toChecksumAddress("0x" + "11" * 20),
+                               "to": Web3.toChecksumAddress("0x" + "22" * 20),
+                               "value": 125}
+
+
+def test_log_with_other_indexed_layout_is_rejected():
+    # an ERC-721 Transfer has the same signature, but the token id is indexed
+    log_entry = raw_log(TOKEN_A, TRANSFER_TOPIC)
+    log_entry["topics"].append(log_entry.pop("data"))
+    log_entry["data"] = "0x"
+    with pytest.raises(ValueError):
+        EventDecoder.for_abi(find_event_abi(ERC20_EVENTS_ABI, "Transfer")).decode(log_entry_formatter(log_entry))
+
+
+def test_unknown_event_is_rejected():
+    with pytest.raises(ValueError):
+        find_event_abi(ERC20_EVENTS_ABI, "Swap")
@@ -0,0 +1,63 @@
+from hexbytes import HexBytes
+
+from dedup import BloomFilter, DuplicateFilter
+
+
+def log_entry(block_number, log_index=0, block_hash=None):
+    return {
+        "blockNumber": block_number,
+        "blockHash": HexBytes(block_hash or block_number.to_bytes(32, "big")),
+        "transactionHash": HexBytes((block_number * 1000 + log_index).to_bytes(32, "big")),
+        "logIndex": log_index,
+    }
+
+
+def test_duplicates_within_window_are_dropped():
+    duplicate_filter = DuplicateFilter(window_blocks=10)
+    assert not duplicate_filter.is_duplicate(log_entry(100))
+    assert not duplicate_filter.is_duplicate(log_entry(100, log_index=1))
+    assert duplicate_filter.is_duplicate(log_entry(100))
+    # same log in a reorganised block
+    assert not duplicate_filter.is_duplicate(log_entry(100, block_hash=b"\x01" * 32))
+    # out of order blocks inside the window are tracked as well
+    assert not duplicate_filter.is_duplicate(log_entry(105))
+    assert not duplicate_filter.is_duplicate(log_entry(99))
+    assert duplicate_filter.is_duplicate(log_entry(99))
+
+
+def test_memory_is_bounded_by_the_window():
+    duplicate_filter = DuplicateFilter(window_blocks=5)
+    for block_number in range(1000):
+        for log_index in range(3):
+            duplicate_filter.is_duplicate(log_entry(block_number, log_index))
+    assert len(duplicate_filter) == 5 * 3
+    assert sorted(duplicate_filter.blocks) == list(range(995, 1000))
+    # without a bloom filter logs older than the window are let through
+    assert not duplicate_filter.is_duplicate(log_entry(10))
+
+
+def test_bloom_filter_remembers_logs_older_than_the_window():
+    duplicate_filter = DuplicateFilter(window_blocks=5, bloom_capacity=1000, bloom_error_rate=0.001)
+    for block_number in range(100):
+        duplicate_filter.is_duplicate(log_entry(block_number))
+    assert len(duplicate_filter) == 5
+    assert all(duplicate_filter.is_duplicate(log_entry(block_number)) for block_number in range(90))
+    assert not duplicate_filter.is_duplicate(log_entry(10, log_index=7))
+    assert duplicate_filter.is_duplicate(log_entry(10, log_index=7))
+
+
+def test_bloom_filter_generations_keep_memory_flat():
+    duplicate_filter = DuplicateFilter(window_blocks=1, bloom_capacity=100)
+    for block_number in range(1000):
+        duplicate_filter.is_duplicate(log_entry(block_number))
+    assert len(duplicate_filter.bloom_filters) == 2
+    assert all(bloom_filter.count <= 100 for bloom_filter in duplicate_filter.bloom_filters)
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom_filter = BloomFilter(capacity=10000, error_rate=0.01)
+    for index in range(10000):
+        bloom_filter.add(index.to_bytes(8, "big"))
+    assert all(index.to_bytes(8, "big") in bloom_filter for index in range(10000))
+    false_positives = sum(index.to_bytes(8, "big") in bloom_filter for index in range(10000, 30000))
+    assert false_positives < 20000 * 0.02
@@ -0,0 +1,161 @@
+import asyncio
+
+import pika
+import pytest
+
+from distribution import AsyncRabbitPublisher, RabbitPublisher
+
+
+class FakeChannel:
+    def __init__(self):
+        self.published = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append(body)
+
+
+class FakeFrame:
+    def __init__(self, method):
+        self.method = method
+
+
+def rabbitmq_config():
+    return {"host": "localhost", "port": 5672, "exchange": "events", "routing_key": "events.all",
+            "user": "guest", "password": "guest"}
+
+
+def test_messages_are_published_in_batches_and_confirmed():
+    async def scenario():
+        publisher = AsyncRabbitPublisher(rabbitmq_config(), batch_size=4)
+        channel = FakeChannel()
+        publisher._channel = channel
+        for index in range(10):
+            await publisher.publish("message {}".format(index))
+
+        await publisher.publish_batch(await publisher.next_batch())
+        assert len(channel.published) == 4
+        await publisher.publish_batch(await publisher.next_batch())
+        await publisher.publish_batch(await publisher.next_batch())
+        assert channel.published == ["message {}".format(index) for index in range(10)]
+        assert publisher.depth == 10
+
+        publisher.on_delivery_confirmation(FakeFrame(pika.spec.Basic.Ack(delivery_tag=6, multiple=True)))
+        publisher.on_delivery_confirmation(FakeFrame(pika.spec.Basic.Nack(delivery_tag=7)))
+        publisher.on_delivery_confirmation(FakeFrame(pika.spec.Basic.Ack(delivery_tag=10, multiple=True)))
+        assert publisher.confirmed_count == 9
+        assert publisher.depth == 1
+
+        # the nacked message goes out again, ahead of the queue
+        await publisher.publish("message 10")
+        await publisher.publish_batch(await publisher.next_batch())
+        assert channel.published[10:] == ["message 6", "message 10"]
+
+    asyncio.run(scenario())
+
+
+def test_unconfirmed_messages_are_published_again_after_channel_loss():
+    async def scenario():
+        publisher = AsyncRabbitPublisher(rabbitmq_config(), batch_size=10)
+        publisher._channel = FakeChannel()
+        for index in range(3):
+            await publisher.publish("message {}".format(index))
+        await publisher.publish_batch(await publisher.next_batch())
+        publisher.on_delivery_confirmation(FakeFrame(pika.spec.Basic.Ack(delivery_tag=1)))
+
+        publisher.on_connection_closed(None, "broker restarted")
+        assert publisher._channel is None
+
+        channel = FakeChannel()
+        publisher._channel = channel
+        publisher._delivery_tag = 0
+        await publisher.publish_batch(await publisher.next_batch())
+        assert channel.published == ["message 1", "message 2"]
+
+    asyncio.run(scenario())
+
+
+def test_publish_cancelled_on_a_full_queue_is_not_pending():
+    async def scenario():
+        publisher = AsyncRabbitPublisher(rabbitmq_config(), queue_size=1)
+        await publisher.publish("message 0")
+        blocked = asyncio.ensure_future(publisher.publish("message 1"))
+        await asyncio.sleep(0)
+        blocked.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+        assert publisher.depth == 1
+
+        publisher._channel = FakeChannel()
+        await publisher.publish_batch(await publisher.next_batch())
+        publisher.on_delivery_confirmation(FakeFrame(pika.spec.Basic.Ack(delivery_tag=1)))
+        assert publisher.depth == 0
+        assert publisher.is_confirmed_through(publisher.last_sequence)
+
+    asyncio.run(scenario())
+
+
+def test_blocking_publisher_reconnects_after_a_failed_publish():
+    class FailingChannel(FakeChannel):
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            raise pika.exceptions.StreamLostError("connection reset")
+
+    class StubPublisher(RabbitPublisher):
+        def __init__(self, channels):
+            self.channels = channels
+            super().__init__(rabbitmq_config())
+
+        def create_channel(self):
+            return self.channels.pop(0)
+
+    channel = FakeChannel()
+    publisher = StubPublisher([FailingChannel(), channel])
+    with pytest.raises(pika.exceptions.StreamLostError):
+        publisher.publish("message 0")
+    assert not publisher.connected
+
+    publisher.reconnect()
+    publisher.publish("message 1")
+    assert publisher.connected
+    assert channel.published == ["message 1"]
+
+
+class FakeConnection:
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.is_open = True
+        self.lost = False
+        self.confirming_channels = []
+
+    def channel(self):
+        connection = self
+
+        class ConfirmingChannel(FakeChannel):
+            def __init__(self):
+                super().__init__()
+                self.connection = connection
+
+            def exchange_declare(self, **kwargs):
+                pass
+
+            def confirm_delivery(self):
+                connection.confirming_channels.append(self)
+
+        return ConfirmingChannel()
+
+    def process_data_events(self, time_limit=None):
+        if self.lost:
+            raise pika.exceptions.StreamLostError("missed heartbeats from client")
+
+
+def test_blocking_publisher_confirms_deliveries_and_keeps_the_connection_alive(monkeypatch):
+    monkeypatch.setattr(pika, "BlockingConnection", FakeConnection)
+    publisher = RabbitPublisher(rabbitmq_config())
+    connection = publisher._channel.connection
+    assert connection.parameters.heartbeat == RabbitPublisher.HEARTBEAT_SECONDS
+    assert connection.confirming_channels == [publisher._channel]
+
+    publisher.keep_alive()
+    assert publisher.connected
+    connection.lost = True
+    publisher.keep_alive()
+    assert not publisher.connected
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+from web3._utils.method_formatters import log_entry_formatter
+
+from decoding import EventDecoder, find_event_abi
+from encoderpool import MessageEncoderPool
+from serialization import MessageSerializer
+from watchlist import WatchedEvent
+from tests.test_watchlist import raw_log, ERC20_EVENTS_ABI, TOKEN_A, TRANSFER_TOPIC
+
+
+@pytest.fixture
+def transfer_event():
+    return WatchedEvent(TOKEN_A, "Transfer", {"fromBlock": "latest"},
+                        EventDecoder.for_abi(find_event_abi(ERC20_EVENTS_ABI, "Transfer")))
+
+
+@pytest.mark.parametrize("pool_type", [MessageEncoderPool.PROCESS, MessageEncoderPool.THREAD])
+def test_messages_keep_log_order(transfer_event, pool_type):
+    matched_logs = [(transfer_event, log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC,
+                                                                 block_number=block_number, log_index=log_index)))
+                    for block_number in range(1, 11) for log_index in range(5)]
+
+    async def scenario():
+        pool = MessageEncoderPool(pool_type=pool_type, workers=2, chunk_size=7)
+        try:
+            return await pool.encode(matched_logs)
+        finally:
+            pool.close()
+
+    messages = asyncio.run(scenario())
+    serializer = MessageSerializer()
+    assert messages == [serializer.serialize(watched_event.decode(log_entry), watched_event.filter_arguments,
+                                             watched_event.event_name)
+                        for watched_event, log_entry in matched_logs]
+    assert [(json.loads(message)["event_data"]["blockNumber"], json.loads(message)["event_data"]["logIndex"])
+            for message in messages] == [(block_number, log_index)
+                                         for block_number in range(1, 11) for log_index in range(5)]
+
+
+def test_undecodable_log_is_skipped(transfer_event):
+    broken_log = raw_log(TOKEN_A, TRANSFER_TOPIC)
+    broken_log["data"] = "0x"
+    matched_logs = [(transfer_event, log_entry_formatter(broken_log)),
+                    (transfer_event, log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC)))]
+
+    async def scenario():
+        pool = MessageEncoderPool(pool_type=MessageEncoderPool.THREAD, workers=1)
+        try:
+            return await pool.encode(matched_logs)
+        finally:
+            pool.close()
+
+    messages = asyncio.run(scenario())
+    assert messages[0] is None
+    assert json.loads(messages[1])["event_data"]["args"]["value"] == 125
+
+
+def test_enrichments_are_added_to_events(transfer_event):
+    matched_logs = [(transfer_event, log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC, block_number=block_number)))
+                    for block_number in (1, 2)]
+
+    async def scenario():
+        pool = MessageEncoderPool(pool_type=MessageEncoderPool.PROCESS, workers=1)
+        try:
+            return await pool.encode(matched_logs, [{"blockTimestamp": 1001}, {"blockTimestamp": None}])
+        finally:
+            pool.close()
+
+    messages = asyncio.run(scenario())
+    assert [json.loads(message)["event_data"]["blockTimestamp"] for message in messages] == [1001, None]
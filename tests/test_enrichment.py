@@ -0,0 +1,102 @@
+import asyncio
+
+from hexbytes import HexBytes
+
+from enrichment import EventEnricher, LRUCache
+
+SENDER = "0x21a31Ee1afC51d94C2eFcCAa2092aD1028285549"
+
+
+class RecordingInterface:
+    """
+    Stands for the Web3Interface, answers block and transaction lookups and records the batches it received
+    """
+    def __init__(self, delay=0.0, missing=()):
+        self.batches = []
+        self.delay = delay
+        self.missing = set(missing)
+
+    async def make_batch_request(self, calls):
+        self.batches.append(calls)
+        await asyncio.sleep(self.delay)
+        results = []
+        for method, params in calls:
+            if params[0] in self.missing:
+                results.append(ValueError("not found"))
+            elif method == "eth_getBlockByHash":
+                results.append({"hash": params[0], "timestamp": hex(int(params[0], 16) + 1000)})
+            else:
+                results.append({"hash": params[0], "from": SENDER.lower()})
+        return results
+
+
+def log_entry(block_number, transaction_index):
+    return {
+        "blockNumber": block_number,
+        "blockHash": HexBytes(block_number.to_bytes(32, "big")),
+        "transactionHash": HexBytes((block_number * 1000 + transaction_index).to_bytes(32, "big")),
+    }
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_one_block_lookup_serves_all_events_of_the_block():
+    w3i = RecordingInterface()
+    enricher = EventEnricher(w3i, block_timestamps=True, transaction_senders=True, batch_size=100)
+    log_entries = [log_entry(block_number, index) for block_number in (10, 11) for index in range(5)]
+    enrichments = asyncio.run(enricher.enrich(log_entries))
+
+    assert enrichments[0] == {"blockTimestamp": 1010, "transactionFrom": SENDER}
+    assert enrichments[-1]["blockTimestamp"] == 1011
+    # 2 blocks and 10 transactions in a single batch
+    assert len(w3i.batches) == 1
+    methods = [method for method, _ in w3i.batches[0]]
+    assert methods.count("eth_getBlockByHash") == 2
+    assert methods.count("eth_getTransactionByHash") == 10
+
+
+def test_cached_lookups_are_not_sent_again():
+    w3i = RecordingInterface()
+    enricher = EventEnricher(w3i, block_timestamps=True, batch_size=2)
+
+    async def scenario():
+        first = await enricher.enrich([log_entry(block_number, 0) for block_number in range(5)])
+        second = await enricher.enrich([log_entry(block_number, 1) for block_number in range(6)])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert [fields["blockTimestamp"] for fields in second] == list(range(1000, 1006))
+    # the first poll is split in batches of 2 lookups, the second only asks for the new block
+    assert [len(batch) for batch in w3i.batches] == [2, 2, 1, 1]
+    assert "transactionFrom" not in first[0]
+
+
+def test_lookups_in_flight_are_shared_between_filters():
+    w3i = RecordingInterface(delay=0.05)
+    enricher = EventEnricher(w3i, block_timestamps=True)
+
+    async def scenario():
+        return await asyncio.gather(enricher.enrich([log_entry(7, 0)]), enricher.enrich([log_entry(7, 1)]))
+
+    first, second = asyncio.run(scenario())
+    assert first == second == [{"blockTimestamp": 1007}]
+    assert len(w3i.batches) == 1
+    assert not enricher.pending
+
+
+def test_failed_lookups_leave_the_field_empty():
+    missing_hash = HexBytes((8).to_bytes(32, "big")).hex()
+    w3i = RecordingInterface(missing=[missing_hash])
+    enricher = EventEnricher(w3i, block_timestamps=True)
+    enrichments = asyncio.run(enricher.enrich([log_entry(8, 0), log_entry(9, 0)]))
+    assert enrichments == [{"blockTimestamp": None}, {"blockTimestamp": 1009}]
+    assert len(enricher.block_cache) == 1
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from decoding import EventDecoder, find_event_abi
+from encoderpool import MessageEncoderPool
+from eventfilters import EventArgumentFilter
+from watchlist import WatchlistIndex, WatchedEvent, compile_argument_filter
+from tests.test_watchlist import raw_log, ERC20_EVENTS_ABI, TOKEN_A, TOKEN_B, TRANSFER_TOPIC
+
+SENDER = Web3.toChecksumAddress("0x" + "11" * 20)
+RECIPIENT = Web3.toChecksumAddress("0x" + "22" * 20)
+OTHER = Web3.toChecksumAddress("0x" + "33" * 20)
+TRANSFER_ABI = find_event_abi(ERC20_EVENTS_ABI, "Transfer")
+
+
+def address_topic(address):
+    return "0x" + address[2:].lower().rjust(64, "0")
+
+
+def transfer_event(argument_values, address=TOKEN_A):
+    return WatchedEvent(address, "Transfer", {"fromBlock": "latest"}, EventDecoder.for_abi(TRANSFER_ABI),
+                        compile_argument_filter(TRANSFER_ABI, {"argument_values": argument_values}))
+
+
+def test_indexed_values_become_topics():
+    argument_filter = EventArgumentFilter(TRANSFER_ABI, {"to": [OTHER.lower(), RECIPIENT]})
+    assert argument_filter.topics == [None, [address_topic(OTHER), address_topic(RECIPIENT)]]
+    assert argument_filter.tests == []
+
+    contract_watchlist = {"contracts": [
+        {"address": address, "blockchain": "ethereum", "abi": ERC20_EVENTS_ABI,
+         "events_to_listen": {"Transfer": {"argument_filters": {"fromBlock": "latest"},
+                                           "argument_values": argument_values}}}
+        for address, argument_values in ((TOKEN_A, {"to": RECIPIENT}), (TOKEN_B, {"to": RECIPIENT}),
+                                         (OTHER, {"from": SENDER}), (SENDER, {}))]}
+    queries = WatchlistIndex(Web3(), contract_watchlist, "ethereum").compile_log_queries(500)
+
+    assert [query.filter_params()["topics"] for query in queries] == [
+        [[TRANSFER_TOPIC], None, [address_topic(RECIPIENT)]],
+        [[TRANSFER_TOPIC], [address_topic(SENDER)]],
+        [[TRANSFER_TOPIC]],
+    ]
+    assert queries[0].addresses == sorted([TOKEN_A, TOKEN_B])
+
+
+def test_non_indexed_values_are_matched_after_decoding():
+    log_entry = log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC))
+    for argument_values, expected in (({"value": 125}, True),
+                                      ({"value": [1, 2]}, False),
+                                      ({"value": {"gte": "0x7d", "lt": 1000}}, True),
+                                      ({"value": {"gt": 125}}, False),
+                                      ({"to": RECIPIENT.lower(), "value": {"ne": 0}}, True)):
+        watched_event = transfer_event(argument_values)
+        assert watched_event.matches(watched_event.decode(log_entry)) is expected
+
+
+def test_invalid_argument_values_are_rejected():
+    with pytest.raises(ValueError):
+        EventArgumentFilter(TRANSFER_ABI, {"amount": 1})
+    with pytest.raises(ValueError):
+        EventArgumentFilter(TRANSFER_ABI, {"value": {"between": [1, 2]}})
+
+
+def test_indexed_string_is_matched_on_its_hash():
+    event_abi = {"anonymous": False, "name": "Named", "type": "event", "inputs": [
+        {"indexed": True, "name": "name", "type": "string"}]}
+    argument_filter = EventArgumentFilter(event_abi, {"name": "vitalik"})
+    assert argument_filter.topics == [[Web3.keccak(text="vitalik").hex()]]
+
+
+def test_encoder_pool_drops_events_not_matching():
+    watched_event = transfer_event({"value": {"gt": 200}})
+    matched_logs = [(watched_event, log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC))),
+                    (transfer_event({"value": {"lt": 200}}), log_entry_formatter(raw_log(TOKEN_A, TRANSFER_TOPIC)))]
+
+    async def scenario():
+        pool = MessageEncoderPool(pool_type=MessageEncoderPool.THREAD, workers=1)
+        try:
+            return await pool.encode(matched_logs)
+        finally:
+            pool.close()
+
+    messages = asyncio.run(scenario())
+    assert messages[0] is None
+    assert json.loads(messages[1])["event_data"]["args"]["value"] == 125
@@ -0,0 +1,50 @@
+import asyncio
+
+import aiohttp
+
+from metrics import MetricsRegistry, MetricsServer, Counter, Gauge, Histogram
+
+
+def test_metrics_are_rendered_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    events = Counter("events_total", "Published events", ["address", "event"], registry=registry)
+    depth = Gauge("queue_depth", "Queue depth", registry=registry)
+    latency = Histogram("rpc_seconds", "RPC latency", ["method"], buckets=(0.1, 1), registry=registry)
+
+    events.labels("0xA", "Transfer").inc()
+    events.labels("0xA", "Transfer").inc(2)
+    events.labels("0xB", 'Odd"Name').inc()
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.5, 5):
+        latency.labels("eth_getLogs").observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE events_total counter" in lines
+    assert 'events_total{address="0xA",event="Transfer"} 3' in lines
+    assert 'events_total{address="0xB",event="Odd\\"Name"} 1' in lines
+    assert "queue_depth 7" in lines
+    assert 'rpc_seconds_bucket{method="eth_getLogs",le="0.1"} 1' in lines
+    assert 'rpc_seconds_bucket{method="eth_getLogs",le="1"} 2' in lines
+    assert 'rpc_seconds_bucket{method="eth_getLogs",le="+Inf"} 3' in lines
+    assert 'rpc_seconds_sum{method="eth_getLogs"} 5.55' in lines
+    assert 'rpc_seconds_count{method="eth_getLogs"} 3' in lines
+
+
+def test_metrics_are_served_over_http():
+    registry = MetricsRegistry()
+    Counter("events_total", "Published events", registry=registry).inc()
+
+    async def scenario():
+        server = MetricsServer("127.0.0.1", 0, registry=registry)
+        await server.start()
+        port = server._runner.addresses[0][1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get("http://127.0.0.1:{}/metrics".format(port)) as response:
+                    return response.headers["Content-Type"], await response.text()
+        finally:
+            await server.close()
+
+    content_type, text = asyncio.run(scenario())
+    assert content_type.startswith("text/plain")
+    assert "events_total 1" in text.splitlines()
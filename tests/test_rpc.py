@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from rpc import AsyncJsonRpcClient
+
+
+async def start_rpc_server(handler):
+    """
+    Starts a local JSON-RPC endpoint, handler receives the decoded request payload and returns the response payload
+    """
+    async def serve(request):
+        payload = json.loads(await request.text())
+        return web.json_response(await handler(payload))
+
+    application = web.Application()
+    application.router.add_post("/", serve)
+    runner = web.AppRunner(application)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, "http://127.0.0.1:{}/".format(port)
+
+
+def test_requests_are_sent_concurrently():
+    async def slow_handler(payload):
+        await asyncio.sleep(0.2)
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": payload["params"][0]}
+
+    async def scenario():
+        runner, endpoint = await start_rpc_server(slow_handler)
+        client = AsyncJsonRpcClient(endpoint, max_concurrent_requests=10)
+        try:
+            started = time.monotonic()
+            results = await asyncio.gather(*[client.make_request("eth_getFilterChanges", [index])
+                                             for index in range(10)])
+            return results, time.monotonic() - started
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    results, elapsed = asyncio.run(scenario())
+    assert results == list(range(10))
+    # ten requests of 0.2 seconds each take about one round trip, not the sum of all of them
+    assert elapsed < 1
+
+
+def test_error_response_is_raised():
+    async def error_handler(payload):
+        return {"jsonrpc": "2.0", "id": payload["id"], "error": {"code": -32000, "message": "filter not found"}}
+
+    async def scenario():
+        runner, endpoint = await start_rpc_server(error_handler)
+        client = AsyncJsonRpcClient(endpoint)
+        try:
+            await client.make_request("eth_getFilterChanges", ["0x1"])
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    with pytest.raises(ValueError, match="filter not found"):
+        asyncio.run(scenario())
+
+
+def test_requests_within_window_are_batched():
+    received_payloads = []
+
+    async def batch_handler(payload):
+        received_payloads.append(payload)
+        return [{"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+                for request in reversed(payload)]
+
+    async def scenario():
+        runner, endpoint = await start_rpc_server(batch_handler)
+        client = AsyncJsonRpcClient(endpoint, batch_window=0.05)
+        try:
+            return await asyncio.gather(*[client.make_request("eth_getFilterChanges", [index])
+                                          for index in range(5)])
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) == list(range(5))
+    assert len(received_payloads) == 1
+    assert len(received_payloads[0]) == 5
+
+
+def test_rejected_batches_fall_back_to_single_requests():
+    received_payloads = []
+
+    async def no_batch_handler(payload):
+        received_payloads.append(payload)
+        if isinstance(payload, list):
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch not supported"}}
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": payload["params"][0]}
+
+    async def scenario():
+        runner, endpoint = await start_rpc_server(no_batch_handler)
+        client = AsyncJsonRpcClient(endpoint, batch_window=0.05)
+        try:
+            first = await asyncio.gather(*[client.make_request("eth_getFilterChanges", [index])
+                                           for index in range(3)])
+            second = await client.make_request("eth_getFilterChanges", [3])
+            return first, second, client.batch_supported
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    first, second, batch_supported = asyncio.run(scenario())
+    assert first == [0, 1, 2]
+    assert second == 3
+    assert not batch_supported
+    # one rejected batch, three single requests replaying it and one direct single request
+    assert len(received_payloads) == 5
+
+
+def test_explicit_batch_keeps_call_order_and_reports_failures():
+    received_payloads = []
+
+    async def batch_handler(payload):
+        received_payloads.append(payload)
+        return [{"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32000, "message": "not found"}}
+                if request["params"][0] is None else
+                {"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+                for request in reversed(payload)]
+
+    async def scenario():
+        runner, endpoint = await start_rpc_server(batch_handler)
+        client = AsyncJsonRpcClient(endpoint)
+        try:
+            return await client.make_batch_request([("eth_getBlockByHash", [index]) for index in (0, None, 2)])
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    first, failed, third = asyncio.run(scenario())
+    assert (first, third) == (0, 2)
+    assert isinstance(failed, ValueError)
+    # sent as one batch even without a batch window
+    assert len(received_payloads) == 1
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from rpc import AsyncJsonRpcClient
+from rpcpool import RpcEndpointPool, FilterEndpointUnavailable
+from tests.test_rpc import start_rpc_server
+
+
+def answer(name):
+    async def handler(payload):
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": name}
+    return handler
+
+
+def test_failing_endpoint_is_put_aside():
+    failing_calls = []
+
+    async def failing_handler(payload):
+        failing_calls.append(payload["id"])
+        raise web.HTTPServiceUnavailable()
+
+    async def scenario():
+        failing_runner, failing_endpoint = await start_rpc_server(failing_handler)
+        healthy_runner, healthy_endpoint = await start_rpc_server(answer("healthy"))
+        pool = RpcEndpointPool([AsyncJsonRpcClient(failing_endpoint), AsyncJsonRpcClient(healthy_endpoint)])
+        pool.RETRY_BACKOFF_SECONDS = 0.01
+        try:
+            # the failing endpoint is the only one tried first
+            pool.endpoints[1].unhealthy_until = asyncio.get_running_loop().time() + 0.5
+            return [await pool.make_request("eth_getBlockByNumber", ["0x1", False]) for _ in range(20)]
+        finally:
+            await pool.close()
+            await failing_runner.cleanup()
+            await healthy_runner.cleanup()
+
+    assert asyncio.run(scenario()) == ["healthy"] * 20
+    # once put aside, the failing endpoint is not tried again for a while
+    assert len(failing_calls) == 1
+
+
+def node(name, head_block):
+    """
+    Answers with its name, the given head and filter ids made of its name
+    """
+    async def handler(payload):
+        results = {"eth_blockNumber": hex(head_block), "eth_newFilter": "0x{}".format(name.encode().hex())}
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": results.get(payload["method"], name)}
+    return handler
+
+
+def test_filters_stay_on_their_endpoint_and_move_when_it_is_put_aside():
+    async def scenario():
+        primary_runner, primary_endpoint = await start_rpc_server(node("primary", 100))
+        other_runner, other_endpoint = await start_rpc_server(node("other", 100))
+        pool = RpcEndpointPool([AsyncJsonRpcClient(primary_endpoint), AsyncJsonRpcClient(other_endpoint)])
+        try:
+            filter_id = await pool.make_request("eth_newFilter", [{}])
+            polled = {await pool.make_request("eth_getFilterChanges", [filter_id]) for _ in range(10)}
+            pool.primary.unhealthy_until = asyncio.get_running_loop().time() + 5
+            with pytest.raises(FilterEndpointUnavailable):
+                await pool.make_request("eth_getFilterChanges", [filter_id])
+            # created again while the primary endpoint is put aside
+            new_filter_id = await pool.make_request("eth_newFilter", [{}])
+            new_polled = {await pool.make_request("eth_getFilterChanges", [new_filter_id]) for _ in range(10)}
+            return polled, new_polled
+        finally:
+            await pool.close()
+            await primary_runner.cleanup()
+            await other_runner.cleanup()
+
+    assert asyncio.run(scenario()) == ({"primary"}, {"other"})
+
+
+def test_log_ranges_only_go_to_endpoints_that_reached_their_last_block():
+    async def scenario():
+        ahead_runner, ahead_endpoint = await start_rpc_server(node("ahead", 100))
+        lagging_runner, lagging_endpoint = await start_rpc_server(node("lagging", 90))
+        pool = RpcEndpointPool([AsyncJsonRpcClient(lagging_endpoint), AsyncJsonRpcClient(ahead_endpoint)])
+        pool.RETRY_BACKOFF_SECONDS = 0.01
+        try:
+            # the heads are not known yet, they are read before the first range is sent
+            recent = {await pool.make_request("eth_getLogs", [{"fromBlock": "0x5a", "toBlock": "0x60"}])
+                      for _ in range(10)}
+            old = {await pool.make_request("eth_getLogs", [{"fromBlock": "0x1", "toBlock": "0x2"}])
+                   for _ in range(50)}
+            head = await pool.make_request("eth_blockNumber", [])
+            with pytest.raises(ValueError, match="try again"):
+                await pool.make_request("eth_getLogs", [{"fromBlock": "0x64", "toBlock": "0x65"}])
+            return recent, old, head
+        finally:
+            await pool.close()
+            await ahead_runner.cleanup()
+            await lagging_runner.cleanup()
+
+    recent, old, head = asyncio.run(scenario())
+    assert recent == {"ahead"}
+    assert old == {"ahead", "lagging"}
+    # the highest head reported by an endpoint
+    assert head == hex(100)
+
+
+def test_slow_request_is_hedged_on_another_endpoint():
+    degraded = {"slow": False}
+
+    async def degrading_handler(payload):
+        if degraded["slow"]:
+            await asyncio.sleep(2)
+        return {"jsonrpc": "2.0", "id": payload["id"], "result": "degrading"}
+
+    async def scenario():
+        degrading_runner, degrading_endpoint = await start_rpc_server(degrading_handler)
+        backup_runner, backup_endpoint = await start_rpc_server(answer("backup"))
+        pool = RpcEndpointPool([AsyncJsonRpcClient(degrading_endpoint), AsyncJsonRpcClient(backup_endpoint)],
+                               hedge_requests=True)
+        try:
+            # learn the usual latency of the endpoint
+            for _ in range(pool.MIN_HEDGE_SAMPLES):
+                await pool.hedged_call(pool.primary, "eth_getBlockByNumber", ["0x1", False])
+            degraded["slow"] = True
+            started = time.monotonic()
+            result = await pool.hedged_call(pool.primary, "eth_getBlockByNumber", ["0x1", False])
+            return result, time.monotonic() - started
+        finally:
+            await pool.close()
+            await degrading_runner.cleanup()
+            await backup_runner.cleanup()
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "backup"
+    assert elapsed < 1
@@ -0,0 +1,31 @@
+import asyncio
+
+from scheduler import ChainHeadScheduler
+
+
+class FakeChain:
+    def __init__(self, heads):
+        self.heads = list(heads)
+        self.calls = 0
+
+    async def get_block_number(self):
+        self.calls += 1
+        return self.heads[min(self.calls, len(self.heads)) - 1]
+
+
+def test_filter_loops_wake_only_on_new_blocks():
+    async def scenario():
+        chain = FakeChain([10, 10, 10, 11, 11, 12])
+        scheduler = ChainHeadScheduler(chain, head_poll_interval=0.01)
+        task = asyncio.ensure_future(scheduler.run())
+        try:
+            woken_at = []
+            polled_block = None
+            for _ in range(3):
+                polled_block = await asyncio.wait_for(scheduler.wait_for_block_after(polled_block), 1)
+                woken_at.append(polled_block)
+            return woken_at
+        finally:
+            task.cancel()
+
+    assert asyncio.run(scenario()) == [10, 11, 12]
@@ -0,0 +1,416 @@
+import asyncio
+import json
+
+import pytest
+from web3._utils.method_formatters import log_entry_formatter
+
+from benchmarks.run_benchmarks import build_watchlist, RABBITMQ_CONFIG
+from benchmarks.standins import FakeEthereumNode, InMemoryBroker, InMemoryChannel, InMemoryRabbitPublisher, \
+    load_example_message, synthetic_addresses
+import main
+from main import EventScraper
+from rpcpool import FilterEndpointUnavailable
+from settings import ScraperSettings
+from web3environment import Web3Interface
+
+
+class FailingChannel(InMemoryChannel):
+    """
+    Refuses the messages of the events of failing_blocks, like a broker connection dropping while publishing them
+    """
+    def __init__(self, broker):
+        super().__init__(broker)
+        self.failing_blocks = set()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if json.loads(body)["event_data"]["blockNumber"] in self.failing_blocks:
+            raise ConnectionError("connection lost")
+        super().basic_publish(exchange, routing_key, body, properties)
+
+
+class InMemoryScraper(EventScraper):
+
+    def __init__(self, broker, *args, **kwargs):
+        self.broker = broker
+        self.channel = FailingChannel(broker)
+        super().__init__(*args, **kwargs)
+
+    def get_rabbit_connection(self, rabbitmq_config, content_type=None):
+        publisher = InMemoryRabbitPublisher(self.broker, rabbitmq_config, content_type=content_type)
+        publisher._channel = self.channel
+        return publisher
+
+
+@pytest.fixture
+def node():
+    # blocks are only produced by the tests
+    node = FakeEthereumNode(synthetic_addresses(2), logs_per_block=2, block_time=3600)
+    node.start()
+    yield node
+    node.stop()
+
+
+def make_scraper(node, tmp_path, addresses=None, **settings):
+    settings.setdefault("CHECKPOINT_PATH", str(tmp_path / "checkpoints.sqlite"))
+    settings = ScraperSettings(ABI_CACHE_PATH="", LOG_FILE="", **settings)
+    return InMemoryScraper(InMemoryBroker(), build_watchlist(addresses or node.contracts), RABBITMQ_CONFIG,
+                           node.endpoint, settings=settings)
+
+
+def logs_of_block(node, block_number):
+    return [log_entry_formatter(raw_log) for raw_logs in node.blocks[block_number].values() for raw_log in raw_logs]
+
+
+def test_checkpoint_stays_before_an_event_that_was_not_published(node, tmp_path):
+    scraper = make_scraper(node, tmp_path)
+    log_queries = scraper.compile_queries(scraper.contract_watchlist).values()
+    node.produce_block()
+    node.produce_block()
+    failed_block, published_block = node.head_block - 1, node.head_block
+    scraper.channel.failing_blocks.add(failed_block)
+    matched_logs = [(watched_event, log_entry)
+                    for log_entry in logs_of_block(node, failed_block) + logs_of_block(node, published_block)
+                    for watched_event in [log_query.demultiplex(log_entry) for log_query in log_queries]
+                    if watched_event is not None]
+    assert len(matched_logs) == 4
+
+    async def scenario():
+        try:
+            return await scraper.publish_logs(matched_logs)
+        finally:
+            await scraper.w3i.close()
+
+    published_logs = asyncio.run(scenario())
+    assert [log_entry['blockNumber'] for _, log_entry in published_logs] == [published_block] * 2
+    for watched_event, log_entry in published_logs:
+        scraper.record_checkpoint(watched_event.address, watched_event.event_name, log_entry['blockNumber'])
+    # the next run publishes the failed events again
+    for watched_event, _ in published_logs:
+        assert scraper.get_checkpoint(watched_event.address, watched_event.event_name) == failed_block - 1
+    assert [json.loads(message)["event_data"]["blockNumber"] for message in scraper.broker.messages] == \
+        [published_block] * 2
+
+
+class RecordingEnricher:
+    """
+    Stands in for EventEnricher, remembers the logs it was asked to enrich
+    """
+    def __init__(self):
+        self.log_entries = []
+
+    async def enrich(self, log_entries):
+        self.log_entries += log_entries
+        return [{"blockTimestamp": 0} for _ in log_entries]
+
+
+@pytest.mark.parametrize("encoder_workers", [0, 1])
+def test_only_events_matching_their_argument_filter_are_enriched(node, tmp_path, encoder_workers):
+    kept_address, dropped_address = node.contracts
+    recipient = load_example_message()["event_data"]["args"]["recipient"]
+    watchlist = build_watchlist([kept_address, dropped_address])
+    for contract, accepted in zip(watchlist["contracts"], [recipient, synthetic_addresses(3)[2]]):
+        contract["events_to_listen"]["OrderFulfilled"]["argument_values"] = {"recipient": accepted}
+    settings = ScraperSettings(ABI_CACHE_PATH="", LOG_FILE="", CHECKPOINT_PATH="", ENCODER_WORKERS=encoder_workers,
+                               ENCODER_POOL_TYPE="thread")
+    scraper = InMemoryScraper(InMemoryBroker(), watchlist, RABBITMQ_CONFIG, node.endpoint, settings=settings)
+    scraper.enricher = RecordingEnricher()
+    log_queries = scraper.compile_queries(scraper.contract_watchlist).values()
+    node.produce_block()
+    node.produce_block()
+    matched_logs = [(watched_event, log_entry)
+                    for log_entry in logs_of_block(node, node.head_block - 1) + logs_of_block(node, node.head_block)
+                    for watched_event in [log_query.demultiplex(log_entry) for log_query in log_queries]
+                    if watched_event is not None]
+    assert {watched_event.address for watched_event, _ in matched_logs} == {kept_address, dropped_address}
+
+    async def scenario():
+        try:
+            return await scraper.publish_logs(matched_logs)
+        finally:
+            await scraper.w3i.close()
+
+    asyncio.run(scenario())
+    assert {log_entry['address'].lower() for log_entry in scraper.enricher.log_entries} == {kept_address.lower()}
+    assert {json.loads(message)["event_data"]["address"].lower() for message in scraper.broker.messages} == \
+        {kept_address.lower()}
+    assert all(json.loads(message)["event_data"]["blockTimestamp"] == 0 for message in scraper.broker.messages)
+
+
+def test_checkpoint_of_a_silent_event_follows_the_polled_head(node, tmp_path):
+    # the third address never emits anything on the node
+    silent_address = synthetic_addresses(3)[2]
+    scraper = make_scraper(node, tmp_path, addresses=[silent_address])
+    log_query, = scraper.compile_queries(scraper.contract_watchlist).values()
+    watched_event, = log_query.watched_events.values()
+
+    def create_filter():
+        return scraper.w3i.web3.eth.filter(log_query.filter_params())
+
+    scraper.head_tracker.head_poll_interval = 0.1
+
+    async def scenario():
+        head_tracking = asyncio.ensure_future(scraper.head_tracker.run())
+        polling = asyncio.ensure_future(scraper.filter_loop(create_filter(), 0.02, watched_event.event_name,
+                                                            watched_event.filter_arguments, log_query, create_filter))
+        try:
+            await asyncio.sleep(0.2)
+            node.produce_block()
+            node.produce_block()
+            await asyncio.sleep(0.3)
+        finally:
+            polling.cancel()
+            head_tracking.cancel()
+            await scraper.w3i.close()
+
+    asyncio.run(scenario())
+    assert scraper.get_checkpoint(watched_event.address, watched_event.event_name) == node.head_block
+    # the head comes from the shared tracker, the filter loop only reads it once when it starts
+    assert node.requests["eth_blockNumber"] < node.requests["eth_getFilterChanges"]
+
+
+class DroppingFilterNode:
+    """
+    Stands in for the Web3Interface of a node that forgot the filter
+    """
+    def __init__(self, head_block):
+        self.head_block = head_block
+
+    async def get_block_number(self):
+        return self.head_block
+
+    async def create_filter(self, create_filter, log_filter=None):
+        return create_filter()
+
+
+def test_filter_not_found_errors_are_recognised():
+    assert Web3Interface.is_filter_not_found(ValueError({"code": -32000, "message": "filter not found"}))
+    assert Web3Interface.is_filter_not_found(ValueError("Filter id 0x1 does not exist"))
+    assert not Web3Interface.is_filter_not_found(ValueError({"code": -32005, "message": "rate limit exceeded"}))
+    assert Web3Interface.is_filter_not_found(FilterEndpointUnavailable("endpoint put aside"))
+    assert not Web3Interface.is_filter_not_found(asyncio.TimeoutError())
+
+
+@pytest.mark.parametrize("error, refilled", [
+    (ValueError({"code": -32000, "message": "filter not found"}), True),
+    (ConnectionError("connection reset by peer"), False),
+])
+def test_polling_error_recreates_a_dropped_filter_and_fills_the_gap(node, tmp_path, error, refilled):
+    scraper = make_scraper(node, tmp_path)
+    log_query = next(iter(scraper.compile_queries(scraper.contract_watchlist).values()))
+    real_w3i, scraper.w3i = scraper.w3i, DroppingFilterNode(head_block=120)
+    filled_ranges = []
+
+    async def publish_block_range(log_query, from_block, to_block, resume_blocks):
+        filled_ranges.append((from_block, to_block))
+        assert set(resume_blocks.values()) == {from_block}
+    scraper.publish_block_range = publish_block_range
+
+    async def scenario():
+        try:
+            return await scraper.handle_polling_error(error, "old filter", 0.01, log_query, lambda: "new filter", 100)
+        finally:
+            await real_w3i.close()
+
+    log_filter, covered_block = asyncio.run(scenario())
+    if refilled:
+        assert (log_filter, covered_block) == ("new filter", 120)
+        assert filled_ranges == [(101, 120)]
+    else:
+        # polled again on the next cycle, the loop stays alive
+        assert (log_filter, covered_block) == ("old filter", 100)
+        assert filled_ranges == []
+
+
+def test_filter_loop_recovers_when_filling_a_dropped_filter_fails(node, tmp_path):
+    scraper = make_scraper(node, tmp_path, addresses=[node.contracts[0]])
+    scraper.RETRY_DELAY_SECONDS = 0.05
+    log_query, = scraper.compile_queries(scraper.contract_watchlist).values()
+    watched_event, = log_query.watched_events.values()
+    fill_failures = []
+    publish_block_range = scraper.publish_block_range
+
+    async def failing_once(*args):
+        if not fill_failures:
+            fill_failures.append(args[1:3])
+            raise ValueError({"code": -32005, "message": "rate limit exceeded"})
+        await publish_block_range(*args)
+    scraper.publish_block_range = failing_once
+
+    def create_filter():
+        return scraper.w3i.web3.eth.filter(log_query.filter_params())
+
+    async def scenario():
+        polling = asyncio.ensure_future(scraper.filter_loop(create_filter(), 0.05, watched_event.event_name,
+                                                            watched_event.filter_arguments, log_query, create_filter))
+        try:
+            await asyncio.sleep(0.2)
+            node.filters.clear()
+            node.produce_block()
+            await asyncio.sleep(0.5)
+            node.produce_block()
+            await asyncio.sleep(0.3)
+            assert not polling.done()
+        finally:
+            polling.cancel()
+            await scraper.w3i.close()
+
+    asyncio.run(scenario())
+    assert fill_failures == [(node.head_block - 1, node.head_block - 1)]
+    # the block of the dropped filter comes from the retried fill, the next one from the new filter
+    assert [json.loads(message)["event_data"]["blockNumber"] for message in scraper.broker.messages] == \
+        [node.head_block - 1, node.head_block]
+
+
+def test_failed_catch_up_is_retried_before_polling(node, tmp_path):
+    scraper = make_scraper(node, tmp_path)
+    scraper.RETRY_DELAY_SECONDS = 0.01
+    log_query = next(iter(scraper.compile_queries(scraper.contract_watchlist).values()))
+    steps = []
+
+    async def catch_up(log_query, to_block):
+        steps.append("catch up")
+        if steps.count("catch up") == 1:
+            raise ValueError({"code": -32005, "message": "rate limit exceeded"})
+
+    async def polling(log_filter):
+        steps.append("poll")
+    scraper.catch_up = catch_up
+
+    def create_filter():
+        steps.append("create filter")
+        return scraper.w3i.new_log_filter(log_query.filter_params())
+
+    async def scenario():
+        try:
+            await scraper.resume_then_poll(log_query, create_filter, polling, "test filter")
+        finally:
+            await scraper.w3i.close()
+
+    asyncio.run(scenario())
+    assert steps == ["create filter", "catch up", "catch up", "poll"]
+
+
+def test_watchlist_reload_only_replaces_the_changed_filters(node, tmp_path):
+    kept_address, removed_address = node.contracts[1], node.contracts[0]
+    added_address = synthetic_addresses(3)[2]
+    scraper = make_scraper(node, tmp_path, addresses=[removed_address, kept_address], CHECKPOINT_PATH="")
+
+    def running_by_address():
+        return {next(iter(log_query.watched_events.values())).address.lower(): (log_query, task)
+                for log_query, task in scraper.running_queries.values()}
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        try:
+            scraper.create_filter_tasks(loop)
+            before = running_by_address()
+            scraper.reload_watchlist(loop, build_watchlist([kept_address, added_address]))
+            after = running_by_address()
+            # the added filter is created by its task, not on the event loop while reloading
+            assert node.requests["eth_newFilter"] == 2
+            # the retired filter is polled once more, then its loop ends
+            await asyncio.sleep(scraper.POLLING_INTERVAL_SECONDS + 0.5)
+            assert node.requests["eth_newFilter"] == 3
+            return before, after, {address: task.done() for address, (_, task) in {**before, **after}.items()}
+        finally:
+            for task in list(scraper.background_tasks):
+                task.cancel()
+            await scraper.w3i.close()
+
+    before, after, done = asyncio.run(scenario())
+    assert before[removed_address][0].retired
+    assert set(after) == {kept_address, added_address.lower()}
+    assert after[kept_address] == before[kept_address] and not after[kept_address][0].retired
+    assert done == {removed_address: True, kept_address: False, added_address.lower(): False}
+
+
+class PushingSubscriber:
+    """
+    Stands in for LogSubscriber: subscribes, then pushes the logs of the blocks in push_blocks
+    """
+    node = None
+    push_blocks = []
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    async def run(self, subscriptions, handle_log, on_subscribed):
+        await on_subscribed()
+        for block_number in self.push_blocks:
+            for log_entry in logs_of_block(self.node, block_number):
+                await handle_log(0, log_entry)
+
+
+def test_subscriptions_made_again_on_reload_fill_the_blocks_in_between(node, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LogSubscriber", PushingSubscriber)
+    PushingSubscriber.node = node
+    scraper = make_scraper(node, tmp_path, SUBSCRIBE_LOGS=True, CHECKPOINT_PATH="")
+
+    def published_blocks():
+        return sorted({json.loads(message)["event_data"]["blockNumber"] for message in scraper.broker.messages})
+
+    async def scenario():
+        try:
+            node.produce_block()
+            PushingSubscriber.push_blocks = [node.head_block]
+            await scraper.subscription_loop(list(scraper.compile_queries(scraper.contract_watchlist).values()))
+            first_blocks = published_blocks()
+            # blocks produced while the subscriptions are made again after a watchlist reload, never pushed
+            node.produce_block()
+            node.produce_block()
+            PushingSubscriber.push_blocks = []
+            watchlist = build_watchlist(node.contracts + synthetic_addresses(3)[2:])
+            await scraper.subscription_loop(list(scraper.compile_queries(watchlist).values()))
+            return first_blocks, published_blocks()
+        finally:
+            await scraper.w3i.close()
+
+    first_blocks, all_blocks = asyncio.run(scenario())
+    assert first_blocks == [node.head_block - 2]
+    assert all_blocks == [node.head_block - 2, node.head_block - 1, node.head_block]
+
+
+class IdleSubscriber:
+    """
+    Stands in for LogSubscriber: subscribes and then never gets any log pushed
+    """
+    caught_up = True
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.subscriptions_made = 0
+
+    async def run(self, subscriptions, handle_log, on_subscribed):
+        await on_subscribed()
+        self.subscriptions_made += 1
+        await asyncio.Event().wait()
+
+
+@pytest.mark.parametrize("caught_up", [True, False])
+def test_checkpoints_of_subscribed_events_follow_the_head(node, tmp_path, monkeypatch, caught_up):
+    monkeypatch.setattr(main, "LogSubscriber", IdleSubscriber)
+    monkeypatch.setattr(IdleSubscriber, "caught_up", caught_up)
+    scraper = make_scraper(node, tmp_path, addresses=[synthetic_addresses(3)[2]], SUBSCRIBE_LOGS=True)
+    scraper.head_tracker.head_poll_interval = 0.05
+    log_query, = scraper.compile_queries(scraper.contract_watchlist).values()
+    watched_event, = log_query.watched_events.values()
+    subscribed_head = node.head_block
+
+    async def scenario():
+        head_tracking = asyncio.ensure_future(scraper.head_tracker.run())
+        subscription = asyncio.ensure_future(scraper.subscription_loop([log_query]))
+        try:
+            for _ in range(3):
+                await asyncio.sleep(0.2)
+                node.produce_block()
+            await asyncio.sleep(0.2)
+        finally:
+            subscription.cancel()
+            head_tracking.cancel()
+            await scraper.w3i.close()
+
+    asyncio.run(scenario())
+    # the last head is only recorded once the next one is seen
+    expected_block = node.head_block - 1 if caught_up else subscribed_head
+    assert scraper.get_checkpoint(watched_event.address, watched_event.event_name) == expected_block
+    assert scraper.subscription_covered_blocks[watched_event.key] == expected_block
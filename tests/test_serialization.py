@@ -0,0 +1,58 @@
+import os
+import json
+
+import pytest
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+import myweb3encoding
+from serialization import MessageSerializer
+
+
+@pytest.fixture
+def expected_message():
+    with open(os.path.join(os.path.dirname(__file__), "example.OrderFulfilled.json"), "rt") as fin:
+        return json.load(fin)
+
+
+@pytest.fixture
+def order_fulfilled_event(expected_message):
+    """
+    The example message turned back into the structure web3 returns when decoding the event
+    """
+    event_data = expected_message["event_data"]
+    args = dict(event_data["args"])
+    args["orderHash"] = bytes.fromhex(args["orderHash"][2:])
+    args["offer"] = tuple(tuple(item) for item in args["offer"])
+    args["consideration"] = tuple(tuple(item) for item in args["consideration"])
+    event = dict(event_data)
+    event["args"] = AttributeDict(args)
+    event["transactionHash"] = HexBytes(event["transactionHash"])
+    event["blockHash"] = HexBytes(event["blockHash"])
+    return AttributeDict(event)
+
+
+def test_json_message_matches_previous_encoding(order_fulfilled_event, expected_message):
+    serializer = MessageSerializer()
+    message = serializer.serialize(order_fulfilled_event, {"fromBlock": "latest"}, "OrderFulfilled")
+
+    assert isinstance(message, bytes)
+    assert json.loads(message) == expected_message
+    assert json.loads(message)["event_data"] == json.loads(myweb3encoding.to_json(order_fulfilled_event))
+    assert serializer.content_type == "application/json"
+
+
+def test_cbor_message_has_same_layout(order_fulfilled_event, expected_message):
+    pytest.importorskip("cbor2")
+    serializer = MessageSerializer(MessageSerializer.CBOR)
+    message = serializer.serialize(order_fulfilled_event, {"fromBlock": "latest"}, "OrderFulfilled")
+
+    assert serializer.decode(message) == expected_message
+    assert len(message) < len(MessageSerializer().serialize(order_fulfilled_event, {"fromBlock": "latest"},
+                                                            "OrderFulfilled"))
+    assert serializer.content_type == "application/cbor"
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        MessageSerializer("xml")
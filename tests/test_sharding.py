@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+from web3 import Web3
+
+from checkpoints import CheckpointStore
+from sharding import ShardSupervisor, shard_for_address, shard_watchlist, shard_file_path, \
+    take_over_checkpoints
+
+ADDRESSES = [Web3.toChecksumAddress("0x{:040x}".format(index * 7919)) for index in range(1, 1001)]
+
+
+def test_adding_a_shard_only_moves_contracts_to_it():
+    before = {address: shard_for_address(address, 4) for address in ADDRESSES}
+    after = {address: shard_for_address(address, 5) for address in ADDRESSES}
+
+    moved = [address for address in ADDRESSES if before[address] != after[address]]
+    assert all(after[address] == 4 for address in moved)
+    # about a fifth of the contracts move to the new shard
+    assert 100 < len(moved) < 300
+    # the assignment does not depend on the address case
+    assert shard_for_address(ADDRESSES[0].lower(), 5) == after[ADDRESSES[0]]
+
+
+def test_watchlist_is_partitioned():
+    contract_watchlist = {"contracts": [{"address": address, "events_to_listen": {}} for address in ADDRESSES]}
+    shards = [shard_watchlist(contract_watchlist, index, 3, salt="worker") for index in range(3)]
+
+    assert sorted(contract_data["address"] for shard in shards for contract_data in shard["contracts"]) == \
+        sorted(ADDRESSES)
+    assert shard_watchlist(contract_watchlist, 0, 1) is contract_watchlist
+
+
+def test_moved_contract_resumes_from_previous_shard(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoints.sqlite")
+    previous_shard = CheckpointStore(shard_file_path(checkpoint_path, 0, 1))
+    previous_shard.record(ADDRESSES[0], "Transfer", 150)
+    previous_shard.record(ADDRESSES[1], "Transfer", 200)
+    previous_shard.flush()
+    previous_shard.close()
+    unsharded = CheckpointStore(checkpoint_path)
+    unsharded.record(ADDRESSES[0], "Transfer", 100)
+    unsharded.flush()
+    unsharded.close()
+
+    shard_path = shard_file_path(checkpoint_path, 0, 0)
+    contract_watchlist = {"contracts": [{"address": ADDRESSES[0].lower(), "events_to_listen": {"Transfer": {}}}]}
+    take_over_checkpoints(checkpoint_path, shard_path, contract_watchlist, Web3.toChecksumAddress)
+
+    store = CheckpointStore(shard_path)
+    assert store.get(ADDRESSES[0], "Transfer") == 150
+    # contracts of other shards are not taken over
+    assert store.get(ADDRESSES[1], "Transfer") is None
+    store.close()
+
+
+def crash_once(worker_index, contract_watchlist, marker_directory):
+    marker = os.path.join(marker_directory, "started-{}".format(worker_index))
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        sys.exit(1)
+    open(os.path.join(marker_directory, "restarted-{}".format(worker_index)), "w").close()
+
+
+def test_crashed_worker_is_restarted(tmp_path):
+    supervisor = ShardSupervisor({0: {"contracts": [{}]}, 1: {"contracts": []}}, crash_once, (str(tmp_path),))
+    supervisor.CHECK_INTERVAL_SECONDS = 0.05
+    supervisor.RESTART_DELAY_SECONDS = 0.05
+    started = time.monotonic()
+    supervisor.run()
+
+    assert os.path.exists(str(tmp_path / "restarted-0"))
+    # the worker without contracts is never started
+    assert not os.path.exists(str(tmp_path / "started-1"))
+    assert time.monotonic() - started < 30
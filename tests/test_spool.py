@@ -0,0 +1,75 @@
+import os
+
+from spool import DiskSpool
+
+
+def messages_of(items):
+    return [message for _, message in items]
+
+
+def test_messages_are_read_in_order_until_acknowledged(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    for index in range(5):
+        spool.append("message {}".format(index).encode())
+    assert spool.depth == 5
+
+    first = spool.read(3)
+    assert messages_of(first) == [b"message 0", b"message 1", b"message 2"]
+    spool.acknowledge(first[1][0])
+    assert spool.depth == 3
+    # the read but unacknowledged message comes back after a rewind
+    spool.rewind()
+    assert messages_of(spool.read(10)) == [b"message 2", b"message 3", b"message 4"]
+    assert spool.read(10) == []
+    spool.close()
+
+
+def test_spool_survives_a_restart(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    for index in range(4):
+        spool.append("message {}".format(index).encode())
+    spool.acknowledge(spool.read(2)[-1][0])
+    spool.close()
+
+    spool = DiskSpool(str(tmp_path))
+    assert spool.depth == 2
+    spool.append(b"message 4")
+    assert messages_of(spool.read(10)) == [b"message 2", b"message 3", b"message 4"]
+    spool.close()
+
+
+def test_incomplete_record_is_dropped_on_open(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    spool.append(b"complete")
+    spool.close()
+    segment_path = spool.segment_path(spool.write_segment)
+    with open(segment_path, "ab") as fout:
+        # header announcing more bytes than were written before the crash
+        fout.write(DiskSpool.HEADER.pack(100, 0) + b"cut")
+
+    spool = DiskSpool(str(tmp_path))
+    assert spool.depth == 1
+    spool.append(b"after restart")
+    assert messages_of(spool.read(10)) == [b"complete", b"after restart"]
+    spool.close()
+
+
+def test_acknowledged_segments_are_deleted(tmp_path):
+    spool = DiskSpool(str(tmp_path), segment_bytes=64)
+    for index in range(20):
+        spool.append("message {:02d}".format(index).encode())
+    segments = [name for name in os.listdir(str(tmp_path)) if name.endswith(DiskSpool.SEGMENT_SUFFIX)]
+    assert len(segments) > 3
+
+    items = spool.read(15)
+    assert messages_of(items) == ["message {:02d}".format(index).encode() for index in range(15)]
+    spool.acknowledge(items[-1][0])
+    remaining = [name for name in os.listdir(str(tmp_path)) if name.endswith(DiskSpool.SEGMENT_SUFFIX)]
+    assert len(remaining) < len(segments)
+    assert messages_of(spool.read(10)) == ["message {:02d}".format(index).encode() for index in range(15, 20)]
+    spool.close()
+
+    # the remaining messages are still there after a restart
+    spool = DiskSpool(str(tmp_path), segment_bytes=64)
+    assert spool.depth == 5
+    spool.close()
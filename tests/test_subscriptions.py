@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+import websockets
+
+from subscriptions import LogSubscriber
+from tests.test_watchlist import raw_log, TOKEN_A, TRANSFER_TOPIC
+
+
+def test_subscriber_resubscribes_and_fills_after_socket_drop():
+    connections = []
+
+    async def serve(socket, path):
+        connections.append(socket)
+        request = json.loads(await socket.recv())
+        subscription_id = "0xsub{}".format(len(connections))
+        await socket.send(json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": subscription_id}))
+        block_number = len(connections) * 10
+        await socket.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription", "params": {
+            "subscription": subscription_id, "result": raw_log(TOKEN_A, TRANSFER_TOPIC, block_number=block_number)}}))
+        if len(connections) == 1:
+            # drop the first connection right after the push
+            return
+        await socket.wait_closed()
+
+    async def scenario():
+        server = await websockets.serve(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        subscriber = LogSubscriber("ws://127.0.0.1:{}".format(port))
+        subscriber.RECONNECT_DELAY_SECONDS = 0.01
+        events = []
+        done = asyncio.Event()
+
+        async def on_subscribed():
+            assert not subscriber.caught_up
+            events.append("subscribed")
+
+        async def handle_log(index, log_entry):
+            assert not subscriber.caught_up
+            events.append((index, log_entry['blockNumber']))
+            if log_entry['blockNumber'] == 20:
+                done.set()
+
+        task = asyncio.ensure_future(subscriber.run([{"address": [TOKEN_A], "topics": [[TRANSFER_TOPIC]]}],
+                                                    handle_log, on_subscribed))
+        try:
+            await asyncio.wait_for(done.wait(), 5)
+            await asyncio.sleep(0.05)
+            # subscribed again once, every pushed log handed over
+            assert subscriber.subscriptions_made == 2 and subscriber.caught_up
+        finally:
+            task.cancel()
+            server.close()
+            await server.wait_closed()
+        return events
+
+    assert asyncio.run(scenario()) == ["subscribed", (0, 10), "subscribed", (0, 20)]
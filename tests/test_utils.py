@@ -0,0 +1,76 @@
+import logging
+import os
+import queue
+
+from utils import CustomFormatter, DroppingQueueHandler, EventLogSampler, LoggingSetup, PER_EVENT
+
+
+def make_record(message, line=10, per_event=True):
+    record = logging.LogRecord("test", logging.INFO, __file__, line, message, None, None)
+    if per_event:
+        record.__dict__.update(PER_EVENT)
+    return record
+
+
+def test_sampler_keeps_one_record_out_of_n_per_call_site():
+    sampler = EventLogSampler(sample_every=3)
+    kept = [sampler.filter(make_record("event {}".format(index))) for index in range(1, 10)]
+    assert kept == [False, False, True] * 3
+    # each log statement is sampled on its own and other records are never sampled
+    assert not sampler.filter(make_record("other", line=20))
+    assert all(sampler.filter(make_record("startup", per_event=False)) for _ in range(5))
+
+
+def test_sampler_rate_limit_reports_skipped_records():
+    sampler = EventLogSampler(max_per_second=2)
+    records = [make_record("event {}".format(index)) for index in range(5)]
+    assert [sampler.filter(record) for record in records] == [True, True, False, False, False]
+    sampler.windows[("test", 10)] = (0, 0)
+    record = make_record("event 5")
+    assert sampler.filter(record)
+    assert record.getMessage() == "event 5 (3 similar messages skipped)"
+
+
+def test_queued_logging_rotates_files(tmp_path):
+    setup = LoggingSetup()
+    file_name = str(tmp_path / "scraper.log")
+    logger = logging.getLogger("test_queued_logging_rotates_files")
+    logger.propagate = False
+    setup.configure(file_name=file_name, max_bytes=2000, backup_count=2, use_queue=True)
+    setup.attach(logger, None, True)
+    try:
+        for index in range(200):
+            logger.debug("message number {}".format(index))
+    finally:
+        setup.close()
+    assert not logger.handlers
+    assert os.path.exists(file_name + ".1") and os.path.exists(file_name + ".2")
+    assert not os.path.exists(file_name + ".3")
+    with open(file_name, "rt") as fin:
+        assert fin.read().rstrip().endswith("message number 199")
+
+
+def test_queue_handler_leaves_formatting_to_the_listener():
+    formatted = []
+
+    class Argument:
+        def __str__(self):
+            formatted.append(True)
+            return "argument"
+
+    log_queue = queue.Queue()
+    handler = DroppingQueueHandler(log_queue)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "sent %s", (Argument(),), None)
+    handler.handle(record)
+    queued = log_queue.get_nowait()
+    assert queued is record and not formatted
+    assert queued.getMessage() == "sent argument"
+
+
+def test_custom_formatter_uses_the_level_format():
+    formatter = CustomFormatter()
+    warning = logging.LogRecord("test", logging.WARNING, __file__, 1, "careful %s", ("now",), None)
+    assert formatter.format(warning).endswith("| careful now" + CustomFormatter.FORMATS[logging.WARNING][-4:])
+    custom_level = logging.LogRecord("test", 25, __file__, 1, "plain", None, None)
+    assert formatter.format(custom_level) == "plain"
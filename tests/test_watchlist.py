@@ -0,0 +1,141 @@
+import json
+
+import pytest
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from watchlist import WatchlistIndex
+
+TOKEN_A = "0x3845badAde8e6dFF049820680d1F14bD3903a5d0"
+TOKEN_B = "0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f"
+
+ERC20_EVENTS_ABI = json.dumps([
+    {"anonymous": False, "name": "Transfer", "type": "event", "inputs": [
+        {"indexed": True, "name": "from", "type": "address"},
+        {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"}]},
+    {"anonymous": False, "name": "Approval", "type": "event", "inputs": [
+        {"indexed": True, "name": "owner", "type": "address"},
+        {"indexed": True, "name": "spender", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"}]},
+])
+
+TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)").hex()
+APPROVAL_TOPIC = Web3.keccak(text="Approval(address,address,uint256)").hex()
+
+
+def raw_log(address, topic0, block_number=1, log_index=0):
+    return {
+        "address": address.lower(),
+        "topics": [topic0,
+                   "0x000000000000000000000000" + "11" * 20,
+                   "0x000000000000000000000000" + "22" * 20],
+        "data": "0x" + hex(125)[2:].rjust(64, "0"),
+        "blockNumber": hex(block_number),
+        "blockHash": "0x" + "ab" * 32,
+        "transactionHash": "0x" + "cd" * 32,
+        "transactionIndex": "0x0",
+        "logIndex": hex(log_index),
+        "removed": False,
+    }
+
+
+@pytest.fixture
+def contract_watchlist():
+    return {
+        "contracts": [
+            {
+                "address": TOKEN_A,
+                "blockchain": "ethereum",
+                "abi": ERC20_EVENTS_ABI,
+                "events_to_listen": {
+                    "Transfer": {"argument_filters": {"fromBlock": "latest"}},
+                    "Approval": {"argument_filters": {"fromBlock": "latest"}},
+                },
+            },
+            {
+                "address": TOKEN_B,
+                "blockchain": "ethereum",
+                "abi": ERC20_EVENTS_ABI,
+                "events_to_listen": {
+                    "Transfer": {"argument_filters": {"fromBlock": "latest"}},
+                },
+            },
+        ]
+    }
+
+
+def test_watchlist_compiles_into_single_query(contract_watchlist):
+    index = WatchlistIndex(Web3(), contract_watchlist, "ethereum")
+    queries = index.compile_log_queries(max_addresses_per_query=500)
+
+    assert len(queries) == 1
+    params = queries[0].filter_params()
+    assert params["address"] == sorted([TOKEN_A, TOKEN_B])
+    assert params["topics"] == [sorted([TRANSFER_TOPIC, APPROVAL_TOPIC])]
+    assert params["fromBlock"] == "latest"
+
+
+def test_watchlist_query_splits_on_address_limit_and_filters(contract_watchlist):
+    contract_watchlist["contracts"].append({
+        "address": TOKEN_A,
+        "blockchain": "ethereum",
+        "abi": ERC20_EVENTS_ABI,
+        "events_to_listen": {"Transfer": {"argument_filters": {"fromBlock": "100", "toBlock": 200}}},
+    })
+    index = WatchlistIndex(Web3(), contract_watchlist, "ethereum")
+    queries = index.compile_log_queries(max_addresses_per_query=1)
+
+    assert [query.addresses for query in queries] == [[TOKEN_A], [TOKEN_B], [TOKEN_A]]
+    assert queries[2].filter_params()["fromBlock"] == 100
+    assert queries[2].filter_params()["toBlock"] == 200
+
+
+def test_watchlist_demultiplexes_and_decodes_logs(contract_watchlist):
+    index = WatchlistIndex(Web3(), contract_watchlist, "ethereum")
+    query = index.compile_log_queries(max_addresses_per_query=500)[0]
+
+    watched_event = query.demultiplex(log_entry_formatter(raw_log(TOKEN_B, TRANSFER_TOPIC)))
+    assert watched_event.event_name == "Transfer"
+    assert watched_event.address == TOKEN_B
+    event = watched_event.decode(log_entry_formatter(raw_log(TOKEN_B, TRANSFER_TOPIC)))
+    assert event["args"]["value"] == 125
+
+    # TOKEN_B Approval is part of the query cross product but is not watched
+    assert query.demultiplex(log_entry_formatter(raw_log(TOKEN_B, APPROVAL_TOPIC))) is None
+
+
+def test_watchlist_rejects_unsupported_chain(contract_watchlist):
+    contract_watchlist["contracts"][0]["blockchain"] = "bsc"
+    with pytest.raises(ValueError):
+        WatchlistIndex(Web3(), contract_watchlist, "ethereum")
+
+
+def test_watchlist_rejects_event_listed_twice_with_different_argument_values(contract_watchlist):
+    contract_watchlist["contracts"].append({
+        "address": TOKEN_B,
+        "blockchain": "ethereum",
+        "abi": ERC20_EVENTS_ABI,
+        "events_to_listen": {"Transfer": {"argument_filters": {"fromBlock": "latest"},
+                                          "argument_values": {"value": {"gte": 100}}}},
+    })
+    with pytest.raises(ValueError):
+        WatchlistIndex(Web3(), contract_watchlist, "ethereum")
+
+
+def test_query_keys_only_change_for_changed_queries(contract_watchlist):
+    keys = {query.key for query in WatchlistIndex(Web3(), contract_watchlist, "ethereum").single_event_queries()}
+    assert len(keys) == 3
+
+    contract_watchlist["contracts"][1]["events_to_listen"]["Transfer"]["argument_values"] = {"value": {"gte": 100}}
+    contract_watchlist["contracts"].append({
+        "address": TOKEN_B,
+        "blockchain": "ethereum",
+        "abi": ERC20_EVENTS_ABI,
+        "events_to_listen": {"Approval": {"argument_filters": {"fromBlock": "latest"}}},
+    })
+    reloaded_keys = {query.key for query in
+                     WatchlistIndex(Web3(), contract_watchlist, "ethereum").single_event_queries()}
+    # the two TOKEN_A queries are kept, the filtered TOKEN_B Transfer and the TOKEN_B Approval are new
+    assert len(keys & reloaded_keys) == 2
+    assert len(reloaded_keys - keys) == 2
@@ -1,5 +1,10 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+import time
 import web3
 import json
 import requests
@@ -7,6 +12,17 @@ import requests
 from colorama import Fore, Style, init as colorama_init
 colorama_init()
 
+"""
+Logging of the scraper.
+Every logger made by get_logger shares the same handlers: a colored stdout handler at INFO and a file handler at DEBUG,
+optionally size rotated. With the logging queue enabled, loggers only put records on a bounded queue and a listener
+thread does the formatting and the writes, so the event loop never waits on the disk or the terminal.
+Log calls made once per event pass extra=PER_EVENT and can be sampled and rate limited with EventLogSampler.
+"""
+
+# extra argument of the log calls made for every event, the ones EventLogSampler samples and rate limits
+PER_EVENT = {"per_event": True}
+
 
 class CustomFormatter(logging.Formatter):
 
@@ -20,38 +36,214 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: Fore.LIGHTRED_EX + print_format + Style.RESET_ALL
     }
 
+    def __init__(self):
+        super().__init__()
+        # built once, not for every record
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+        self.default_formatter = logging.Formatter()
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
+
+
+class EventLogSampler(logging.Filter):
+    """
+    Lets through one out of every sample_every per event records of a log call, and at most max_per_second of them
+    each second. The next record let through tells how many were skipped before it
+    """
+    def __init__(self, sample_every=1, max_per_second=0):
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self.lock = threading.Lock()
+        # (logger name, line of the log call) -> records seen, records skipped, (start of the second, records let through)
+        self.seen = {}
+        self.skipped = {}
+        self.windows = {}
+
+    def filter(self, record):
+        if not getattr(record, "per_event", False) or (self.sample_every == 1 and not self.max_per_second):
+            return True
+        key = (record.name, record.lineno)
+        with self.lock:
+            seen = self.seen[key] = self.seen.get(key, 0) + 1
+            if seen % self.sample_every:
+                self.skipped[key] = self.skipped.get(key, 0) + 1
+                return False
+            if self.max_per_second:
+                now = time.monotonic()
+                window_start, count = self.windows.get(key, (now, 0))
+                if now - window_start >= 1:
+                    window_start, count = now, 0
+                if count >= self.max_per_second:
+                    self.skipped[key] = self.skipped.get(key, 0) + 1
+                    return False
+                self.windows[key] = (window_start, count + 1)
+            skipped = self.skipped.pop(key, 0)
+        if skipped:
+            record.msg = "{} ({} similar messages skipped)".format(record.getMessage(), skipped)
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without ever waiting, records are dropped while the queue is full
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        The records are not formatted here as QueueHandler does for queues crossing processes: the listener is a thread
+        of this process, it formats them with its own handlers
+        """
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.msg = "{} ({} log records dropped before this one, logging queue full)".format(
+                record.msg, self.dropped)
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingSetup:
+    """
+    The handlers of the loggers made by get_logger, one set per log file, and how they are configured
+    """
+    DEFAULT_FILE_NAME = 'debug_log.txt'
+    FILE_FORMAT = '%(asctime)s [%(levelname)7s][%(name)s]: %(message)s'
+
+    def __init__(self):
+        self.file_name = self.DEFAULT_FILE_NAME
+        self.max_bytes = 0
+        self.backup_count = 5
+        self.use_queue = False
+        self.queue_size = 10000
+        self.sampler = EventLogSampler()
+        self.lock = threading.RLock()
+        # (file name, use file logger) -> handlers attached to the loggers
+        self.handlers = {}
+        self.listeners = []
+        # loggers made by get_logger with the arguments they were made with
+        self.loggers = []
+
+    def create_handlers(self, file_name, use_file_logger) -> list:
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        stdout_handler.setLevel(logging.INFO)
+        stdout_handler.setFormatter(CustomFormatter())
+        handlers = [stdout_handler]
+
+        if use_file_logger and file_name:
+            if self.max_bytes:
+                file_handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=self.max_bytes,
+                                                                    backupCount=self.backup_count, encoding='utf8')
+            else:
+                file_handler = logging.FileHandler(file_name, encoding='utf8')
+            file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(logging.Formatter(self.FILE_FORMAT))
+            handlers.insert(0, file_handler)
+
+        if not self.use_queue:
+            return handlers
+        log_queue = queue.Queue(maxsize=self.queue_size)
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        self.listeners.append((listener, handlers))
+        return [DroppingQueueHandler(log_queue)]
+
+    def handlers_for(self, file_name, use_file_logger) -> list:
+        key = (file_name or self.file_name, use_file_logger)
+        with self.lock:
+            if key not in self.handlers:
+                self.handlers[key] = self.create_handlers(*key)
+            return self.handlers[key]
+
+    def attach(self, logger, file_name, use_file_logger):
+        logger.setLevel(logging.DEBUG)
+        logger.addFilter(self.sampler)
+        for handler in self.handlers_for(file_name, use_file_logger):
+            logger.addHandler(handler)
+        with self.lock:
+            if all(known_logger is not logger for known_logger, _, _ in self.loggers):
+                self.loggers.append((logger, file_name, use_file_logger))
+
+    def configure(self, file_name=DEFAULT_FILE_NAME, max_bytes=0, backup_count=5, use_queue=False, queue_size=10000,
+                  sample_every=1, max_events_per_second=0):
+        """
+        Changes the logging of the whole process, loggers already made are moved to the new handlers
+        @param file_name: default log file, an empty value only logs to stdout
+        @param max_bytes: size at which the log file is rotated, 0 never rotates it
+        @param backup_count: rotated files kept
+        @param use_queue: format and write records on a listener thread
+        @param queue_size: records waiting for the listener thread, records are dropped above it
+        @param sample_every: only one out of every sample_every per event records is logged
+        @param max_events_per_second: per event records logged per second and log call, 0 does not limit them
+        """
+        with self.lock:
+            self.close()
+            self.file_name = file_name
+            self.max_bytes = max_bytes
+            self.backup_count = backup_count
+            self.use_queue = use_queue
+            self.queue_size = queue_size
+            self.sampler.sample_every = max(1, sample_every)
+            self.sampler.max_per_second = max_events_per_second
+            for logger, logger_file_name, use_file_logger in self.loggers:
+                for handler in self.handlers_for(logger_file_name, use_file_logger):
+                    logger.addHandler(handler)
+
+    def close(self):
+        """
+        Writes out the queued records and closes the handlers
+        """
+        with self.lock:
+            for listener, _ in self.listeners:
+                listener.stop()
+            for handlers in self.handlers.values():
+                for logger, _, _ in self.loggers:
+                    for handler in handlers:
+                        logger.removeHandler(handler)
+                for handler in handlers:
+                    handler.close()
+            for _, handlers in self.listeners:
+                for handler in handlers:
+                    handler.close()
+            self.handlers = {}
+            self.listeners = []
+
+
+LOGGING = LoggingSetup()
+atexit.register(LOGGING.close)
 
 
 def get_logger(name, file_name=None, use_file_logger=True):
 
-    if not file_name:
-        file_name = 'debug_log.txt'
     logger = logging.getLogger(name)
 
     if logger.hasHandlers():
         return logger
 
-    logger.setLevel(logging.DEBUG)
+    LOGGING.attach(logger, file_name, use_file_logger)
 
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setLevel(logging.INFO)
-    stdout_handler.setFormatter(CustomFormatter())
+    return logger
 
-    if use_file_logger:
-        formatter = logging.Formatter('%(asctime)s [%(levelname)7s][%(name)s]: %(message)s')
-        file_handler = logging.FileHandler(file_name, encoding='utf8')
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
 
-        logger.addHandler(file_handler)
+# delay before the second try of a retried call, doubled at every try
+RETRY_BACKOFF_SECONDS = 0.1
+MAX_RETRY_BACKOFF_SECONDS = 5
 
-    logger.addHandler(stdout_handler)
 
-    return logger
+def retry_backoff(attempted_tries):
+    """
+    Waits before the next try of a failed call, the wait doubles with each try so a struggling endpoint is not hammered
+    """
+    time.sleep(min(RETRY_BACKOFF_SECONDS * 2 ** max(attempted_tries - 2, 0), MAX_RETRY_BACKOFF_SECONDS))
 
 
 def validate_address(input_address):
@@ -72,6 +264,8 @@ def endpoint_issue_retry(original_function):
         attempted_tries = 1
         last_exception = None
         while attempted_tries < max_tries:
+            if last_exception is not None:
+                retry_backoff(attempted_tries)
             try:
                 return original_function(self, *args, **kwargs)
             except json.decoder.JSONDecodeError as e:
@@ -105,6 +299,8 @@ def jsonrpc_issue_retry(original_function):
         attempted_tries = 0
 
         while attempted_tries < max_tries:
+            if attempted_tries:
+                retry_backoff(attempted_tries + 1)
             try:
                 return original_function(self, *args, **kwargs)
             except KeyError as e:
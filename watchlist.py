@@ -0,0 +1,229 @@
+from hexbytes import HexBytes
+from web3.types import LogReceipt
+
+from decoding import EventDecoder, find_event_abi
+from eventfilters import EventArgumentFilter
+
+"""
+Compiles the contract-watchlist.json content into a small number of log queries.
+Instead of one eth_newFilter per (contract, event) the watched addresses and the topic0 hashes of the watched events
+are packed in a single filter and every received log is demultiplexed locally back to the contract event it belongs to.
+"""
+
+
+def normalise_block_identifier(value):
+    """
+    Block identifiers in the watchlist are either integers (possibly written as strings) or tags such as "latest"
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def compile_argument_filter(event_abi: dict, event_data: dict):
+    """
+    @param event_data: the watchlist entry of the event
+    @return: the EventArgumentFilter of its "argument_values", None when it has none
+    """
+    argument_values = event_data.get('argument_values')
+    if not argument_values:
+        return None
+    return EventArgumentFilter.for_event(event_abi, argument_values)
+
+
+class WatchedEvent:
+    """
+    A single (contract, event) pair from the watchlist together with the precompiled decoder of its logs and the
+    filter on its argument values, if any
+    """
+    def __init__(self, address, event_name: str, filter_arguments: dict, event_decoder: EventDecoder,
+                 argument_filter: EventArgumentFilter = None):
+        self.address = address
+        self.event_name = event_name
+        self.filter_arguments = filter_arguments
+        self.event_decoder = event_decoder
+        self.argument_filter = argument_filter
+        self.topic0 = HexBytes(event_decoder.topic0)
+
+    @property
+    def key(self):
+        return self.address, self.topic0
+
+    def decode(self, log_entry: LogReceipt) -> dict:
+        """
+        @return: the decoded event as a plain dict, ready to be serialized
+        """
+        return self.event_decoder.decode(log_entry)
+
+    @property
+    def topic_filters(self) -> tuple:
+        """
+        @return: the accepted values of topics 1 to 3, filtered by the node
+        """
+        if self.argument_filter is None:
+            return ()
+        return self.argument_filter.topic_filters
+
+    def matches(self, event: dict) -> bool:
+        """
+        @param event: the decoded event
+        @return: False when the argument values the node could not filter out do not match
+        """
+        return self.argument_filter is None or self.argument_filter.matches(event)
+
+    @property
+    def filters_decoded_arguments(self) -> bool:
+        """
+        @return: True when matches can drop some of the events the node sent
+        """
+        return self.argument_filter is not None and bool(self.argument_filter.tests)
+
+
+class LogQuery:
+    """
+    Groups watched events that share the same argument filters and topic filters so they can be served by one log
+    filter
+    """
+    def __init__(self, argument_filters: dict, topic_filters: tuple = ()):
+        """
+        @param argument_filters: block range of the events
+        @param topic_filters: accepted values of topics 1 to 3 (None for any value), as in WatchedEvent.topic_filters
+        """
+        self.argument_filters = argument_filters
+        self.topic_filters = topic_filters
+        self.watched_events = {}
+        self.address_set = set()
+        # set when a watchlist reload drops the query, its polling loop stops after the current poll
+        self.retired = False
+
+    def add(self, watched_event: WatchedEvent):
+        self.watched_events[watched_event.key] = watched_event
+        self.address_set.add(watched_event.address)
+
+    @property
+    def addresses(self):
+        return sorted(self.address_set)
+
+    @property
+    def key(self) -> tuple:
+        """
+        @return: what the query asks the node and how its logs are decoded and filtered, queries with the same key are
+        interchangeable so a watchlist reload keeps them running
+        """
+        block_range = tuple(sorted((argument, str(value)) for argument, value in self.argument_filters.items()))
+        watched_events = tuple(sorted(
+            (address, bytes(topic0), watched_event.event_name, watched_event.event_decoder.key,
+             watched_event.argument_filter.key if watched_event.argument_filter is not None else "")
+            for (address, topic0), watched_event in self.watched_events.items()))
+        return block_range, self.topic_filters, watched_events
+
+    @property
+    def topics(self):
+        return sorted({topic0.hex() for _, topic0 in self.watched_events})
+
+    @property
+    def historical_range(self):
+        """
+        @return: (fromBlock, toBlock) when both are given as block numbers, None for ranges following the chain head
+        """
+        from_block = normalise_block_identifier(self.argument_filters.get('fromBlock', 'latest'))
+        to_block = normalise_block_identifier(self.argument_filters.get('toBlock', 'latest'))
+        if isinstance(from_block, int) and isinstance(to_block, int):
+            return from_block, to_block
+        return None
+
+    def filter_params(self) -> dict:
+        """
+        @return: the filter parameters as accepted by eth_newFilter/eth_getLogs
+        """
+        params = {
+            "address": self.addresses,
+            "topics": [self.topics] + [None if accepted is None else list(accepted) for accepted in self.topic_filters]
+        }
+        for argument, value in self.argument_filters.items():
+            params[argument] = normalise_block_identifier(value)
+        return params
+
+    def demultiplex(self, log_entry: LogReceipt):
+        """
+        Finds the watched event a received log belongs to. As the query is a cross product of addresses and topics,
+        logs of a watched address with a topic watched only on another address are received and need to be dropped.
+        @param log_entry: formatted log entry (checksum address, HexBytes topics)
+        @return: the matching WatchedEvent or None if the log is not watched
+        """
+        if not log_entry['topics']:
+            return None
+        return self.watched_events.get((log_entry['address'], HexBytes(log_entry['topics'][0])))
+
+
+class WatchlistIndex:
+    """
+    Index over all contract events in the watchlist, able to compile them into consolidated log queries
+    """
+    def __init__(self, web3, contract_watchlist: dict, blockchain: str, abi_cache=None):
+        """
+        @param abi_cache: AbiCache the event ABIs are looked up in instead of parsing the contract ABIs
+        @raise ValueError: for a contract event listed twice with different argument values. Its log queries,
+        checkpoints and duplicate detection only know the contract event, one of the two would be lost
+        """
+        self.watched_events = []
+        # WatchedEvent.key -> argument filter key of the first entry of the contract event
+        argument_filter_keys = {}
+        for contract_data in contract_watchlist['contracts']:
+            address = web3.toChecksumAddress(contract_data['address'])
+            if contract_data['blockchain'] != blockchain:
+                raise ValueError("Chain {} is not supported for smart contract {}!".format(
+                    contract_data['blockchain'], address))
+            # only the ABI entries of the listened events are compiled, the rest of the ABI is never looked at again
+            for event_name, event_data in contract_data['events_to_listen'].items():
+                if abi_cache is not None:
+                    event_abi = abi_cache.find_event_abi(contract_data['abi'], event_name)
+                else:
+                    event_abi = find_event_abi(contract_data['abi'], event_name)
+                watched_event = WatchedEvent(address=address,
+                                             event_name=event_name,
+                                             filter_arguments=event_data['argument_filters'],
+                                             event_decoder=EventDecoder.for_abi(event_abi),
+                                             argument_filter=compile_argument_filter(event_abi, event_data))
+                argument_filter_key = watched_event.argument_filter.key if watched_event.argument_filter else ""
+                if argument_filter_keys.setdefault(watched_event.key, argument_filter_key) != argument_filter_key:
+                    raise ValueError("Event {} of smart contract {} is listed twice with different argument_values, "
+                                     "they have to be combined in one entry".format(event_name, address))
+                self.watched_events.append(watched_event)
+
+    def single_event_queries(self) -> list:
+        """
+        @return: one LogQuery per watched event, as polled without consolidation
+        """
+        queries = []
+        for watched_event in self.watched_events:
+            query = LogQuery(watched_event.filter_arguments, watched_event.topic_filters)
+            query.add(watched_event)
+            queries.append(query)
+        return queries
+
+    def compile_log_queries(self, max_addresses_per_query: int) -> list:
+        """
+        Packs the watched events into as few log queries as possible. Events are grouped by their argument filters
+        and topic filters, and a group is split when it would exceed max_addresses_per_query addresses, as providers
+        limit the filter size
+        @param max_addresses_per_query: maximum number of addresses in one query
+        @return: list of LogQuery
+        """
+        queries = []
+        open_queries = {}
+        for watched_event in self.watched_events:
+            block_range = tuple(sorted((argument, str(value))
+                                       for argument, value in watched_event.filter_arguments.items()))
+            group = (block_range, watched_event.topic_filters)
+            query = open_queries.get(group)
+            if query is not None and watched_event.address not in query.address_set and \
+                    len(query.address_set) >= max_addresses_per_query:
+                query = None
+            if query is None:
+                query = LogQuery(watched_event.filter_arguments, watched_event.topic_filters)
+                open_queries[group] = query
+                queries.append(query)
+            query.add(watched_event)
+        return queries
@@ -1,5 +1,16 @@
+import asyncio
+import copy
+from typing import List
+
 from web3 import Web3
 from web3.middleware import geth_poa_middleware  # Needed for Binance Smart Chain
+from web3.contract import LogFilter
+from web3.types import LogReceipt
+from web3._utils.method_formatters import log_entry_formatter, block_formatter
+from web3._utils.rpc_abi import RPC
+
+from rpc import AsyncJsonRpcClient
+from rpcpool import RpcEndpointPool, FilterEndpointUnavailable
 from utils import get_logger, endpoint_issue_retry, jsonrpc_issue_retry
 
 
@@ -13,6 +24,19 @@ class Blockchains:
     BINANCE_SMART_CHAIN_TESTNET = "bsc-testnet"
     ETHEREUM_RINKEBY_TESTNET = 'ethereum-rinkey-testnet'
 
+    # how often the chain head is checked for new blocks, a fraction of each chain's block time
+    HEAD_POLL_INTERVAL_SECONDS = {
+        ETHEREUM: 1.0,
+        BINANCE_SMART_CHAIN: 0.5,
+        FANTOM: 0.5,
+        CRONOS: 1.0,
+        AVALANCHE: 0.5,
+    }
+
+
+# fragments of the error messages nodes use for unknown filter ids
+FILTER_NOT_FOUND_MARKERS = ("not found", "does not exist", "unknown filter", "not exist")
+
 
 class Web3Interface:
 
@@ -23,7 +47,15 @@ class Web3Interface:
                              # Blockchains.AVALANCHE
                              ]
 
-    def __init__(self, blockchain, endpoint, is_test_net=False):
+    def __init__(self, blockchain, endpoint, is_test_net=False,
+                 max_concurrent_requests=AsyncJsonRpcClient.MAX_CONCURRENT_REQUESTS,
+                 connection_pool_size=AsyncJsonRpcClient.CONNECTION_POOL_SIZE,
+                 batch_window=AsyncJsonRpcClient.BATCH_WINDOW_SECONDS,
+                 max_batch_size=AsyncJsonRpcClient.MAX_BATCH_SIZE,
+                 fallback_endpoints=(),
+                 max_attempts=RpcEndpointPool.MAX_ATTEMPTS,
+                 hedge_requests=False,
+                 hedge_percentile=RpcEndpointPool.HEDGE_PERCENTILE):
         if blockchain not in Web3Interface.SUPPORTED_BLOCKCHAINS:
             raise ValueError("Blockchain {} not supported. Currently supported are: {}".format(
                 blockchain, Web3Interface.SUPPORTED_BLOCKCHAINS))
@@ -34,10 +66,25 @@ class Web3Interface:
 
         self.endpoint = endpoint
 
+        # the synchronous web3 object is used for setup (contracts, filter creation), the polling path goes through
+        # the asynchronous transport when the endpoint is HTTP based
+        self.async_rpc = None
         if self.endpoint.startswith("ws"):
             self.web3 = Web3(Web3.WebsocketProvider(self.endpoint))
         else:
             self.web3 = Web3(Web3.HTTPProvider(self.endpoint))
+            # filters are created on the primary endpoint, the other HTTP endpoints take over the stateless requests
+            # when it is slow or failing and the filters when it is put aside
+            endpoints = [self.endpoint] + [fallback for fallback in fallback_endpoints
+                                           if fallback.startswith("http") and fallback != self.endpoint]
+            clients = [AsyncJsonRpcClient(rpc_endpoint,
+                                          max_concurrent_requests=max_concurrent_requests,
+                                          connection_pool_size=connection_pool_size,
+                                          batch_window=batch_window,
+                                          max_batch_size=max_batch_size)
+                       for rpc_endpoint in endpoints]
+            self.async_rpc = RpcEndpointPool(clients, max_attempts=max_attempts, hedge_requests=hedge_requests,
+                                             hedge_percentile=hedge_percentile)
 
         if blockchain == Blockchains.BINANCE_SMART_CHAIN:
             self.web3.middleware_onion.inject(geth_poa_middleware, layer=0)
@@ -61,3 +108,126 @@ class Web3Interface:
         self.logger.error(message)
 
         raise Exception(message)
+
+    @staticmethod
+    def is_filter_not_found(error: Exception) -> bool:
+        """
+        Nodes drop filters that are not polled for a while, or lose them when a load balancer switches backend
+        @return: True if the error is the node reporting an unknown filter id, or the endpoint of the filter being put
+        aside
+        """
+        if isinstance(error, FilterEndpointUnavailable):
+            return True
+        message = str(error).lower()
+        return "filter" in message and any(marker in message for marker in FILTER_NOT_FOUND_MARKERS)
+
+    def new_log_filter(self, filter_params: dict) -> LogFilter:
+        """
+        Same as web3.eth.filter(filter_params), the parameters are kept on the filter so that it can be created again
+        """
+        log_filter = self.web3.eth.filter(filter_params)
+        log_filter.filter_params = filter_params
+        return log_filter
+
+    async def create_filter(self, create_filter, log_filter: LogFilter = None) -> LogFilter:
+        """
+        Creates a log filter without blocking the event loop
+        @param create_filter: function creating the filter with the synchronous web3 object (createFilter or
+        new_log_filter)
+        @param log_filter: a filter made before by create_filter, to create again in place of a dropped one. On the
+        asynchronous transport a copy of it is installed through the endpoint pool: on the primary endpoint, or on a
+        healthy one while the primary is put aside
+        """
+        if self.async_rpc is None or log_filter is None or log_filter.filter_params is None:
+            return await asyncio.get_running_loop().run_in_executor(None, create_filter)
+        params = dict(log_filter.filter_params)
+        for block_key in ('fromBlock', 'toBlock'):
+            if isinstance(params.get(block_key), int):
+                params[block_key] = hex(params[block_key])
+        new_filter = copy.copy(log_filter)
+        new_filter.filter_id = await self.async_rpc.make_request(RPC.eth_newFilter, [params])
+        return new_filter
+
+    async def get_new_entries(self, log_filter: LogFilter, decode=True) -> List[LogReceipt]:
+        """
+        Asynchronous equivalent of log_filter.get_new_entries(), it does not block the event loop while waiting
+        for the RPC endpoint so that all filters can be polled concurrently
+        @param log_filter: a filter created with createFilter or web3.eth.filter
+        @param decode: False to skip the decoding done by contract event filters, for callers with their own decoder
+        @return: the formatted (and, for contract event filters, decoded) new log entries
+        """
+        if self.async_rpc is None:
+            if decode:
+                return await asyncio.get_running_loop().run_in_executor(None, log_filter.get_new_entries)
+            log_entries = await asyncio.get_running_loop().run_in_executor(
+                None, self.web3.eth.get_filter_changes, log_filter.filter_id)
+        else:
+            raw_entries = await self.async_rpc.make_request(RPC.eth_getFilterChanges, [log_filter.filter_id])
+            log_entries = [log_entry_formatter(raw_entry) for raw_entry in raw_entries or []]
+        log_entries = [log_entry for log_entry in log_entries if log_filter.is_valid_entry(log_entry)]
+        if not decode:
+            return log_entries
+        return [log_filter.format_entry(log_entry) for log_entry in log_entries]
+
+    async def uninstall_filter(self, log_filter: LogFilter) -> bool:
+        """
+        Removes a filter that is no longer polled from the node
+        @return: False when the node did not know the filter
+        """
+        if self.async_rpc is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.web3.eth.uninstall_filter,
+                                                                    log_filter.filter_id)
+        return await self.async_rpc.make_request(RPC.eth_uninstallFilter, [log_filter.filter_id])
+
+    async def get_logs(self, filter_params: dict) -> List[LogReceipt]:
+        """
+        Asynchronous eth_getLogs, integer block numbers in filter_params are sent as hex quantities
+        @return: the formatted log entries
+        """
+        if self.async_rpc is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.web3.eth.get_logs, filter_params)
+
+        params = dict(filter_params)
+        for block_key in ('fromBlock', 'toBlock'):
+            if isinstance(params.get(block_key), int):
+                params[block_key] = hex(params[block_key])
+        raw_entries = await self.async_rpc.make_request(RPC.eth_getLogs, [params])
+        return [log_entry_formatter(raw_entry) for raw_entry in raw_entries]
+
+    async def get_block_number(self) -> int:
+        if self.async_rpc is None:
+            return await asyncio.get_running_loop().run_in_executor(None, lambda: self.web3.eth.block_number)
+        return int(await self.async_rpc.make_request(RPC.eth_blockNumber, []), 16)
+
+    async def get_block(self, block_number: int, full_transactions=False):
+        """
+        Asynchronous block lookup, concurrent lookups are coalesced in one batch when batching is enabled
+        @return: the formatted block or None if the node does not know it yet
+        """
+        if self.async_rpc is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.web3.eth.get_block, block_number, full_transactions)
+        block = await self.async_rpc.make_request(RPC.eth_getBlockByNumber, [hex(block_number), full_transactions])
+        return block_formatter(block) if block is not None else None
+
+    async def make_batch_request(self, calls: list) -> list:
+        """
+        Sends several requests at once, as one JSON-RPC batch on the asynchronous transport
+        @param calls: list of (method, params)
+        @return: the raw results in the order of the calls, a ValueError in place of the result of a failed call
+        """
+        if self.async_rpc is not None:
+            return await self.async_rpc.make_batch_request(calls)
+
+        def make_request(method, params):
+            response = self.web3.provider.make_request(method, params)
+            if "error" in response:
+                return ValueError(response["error"])
+            return response["result"]
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[loop.run_in_executor(None, make_request, method, params)
+                                      for method, params in calls])
+
+    async def close(self):
+        if self.async_rpc is not None:
+            await self.async_rpc.close()